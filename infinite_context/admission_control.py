@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+审核请求准入控制 - 按队列深度和预估 token 负载拒绝超出处理能力的请求
+"""
+
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from deployment_config import LongContextConfig
+from task_queue import TaskQueue
+
+
+@dataclass
+class AdmissionDecision:
+    """准入结果（拒绝时 retry_after 为建议的重试等待秒数）"""
+
+    admitted: bool
+    priority: bool
+    retry_after: int = 0
+    reason: str = ""
+
+
+class AdmissionController:
+    """审核作业准入控制
+
+    未完成负载（排队中和执行中的作业）从任务队列读取，多个 API 进程共享
+    同一视图。限制有两项：工作流的未完成作业数不超过其 max_concurrent 乘以
+    queue_factor，全部作业的预估 token 总量不超过 max_pending_tokens。
+    小的单个审核走优先通道：上限放宽 priority_headroom，领取时排在普通作业
+    之前，大批量任务占满队列时仍可提交并尽快执行。
+
+    检查与入队之间没有加锁，并发提交时上限可能被少量超出。
+    """
+
+    def __init__(
+        self,
+        task_queue: TaskQueue,
+        queue_factor: int = 8,
+        max_pending_tokens: int = 20000000,
+        priority_max_tokens: int = 50000,
+        priority_headroom: float = 0.25,
+        min_retry_after_seconds: int = 1,
+        max_retry_after_seconds: int = 300,
+    ):
+        self.task_queue = task_queue
+        self.queue_factor = queue_factor
+        self.max_pending_tokens = max_pending_tokens
+        self.priority_max_tokens = priority_max_tokens
+        self.priority_headroom = priority_headroom
+        self.min_retry_after_seconds = min_retry_after_seconds
+        self.max_retry_after_seconds = max_retry_after_seconds
+        # 没有实测数据时按各模型预估耗时的均值估算排空时间
+        models = LongContextConfig.MODELS.values()
+        self.seconds_per_1k_tokens = sum(
+            model["latency_per_1k_tokens"] for model in models
+        ) / len(models)
+
+    @classmethod
+    def from_config(
+        cls, task_queue: TaskQueue, settings: Optional[Dict[str, Any]] = None
+    ) -> Optional["AdmissionController"]:
+        """按 LongContextConfig.ADMISSION_CONTROL 创建，未启用时返回 None"""
+        settings = settings or LongContextConfig.ADMISSION_CONTROL
+        if not settings["enabled"]:
+            return None
+        return cls(
+            task_queue,
+            settings["queue_factor"],
+            settings["max_pending_tokens"],
+            settings["priority_max_tokens"],
+            settings["priority_headroom"],
+            settings["min_retry_after_seconds"],
+            settings["max_retry_after_seconds"],
+        )
+
+    def admit(
+        self, workflow_id: str, estimated_tokens: int, kind: str = "single"
+    ) -> AdmissionDecision:
+        """判断预估 estimated_tokens 的作业能否提交到 workflow_id"""
+        priority = kind == "single" and estimated_tokens <= self.priority_max_tokens
+        scale = 1 + self.priority_headroom if priority else 1
+        load = self.task_queue.pending_load()
+
+        max_concurrent = LongContextConfig.get_max_concurrent(workflow_id)
+        workflow = load.get(workflow_id, {"jobs": 0, "tokens": 0})
+        job_limit = math.floor(max_concurrent * self.queue_factor * scale)
+        if workflow["jobs"] >= job_limit:
+            # 需要先完成的作业数 × 该工作流作业的平均 token 数
+            average_tokens = workflow["tokens"] / workflow["jobs"] or estimated_tokens
+            excess_tokens = (workflow["jobs"] - job_limit + 1) * average_tokens
+            return AdmissionDecision(
+                False,
+                priority,
+                self._retry_after(excess_tokens, max_concurrent),
+                f"工作流未完成作业数已达上限 {job_limit}",
+            )
+
+        pending_tokens = sum(counts["tokens"] for counts in load.values())
+        token_limit = self.max_pending_tokens * scale
+        # 单个作业超过上限时只要求队列为空，避免永远无法提交
+        if pending_tokens and pending_tokens + estimated_tokens > token_limit:
+            total_concurrent = sum(
+                workflow["max_concurrent"]
+                for workflow in LongContextConfig.DIFY_WORKFLOWS.values()
+            )
+            return AdmissionDecision(
+                False,
+                priority,
+                self._retry_after(
+                    pending_tokens + estimated_tokens - token_limit, total_concurrent
+                ),
+                f"未完成作业的预估 token 总量已达上限 {int(token_limit)}",
+            )
+
+        return AdmissionDecision(True, priority)
+
+    def _retry_after(self, excess_tokens: float, concurrency: int) -> int:
+        """以 concurrency 路并发处理完 excess_tokens 的预估秒数"""
+        seconds = excess_tokens / 1000 * self.seconds_per_1k_tokens / concurrency
+        return int(
+            min(
+                self.max_retry_after_seconds,
+                max(self.min_retry_after_seconds, math.ceil(seconds)),
+            )
+        )
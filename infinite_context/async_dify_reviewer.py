@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Dify 长上下文合同审核工作流 - 异步版本（共享长连接客户端）
+"""
+
+import asyncio
+import importlib.util
+import inspect
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+import httpx
+
+from clause_dedup import ClauseIndex
+from clause_search import ClauseSearchIndex
+from contract_cache import ContractCache
+from deployment_config import LongContextConfig
+from model_router import ModelRouter
+from response_cache import WorkflowResponseCache
+from dify_contract_reviewer import ContractReviewerBase, ProgressCallback
+
+# 安装 h2 时启用 HTTP/2，否则退回 HTTP/1.1 长连接
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class AsyncDifyLongContextContractReviewer(ContractReviewerBase):
+    """异步 Dify 长上下文合同审核器
+
+    所有请求复用同一个 httpx.AsyncClient 连接池，不阻塞事件循环；
+    文档解析等 CPU 密集步骤放到线程池执行。请求构建和结果组装与同步版本
+    共用 ContractReviewerBase，不继承同步版本的审核接口。
+    """
+
+    def __init__(
+        self,
+        dify_api_base: str,
+        api_key: str,
+        cache: Optional[ContractCache] = None,
+        response_cache: Optional[WorkflowResponseCache] = None,
+        clause_index: Optional[ClauseIndex] = None,
+        model_router: Optional[ModelRouter] = None,
+        search_index: Optional[ClauseSearchIndex] = None,
+    ):
+        super().__init__(
+            dify_api_base,
+            api_key,
+            cache=cache,
+            response_cache=response_cache,
+            clause_index=clause_index,
+            model_router=model_router,
+            search_index=search_index,
+        )
+        settings = self.http_settings
+        # 所有请求都发往同一个 Dify 主机，连接池上限即单主机连接上限
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            http2=settings["http2"] and HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=settings["max_connections"],
+                max_keepalive_connections=settings["max_keepalive_connections"],
+                keepalive_expiry=settings["keepalive_expiry_seconds"],
+            ),
+            timeout=httpx.Timeout(
+                settings["timeout_seconds"],
+                connect=settings["connect_timeout_seconds"],
+            ),
+        )
+        self._async_workflow_limits = {}
+        # 进行中的请求（缓存键 -> Future），相同请求并发时只调用一次
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _async_workflow_limit(self, workflow_id: str) -> asyncio.Semaphore:
+        """获取工作流的异步并发信号量（同一审核器的所有请求共享）"""
+        if workflow_id not in self._async_workflow_limits:
+            self._async_workflow_limits[workflow_id] = asyncio.Semaphore(
+                LongContextConfig.get_max_concurrent(workflow_id)
+            )
+        return self._async_workflow_limits[workflow_id]
+
+    async def aclose(self):
+        """关闭连接池和进程池，写入尚未落盘的响应缓存计数"""
+        await self.client.aclose()
+        await asyncio.to_thread(self.processor.close)
+        if self.response_cache is not None:
+            await asyncio.to_thread(self.response_cache.flush_counters)
+
+    async def review_single_contract(
+        self,
+        file_path: str,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """审核单个合同，progress_callback 可以是普通函数或协程函数"""
+        started = time.perf_counter()
+        contract = await asyncio.to_thread(self.processor.process_contract, file_path)
+        await self._areport(progress_callback, self._extraction_event(contract))
+        result = await self._review_processed_contract(
+            contract, file_path, workflow_id, progress_callback
+        )
+        return self._record_review(workflow_id, started, result)
+
+    async def _review_processed_contract(
+        self,
+        contract,
+        file_path: str,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        if not contract.metadata["can_fit_in_context"]:
+            if self.section_retriever is not None:
+                return await self._review_large_contract_by_retrieval(
+                    contract, workflow_id, progress_callback
+                )
+            return await self._review_large_contract_in_chunks(
+                contract, workflow_id, progress_callback
+            )
+
+        response = await self._call_dify_workflow(
+            workflow_id, self._single_review_request(contract, file_path)
+        )
+
+        return self._single_review_result(contract, file_path, response)
+
+    async def review_multiple_contracts(
+        self,
+        file_paths: List[str],
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """批量审核多个合同：按上下文长度装箱分组，各组并发审核后汇总"""
+        started = time.perf_counter()
+        contracts = await asyncio.to_thread(
+            self.processor.process_contracts, file_paths
+        )
+        groups = await asyncio.to_thread(
+            self.batch_scheduler.plan, file_paths, contracts
+        )
+        await self._areport(
+            progress_callback, self._batch_extraction_event(contracts, groups)
+        )
+
+        if len(groups) == 1:
+            return self._record_review(
+                workflow_id,
+                started,
+                await self._review_group(workflow_id, file_paths, contracts),
+            )
+
+        fan_out = asyncio.Semaphore(LongContextConfig.get_max_concurrent(workflow_id))
+        completed = 0
+
+        async def review_group(group: List[int]) -> Dict[str, Any]:
+            nonlocal completed
+            async with fan_out:
+                result = await self._review_group(
+                    workflow_id,
+                    [file_paths[i] for i in group],
+                    [contracts[i] for i in group],
+                )
+            completed += 1
+            await self._areport(
+                progress_callback,
+                self._item_reviewed_event("group_reviewed", completed, len(groups)),
+            )
+            return result
+
+        results = await asyncio.gather(*(review_group(group) for group in groups))
+
+        await self._areport(progress_callback, self._summary_event())
+        summary_response = await self._reduce_summaries(
+            workflow_id, "batch_summary", self._group_summary_blocks(results)
+        )
+
+        return self._record_review(
+            workflow_id,
+            started,
+            self._scheduled_batch_result(results, summary_response),
+        )
+
+    async def _review_group(
+        self, workflow_id: str, file_paths: List[str], contracts: List
+    ) -> Dict[str, Any]:
+        """审核一组合同：单个合同按单独审核处理，多个合同合并为一次请求"""
+        if len(contracts) == 1:
+            return await self._review_processed_contract(
+                contracts[0], file_paths[0], workflow_id
+            )
+        combined_contract = await asyncio.to_thread(
+            self.processor.combine_processed_contracts, file_paths, contracts
+        )
+        response = await self._call_dify_workflow(
+            workflow_id, self._combined_review_request(combined_contract, file_paths)
+        )
+        return self._combined_review_result(combined_contract, file_paths, response)
+
+    async def _review_large_contract_in_chunks(
+        self,
+        contract,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """分块处理大型合同"""
+        # 按模型 token 预算打包章节，减少调用次数
+        chunks = await asyncio.to_thread(self._pack_sections, contract)
+        await self._areport(progress_callback, self._chunking_event(chunks))
+
+        # 与已审核内容近似重复的分块复用原结果或只审核差异
+        lookups = await asyncio.to_thread(
+            self._find_reviewed_chunks, workflow_id, chunks
+        )
+
+        # 各分块并发审核，并发数受工作流 max_concurrent 限制；请求体在获得
+        # 并发名额后才构建，gather 保持分块顺序，最后一个分块完成后立即开始总结
+        fan_out = asyncio.Semaphore(LongContextConfig.get_max_concurrent(workflow_id))
+
+        completed = 0
+
+        async def review_chunk(chunk, lookup) -> Dict[str, Any]:
+            nonlocal completed
+            async with fan_out:
+                response = await self._review_chunk(workflow_id, chunk, lookup)
+            completed += 1
+            await self._areport(
+                progress_callback,
+                self._item_reviewed_event("chunk_reviewed", completed, len(chunks)),
+            )
+            return response
+
+        responses = await asyncio.gather(
+            *(review_chunk(chunk, lookup) for chunk, lookup in zip(chunks, lookups))
+        )
+
+        chunk_reviews = [
+            self._chunk_review_entry(chunk, response, match)
+            for chunk, response, (_, match) in zip(chunks, responses, lookups)
+        ]
+
+        await self._areport(progress_callback, self._summary_event())
+        summary_response = await self._reduce_summaries(
+            workflow_id, "chunk_summary", self._chunk_summary_blocks(chunk_reviews)
+        )
+
+        return self._chunk_review_result(contract, chunk_reviews, summary_response)
+
+    async def _review_large_contract_by_retrieval(
+        self,
+        contract,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """检索模式审核大型合同：每个审核项只审核检索出的相关章节"""
+        selections = await asyncio.to_thread(
+            self._retrieve_checklist_sections, contract
+        )
+        await self._areport(progress_callback, self._retrieval_event(selections))
+
+        items = [item for item, units in selections.items() if units]
+        fan_out = asyncio.Semaphore(LongContextConfig.get_max_concurrent(workflow_id))
+        completed = 0
+
+        async def review_item(item: str) -> Dict[str, Any]:
+            nonlocal completed
+            async with fan_out:
+                response = await self._call_dify_workflow(
+                    workflow_id, self._checklist_review_request(item, selections[item])
+                )
+            completed += 1
+            await self._areport(
+                progress_callback,
+                self._item_reviewed_event(
+                    "checklist_item_reviewed", completed, len(items)
+                ),
+            )
+            return response
+
+        responses = dict(
+            zip(items, await asyncio.gather(*(review_item(item) for item in items)))
+        )
+
+        item_reviews = [
+            self._checklist_review_entry(item, units, responses.get(item))
+            for item, units in selections.items()
+        ]
+
+        await self._areport(progress_callback, self._summary_event())
+        summary_response = await self._reduce_summaries(
+            workflow_id, "chunk_summary", self._checklist_summary_blocks(item_reviews)
+        )
+
+        return self._retrieval_review_result(
+            contract, selections, item_reviews, summary_response
+        )
+
+    async def _review_chunk(
+        self, workflow_id: str, chunk, lookup: Tuple
+    ) -> Dict[str, Any]:
+        """审核单个分块：近似重复时复用原结果或只审核差异，完整审核后加入索引"""
+        signature, match = lookup
+        if self._is_reusable(match):
+            return match.review
+        if match is not None:
+            return await self._call_dify_workflow(
+                workflow_id, self._chunk_diff_review_request(chunk, match)
+            )
+        response = await self._call_dify_workflow(
+            workflow_id, self._chunk_review_request(chunk)
+        )
+        await asyncio.to_thread(
+            self._index_chunk_review, workflow_id, chunk, signature, response
+        )
+        return response
+
+    async def _reduce_summaries(
+        self, workflow_id: str, review_type: str, blocks: List[str]
+    ) -> Dict[str, Any]:
+        """分层归并总结，同一层的各组并发总结"""
+        batches = await asyncio.to_thread(self.summary_reducer.plan, blocks)
+        level = 0
+        while len(batches) > 1:
+            level += 1
+            responses = await asyncio.gather(
+                *(
+                    self._call_dify_workflow(workflow_id, request)
+                    for request in self._partial_summary_requests(
+                        review_type, batches, level
+                    )
+                )
+            )
+            batches = await asyncio.to_thread(
+                self.summary_reducer.plan,
+                self._partial_summary_blocks(level, responses),
+            )
+
+        return await self._call_dify_workflow(
+            workflow_id, self._summary_request(review_type, batches[0])
+        )
+
+    @staticmethod
+    async def _areport(
+        progress_callback: Optional[ProgressCallback], event: Dict[str, Any]
+    ):
+        if progress_callback is not None:
+            result = progress_callback(event)
+            if inspect.isawaitable(result):
+                await result
+
+    async def _call_dify_workflow(
+        self, workflow_id: str, data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """调用 Dify 工作流 API，优先使用响应缓存并合并并发的相同请求"""
+        model = self._route(data)
+        cache_key = self._response_cache_key(workflow_id, data, model)
+        if cache_key is None:
+            return await self._post_routed(workflow_id, data, model)
+
+        cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(cache_key)
+        if pending is not None:
+            await asyncio.wait({pending})
+            if not pending.cancelled():
+                await asyncio.to_thread(self.response_cache.record, "coalesced")
+                return pending.result()
+            # 发起请求的协程被取消时自行重新请求
+            return await self._call_dify_workflow(workflow_id, data)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await self._post_routed(workflow_id, data, model)
+            if self._is_cacheable(result):
+                await asyncio.to_thread(self.response_cache.set, cache_key, result)
+            future.set_result(result)
+            return result
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._inflight[cache_key]
+
+    async def _post_routed(
+        self, workflow_id: str, data: Dict[str, Any], model: Optional[str]
+    ) -> Dict[str, Any]:
+        """发送到路由选择的模型（None 为工作流默认模型），并记录耗时和结果"""
+        token_count = self._prompt_token_count(data)
+        if model is None:
+            return await self._post_workflow(workflow_id, data)
+        self.model_router.begin(model)
+        started, result = time.perf_counter(), None
+        try:
+            result = await self._post_workflow(
+                workflow_id, self._with_model(data, model)
+            )
+            return result
+        finally:
+            self._finish_route(model, token_count, started, result)
+
+    async def _post_workflow(
+        self, workflow_id: str, data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        queued = sent = time.perf_counter()
+        result = None
+        try:
+            async with self._async_workflow_limit(workflow_id):
+                sent = time.perf_counter()
+                response = await self.client.post(
+                    self._workflow_url(workflow_id), content=self._encode_body(data)
+                )
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as e:
+            result = {"error": str(e), "status": "failed"}
+        finally:
+            self._record_request(workflow_id, queued, sent, result)
+        return result
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+批量审核分组 - 将一批合同装箱为尽量少的合并审核请求
+"""
+
+import bisect
+from typing import List
+
+from contract_processor import ContractDocument, LongContextContractProcessor
+from deployment_config import LongContextConfig
+
+# 文档拼接处 token 合并可能带来的计数偏差
+JUNCTION_SLACK_TOKENS = 4
+
+
+class BatchScheduler:
+    """按模型上下文对批量合同分组
+
+    每个合同的占用为正文 token 数加文档分隔符，按占用从大到小依次放入
+    剩余容量最小且放得下的组（Best-Fit Decreasing），组数不超过最优解的
+    11/9 倍加常数。超过 token_budget 的合同单独成组，由分块审核处理。
+    """
+
+    def __init__(self, processor: LongContextContractProcessor, token_budget: int):
+        self.processor = processor
+        self.token_budget = token_budget
+
+    @classmethod
+    def for_model(
+        cls, processor: LongContextContractProcessor, model_name: str
+    ) -> "BatchScheduler":
+        """模型上下文长度扣除为审核提示词和输出预留的部分"""
+        context = processor.max_context_length.get(model_name, 128000)
+        reserve = LongContextConfig.BATCH_SCHEDULING["prompt_reserve_tokens"]
+        return cls(processor, context - reserve)
+
+    def plan(
+        self, file_paths: List[str], contracts: List[ContractDocument]
+    ) -> List[List[int]]:
+        """返回各组的合同下标，组内和组间均保持原顺序"""
+        sizes = [
+            contract.token_count
+            + self.processor.count_tokens(
+                self.processor.document_header(len(file_paths), file_path)
+            )
+            + JUNCTION_SLACK_TOKENS
+            for file_path, contract in zip(file_paths, contracts)
+        ]
+
+        groups: List[List[int]] = []
+        # (剩余容量, 组号)，按剩余容量升序
+        free: List[tuple] = []
+        for index in sorted(range(len(sizes)), key=lambda i: sizes[i], reverse=True):
+            size = sizes[index]
+            if size > self.token_budget:
+                groups.append([index])
+                continue
+            position = bisect.bisect_left(free, (size, -1))
+            if position == len(free):
+                groups.append([index])
+                bisect.insort(free, (self.token_budget - size, len(groups) - 1))
+                continue
+            remaining, group = free.pop(position)
+            groups[group].append(index)
+            bisect.insort(free, (remaining - size, group))
+
+        return sorted(sorted(group) for group in groups)
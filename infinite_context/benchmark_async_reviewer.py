@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+异步审核器基准 - 在本地模拟 Dify 服务上测量吞吐量和事件循环延迟
+
+对比两种方式：
+- 同步审核器直接在协程中调用（原 contract_api 的做法，会阻塞事件循环）
+- 异步审核器在共享连接池上并发审核
+
+用法: python benchmark_async_reviewer.py --concurrency 100 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from async_dify_reviewer import AsyncDifyLongContextContractReviewer
+from dify_contract_reviewer import DifyLongContextContractReviewer
+from mock_dify_server import run_server_in_thread
+
+WORKFLOW_ID = "benchmark-workflow"
+
+
+async def monitor_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> List[float]:
+    """周期性休眠并记录实际唤醒延迟，反映事件循环被阻塞的程度"""
+    lags = []
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(loop.time() - expected, 0.0))
+    return lags
+
+
+def summarize(
+    name: str, reviews: int, elapsed: float, lags: List[float]
+) -> Dict[str, Any]:
+    ordered = sorted(lags) or [0.0]
+    return {
+        "name": name,
+        "reviews": reviews,
+        "elapsed_seconds": elapsed,
+        "reviews_per_second": reviews / elapsed if elapsed else 0.0,
+        "loop_lag_p50_ms": ordered[len(ordered) // 2] * 1000,
+        "loop_lag_max_ms": ordered[-1] * 1000,
+    }
+
+
+async def run_async_reviews(
+    base_url: str, file_path: str, concurrency: int
+) -> Dict[str, Any]:
+    reviewer = AsyncDifyLongContextContractReviewer(base_url, "benchmark-key")
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(stop))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            reviewer.review_single_contract(file_path, WORKFLOW_ID)
+            for _ in range(concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = await monitor
+    await reviewer.aclose()
+
+    failed = sum(1 for result in results if "error" in result["review_result"])
+    summary = summarize("async", concurrency, elapsed, lags)
+    summary["failed"] = failed
+    return summary
+
+
+async def run_blocking_reviews(
+    base_url: str, file_path: str, reviews: int
+) -> Dict[str, Any]:
+    reviewer = DifyLongContextContractReviewer(base_url, "benchmark-key")
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(monitor_loop_lag(stop))
+
+    async def review():
+        # 与原后台任务相同：在协程中直接调用同步审核器
+        return reviewer.review_single_contract(file_path, WORKFLOW_ID)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(review() for _ in range(reviews)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    lags = await monitor
+    reviewer.close()
+    return summarize("blocking", reviews, elapsed, lags)
+
+
+async def main(args: argparse.Namespace):
+    stop_server = run_server_in_thread(port=args.port, latency_seconds=args.latency)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    with tempfile.NamedTemporaryFile(
+        "w", suffix=".txt", delete=False, encoding="utf-8"
+    ) as f:
+        f.write("第一条 甲方应按约定支付服务费用。\n第二条 乙方应按期交付成果。\n")
+        file_path = f.name
+
+    try:
+        results = [await run_async_reviews(base_url, file_path, args.concurrency)]
+        if args.blocking_reviews:
+            results.append(
+                await run_blocking_reviews(base_url, file_path, args.blocking_reviews)
+            )
+    finally:
+        os.unlink(file_path)
+        stop_server()
+
+    for result in results:
+        print(
+            f"{result['name']:8s} 审核数 {result['reviews']:4d} "
+            f"耗时 {result['elapsed_seconds']:6.2f}s "
+            f"吞吐 {result['reviews_per_second']:7.1f}/s "
+            f"事件循环延迟 p50 {result['loop_lag_p50_ms']:6.1f}ms "
+            f"max {result['loop_lag_max_ms']:7.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="异步审核器基准")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--blocking-reviews", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--port", type=int, default=8011)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+批量导入性能基准 - 对比逐个处理与进程池并行处理多个合同文件（不使用缓存）
+
+用法: python benchmark_ingestion.py --files 100 --chars 200000 --workers 8
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmark_section_splitter import build_synthetic_contract
+from contract_processor import LongContextContractProcessor
+
+
+def write_files(directory: str, count: int, chars: int) -> list:
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"contract_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(build_synthetic_contract(chars, seed=i))
+        paths.append(path)
+    return paths
+
+
+def run_benchmark(count: int, chars: int, workers: int):
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_files(directory, count, chars)
+
+        sequential = LongContextContractProcessor(ingest_workers=1)
+        start = time.perf_counter()
+        expected = sequential.process_contracts(paths)
+        sequential_seconds = time.perf_counter() - start
+
+        parallel = LongContextContractProcessor(ingest_workers=workers)
+        start = time.perf_counter()
+        parallel.process_contracts(paths)
+        cold_seconds = time.perf_counter() - start
+        # 进程池已启动，第二次调用复用同一进程池
+        start = time.perf_counter()
+        documents = parallel.process_contracts(paths)
+        parallel_seconds = time.perf_counter() - start
+        parallel.close()
+
+        combined = parallel.combine_processed_contracts(paths, documents)
+
+    assert [d.token_count for d in documents] == [d.token_count for d in expected]
+    print(f"文件数 {count}，每个 {chars} 字符，合并后 {combined.token_count} tokens")
+    print(f"逐个处理: {sequential_seconds:.2f}s")
+    print(f"进程池首次调用（含启动进程）: {cold_seconds:.2f}s")
+    print(
+        f"进程池({parallel.ingest_workers} 进程): {parallel_seconds:.2f}s  "
+        f"加速 {sequential_seconds / parallel_seconds:.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量导入性能基准")
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--chars", type=int, default=200000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    run_benchmark(args.files, args.chars, args.workers)
@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""
+合同审核 API 端到端压测 - 本地模拟 Dify 服务 + 子进程运行的 contract_api
+
+按目标速率（开环泊松到达，不等待上一个请求完成）驱动 upload、
+review/single、review/batch 和 status 接口，报告各接口的 p50/p95/p99
+延迟、吞吐量和错误数，审核任务从提交到完成的耗时，以及 API 进程树
+（含内嵌工作进程）的峰值内存。
+
+用法: python benchmark_load.py --duration 30 --single-rate 5 --batch-rate 0.5 \
+          --upload-rate 2 --status-rate 20 --latency 0.3 --distribution lognormal
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from mock_dify_server import add_server_arguments, run_server_in_thread, server_options
+
+CLAUSES = [
+    "甲方应于每月五日前支付上月服务费用，逾期按日万分之五支付违约金。",
+    "乙方应按约定标准提供服务，并对服务过程中知悉的商业秘密承担保密义务。",
+    "任何一方违反本合同约定的，应赔偿由此给对方造成的全部损失。",
+    "因不可抗力导致合同无法履行的，双方互不承担违约责任。",
+    "本合同履行过程中发生的争议，双方应协商解决；协商不成的，提交甲方所在地人民法院诉讼解决。",
+    "未经对方书面同意，任何一方不得将本合同项下的权利义务转让给第三方。",
+]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """最近秩分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def write_contracts(directory: str, count: int, chars: int, seed: int) -> List[str]:
+    """生成结构化的模拟合同文本"""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        sections = []
+        size = 0
+        while size < chars:
+            body = "".join(rng.choice(CLAUSES) for _ in range(rng.randint(3, 8)))
+            sections.append(
+                f"第{len(sections) + 1}条 条款{len(sections) + 1}\n{body}\n"
+            )
+            size += len(sections[-1])
+        path = os.path.join(directory, f"contract_{i}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"合同编号：LT-{seed}-{i}\n" + "".join(sections))
+        paths.append(path)
+    return paths
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """进程及其全部子进程的常驻内存（字节），无法读取时返回 None"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+            return sum(process.memory_info().rss for process in processes)
+        except psutil.Error:
+            return None
+
+    # 没有 psutil 时读取 /proc（Linux）
+    total, pending = 0, [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+    except OSError:
+        return None if total == 0 else total
+    return total
+
+
+class MemorySampler:
+    """后台线程定期采样进程树内存"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            self._stop.wait(self.interval)
+
+
+class LoadTest:
+    """开环压测：每类请求按泊松到达独立调度，记录每个请求的状态码和延迟"""
+
+    def __init__(self, client: httpx.AsyncClient, contracts: List[str], args):
+        self.client = client
+        self.contracts = contracts
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.records: List[tuple] = []
+        self.task_ids: List[str] = []
+
+    async def run(self):
+        rates = {
+            "upload": self.args.upload_rate,
+            "review_single": self.args.single_rate,
+            "review_batch": self.args.batch_rate,
+            "status": self.args.status_rate,
+        }
+        inflight: List[asyncio.Task] = []
+        deadline = time.perf_counter() + self.args.duration
+        await asyncio.gather(
+            *(
+                self._schedule(name, rate, deadline, inflight)
+                for name, rate in rates.items()
+                if rate > 0
+            )
+        )
+        await asyncio.gather(*inflight)
+
+    async def _schedule(
+        self, name: str, rate: float, deadline: float, inflight: List[asyncio.Task]
+    ):
+        operation = getattr(self, f"_{name}")
+        next_at = time.perf_counter()
+        while True:
+            next_at += self.rng.expovariate(rate)
+            if next_at >= deadline:
+                return
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            inflight.append(asyncio.create_task(self._timed(name, operation)))
+
+    async def _timed(self, name: str, operation):
+        started = time.perf_counter()
+        try:
+            status = await operation()
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        self.records.append((name, status, time.perf_counter() - started))
+
+    async def _upload(self):
+        path = self.rng.choice(self.contracts)
+        with open(path, "rb") as f:
+            content = f.read()
+        if self.args.unique_uploads:
+            content += f"\n附件编号：{self.rng.getrandbits(64):x}\n".encode("utf-8")
+        response = await self.client.post(
+            "/api/contracts/upload",
+            files=[("files", (os.path.basename(path), content, "text/plain"))],
+        )
+        return response.status_code
+
+    async def _review_single(self):
+        response = await self.client.post(
+            "/api/contracts/review/single",
+            params={"file_path": self.rng.choice(self.contracts)},
+        )
+        if response.status_code == 200:
+            self.task_ids.append(response.json()["task_id"])
+        return response.status_code
+
+    async def _review_batch(self):
+        paths = self.rng.sample(
+            self.contracts, min(self.args.batch_size, len(self.contracts))
+        )
+        response = await self.client.post("/api/contracts/review/batch", json=paths)
+        if response.status_code == 200:
+            self.task_ids.append(response.json()["task_id"])
+        return response.status_code
+
+    async def _status(self):
+        if not self.task_ids:
+            return "skipped"
+        task_id = self.rng.choice(self.task_ids)
+        response = await self.client.get(f"/api/contracts/status/{task_id}")
+        return response.status_code
+
+    async def drain(self, timeout: float) -> Dict[str, Dict[str, Any]]:
+        """等待已提交的审核任务结束（长轮询），返回各任务最终状态"""
+        deadline = time.perf_counter() + timeout
+        states: Dict[str, Dict[str, Any]] = {}
+
+        async def wait(task_id: str):
+            revision = -1
+            while time.perf_counter() < deadline:
+                response = await self.client.get(
+                    f"/api/contracts/status/{task_id}",
+                    params={"wait_seconds": 10, "since_revision": revision},
+                    timeout=30,
+                )
+                state = response.json()
+                states[task_id] = state
+                if state.get("status") in ("completed", "failed"):
+                    return
+                revision = state.get("revision", revision)
+
+        limit = asyncio.Semaphore(50)
+
+        async def bounded(task_id: str):
+            async with limit:
+                await wait(task_id)
+
+        await asyncio.gather(*(bounded(task_id) for task_id in self.task_ids))
+        return states
+
+
+def summarize_requests(records: List[tuple], duration: float) -> Dict[str, Any]:
+    summary = {}
+    for name in sorted({record[0] for record in records}):
+        rows = [record for record in records if record[0] == name]
+        ok = [latency for _, status, latency in rows if status == 200]
+        summary[name] = {
+            "requests": len(rows),
+            "ok": len(ok),
+            "rejected_429": sum(1 for _, status, _ in rows if status == 429),
+            "errors": sum(
+                1 for _, status, _ in rows if status not in (200, 429, "skipped")
+            ),
+            "throughput_rps": len(ok) / duration,
+            "p50_ms": (percentile(ok, 0.5) or 0) * 1000,
+            "p95_ms": (percentile(ok, 0.95) or 0) * 1000,
+            "p99_ms": (percentile(ok, 0.99) or 0) * 1000,
+        }
+    return summary
+
+
+def summarize_reviews(states: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    durations = []
+    counts: Dict[str, int] = {}
+    for state in states.values():
+        status = state.get("status", "unknown")
+        counts[status] = counts.get(status, 0) + 1
+        if status == "completed" and "completed_at" in state:
+            durations.append(
+                (
+                    datetime.fromisoformat(state["completed_at"])
+                    - datetime.fromisoformat(state["created_at"])
+                ).total_seconds()
+            )
+    return {
+        "tasks": len(states),
+        "statuses": counts,
+        "completion_p50_s": percentile(durations, 0.5),
+        "completion_p95_s": percentile(durations, 0.95),
+        "completion_p99_s": percentile(durations, 0.99),
+    }
+
+
+def start_api(args, dify_url: str) -> subprocess.Popen:
+    """以子进程启动 contract_api，内嵌工作进程连接模拟 Dify 服务"""
+    env = dict(
+        os.environ,
+        DIFY_API_BASE=dify_url,
+        EMBEDDED_REVIEW_WORKERS=str(args.workers),
+    )
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "contract_api:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(args.api_port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/api/models/info")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("API 未能在超时时间内启动")
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"\n压测时长 {report['duration_seconds']:.0f}s")
+    print(
+        f"{'接口':<14}{'请求':>7}{'成功':>7}{'429':>6}{'错误':>6}"
+        f"{'吞吐/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    )
+    for name, row in report["requests"].items():
+        print(
+            f"{name:<14}{row['requests']:>7}{row['ok']:>7}{row['rejected_429']:>6}"
+            f"{row['errors']:>6}{row['throughput_rps']:>9.2f}{row['p50_ms']:>9.1f}"
+            f"{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}"
+        )
+    reviews = report["reviews"]
+    print(f"\n审核任务 {reviews['tasks']} 个，状态 {reviews['statuses']}")
+    if reviews["completion_p50_s"] is not None:
+        print(
+            f"提交到完成 p50 {reviews['completion_p50_s']:.2f}s  "
+            f"p95 {reviews['completion_p95_s']:.2f}s  "
+            f"p99 {reviews['completion_p99_s']:.2f}s"
+        )
+    memory = report["memory"]
+    if memory["peak_rss_mb"] is not None:
+        print(
+            f"API 进程树内存 峰值 {memory['peak_rss_mb']:.1f} MB  "
+            f"结束时 {memory['final_rss_mb']:.1f} MB"
+        )
+    print(f"模拟 Dify 服务: {report['dify']}")
+
+
+async def main(args) -> Dict[str, Any]:
+    dify_url = f"http://127.0.0.1:{args.dify_port}"
+    stop_dify = run_server_in_thread(
+        port=args.dify_port, latency_seconds=args.latency, **server_options(args)
+    )
+    api = start_api(args, dify_url)
+    sampler = MemorySampler(api.pid)
+    corpus = tempfile.mkdtemp(prefix="contract_load_test_")
+    try:
+        contracts = write_contracts(
+            corpus, args.contracts, args.contract_chars, args.seed
+        )
+        limits = httpx.Limits(max_connections=args.max_connections)
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{args.api_port}", limits=limits, timeout=60
+        ) as client:
+            await wait_until_ready(client)
+            sampler.start()
+            load = LoadTest(client, contracts, args)
+            started = time.perf_counter()
+            await load.run()
+            duration = time.perf_counter() - started
+            states = await load.drain(args.drain_timeout)
+            async with httpx.AsyncClient() as dify:
+                dify_stats = (await dify.get(f"{dify_url}/stats")).json()
+    finally:
+        sampler.stop()
+        api.terminate()
+        try:
+            api.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            api.kill()
+        stop_dify()
+
+    samples = sampler.samples
+    return {
+        "duration_seconds": duration,
+        "requests": summarize_requests(load.records, duration),
+        "reviews": summarize_reviews(states),
+        "memory": {
+            "peak_rss_mb": max(samples) / 2**20 if samples else None,
+            "final_rss_mb": samples[-1] / 2**20 if samples else None,
+        },
+        "dify": dify_stats,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合同审核 API 端到端压测")
+    parser.add_argument("--duration", type=float, default=30, help="施压时长（秒）")
+    parser.add_argument("--upload-rate", type=float, default=1, help="上传请求/秒")
+    parser.add_argument("--single-rate", type=float, default=2, help="单个审核请求/秒")
+    parser.add_argument("--batch-rate", type=float, default=0.2, help="批量审核请求/秒")
+    parser.add_argument("--status-rate", type=float, default=10, help="状态查询/秒")
+    parser.add_argument("--batch-size", type=int, default=5)
+    parser.add_argument("--contracts", type=int, default=20, help="生成的合同数")
+    parser.add_argument("--contract-chars", type=int, default=20000)
+    parser.add_argument(
+        "--unique-uploads", action="store_true", help="每次上传内容不同，不命中去重"
+    )
+    parser.add_argument("--workers", type=int, default=2, help="内嵌审核工作进程数")
+    parser.add_argument("--api-port", type=int, default=8000)
+    parser.add_argument("--dify-port", type=int, default=8001)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument(
+        "--drain-timeout", type=float, default=300, help="等待审核任务结束的最长时间"
+    )
+    parser.add_argument("--json", help="同时将报告写入 JSON 文件")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = 1
+
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+模型路由仿真 - 在模拟的模型端点上对比固定阈值选择和 ModelRouter
+
+每个模拟端点有固定的并发容量（超出时排队）、每 1k tokens 耗时和错误率；
+仿真中段 claude-3-sonnet 变慢并出现错误。时间按 --time-scale 压缩，
+延迟和 SLO 均以仿真秒计。
+
+--end-to-end 在本地模拟 Dify 服务上运行审核器（单次审核和超长合同的
+分块请求），核对每个路由请求都以路由选择的模型到达工作流。
+
+用法: python benchmark_model_router.py --requests 2000 --rate 4
+      python benchmark_model_router.py --end-to-end
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+import requests
+
+from benchmark_section_splitter import build_synthetic_contract
+from deployment_config import LongContextConfig
+from dify_contract_reviewer import DifyLongContextContractReviewer
+from mock_dify_server import run_server_in_thread
+from model_router import ModelRouter
+
+
+class SimulatedEndpoint:
+    """模拟的模型端点：容量受限，超出容量的请求排队"""
+
+    def __init__(self, latency_per_1k: float, capacity: int, error_rate: float):
+        self.latency_per_1k = latency_per_1k
+        self.error_rate = error_rate
+        self.slots = asyncio.Semaphore(capacity)
+
+    async def call(self, token_count: int, time_scale: float, rng: random.Random):
+        """返回 (是否成功, 服务耗时)；排队时间由调用方计入总延迟"""
+        async with self.slots:
+            service = (
+                self.latency_per_1k
+                * max(token_count / 1000, 1.0)
+                * rng.lognormvariate(0, 0.25)
+            )
+            await asyncio.sleep(service * time_scale)
+            return rng.random() >= self.error_rate, service
+
+
+def static_choice(token_count: int) -> str:
+    """原 get_optimal_model 的固定阈值"""
+    if token_count > 500000:
+        return "gemini-1.5-pro"
+    elif token_count > 100000:
+        return "claude-3-sonnet"
+    return "gpt-4-turbo"
+
+
+def request_sizes(count: int, rng: random.Random) -> List[int]:
+    """合同规模分布：多数几万 tokens，少量超长合同"""
+    return [min(int(rng.lognormvariate(10, 1.0)), 900000) for _ in range(count)]
+
+
+async def simulate(
+    policy: str, sizes: List[int], rate: float, time_scale: float, seed: int
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    models = LongContextConfig.MODELS
+    endpoints = {
+        name: SimulatedEndpoint(
+            model["latency_per_1k_tokens"], model["max_concurrent"], 0.01
+        )
+        for name, model in models.items()
+    }
+    router = ModelRouter.from_config()
+    slo = LongContextConfig.MODEL_ROUTING["latency_slo_seconds"]["medium"]
+    records = []
+
+    async def one(index: int, token_count: int):
+        degraded = len(sizes) // 3 <= index < 2 * len(sizes) // 3
+        endpoints["claude-3-sonnet"].latency_per_1k = 2.0 if degraded else 0.5
+        endpoints["claude-3-sonnet"].error_rate = 0.3 if degraded else 0.01
+
+        model = (
+            router.choose(token_count)
+            if policy == "router"
+            else static_choice(token_count)
+        )
+        router.begin(model)
+        started = time.perf_counter()
+        ok, _ = await endpoints[model].call(token_count, time_scale, rng)
+        latency = (time.perf_counter() - started) / time_scale
+        router.finish(model, token_count, latency, ok)
+        records.append((model, token_count, latency, ok))
+
+    tasks = []
+    for index, token_count in enumerate(sizes):
+        tasks.append(asyncio.create_task(one(index, token_count)))
+        await asyncio.sleep(rng.expovariate(rate) * time_scale)
+    await asyncio.gather(*tasks)
+
+    latencies = sorted(record[2] for record in records)
+    cost = sum(
+        LongContextConfig.estimate_cost(token_count, model)
+        for model, token_count, _, _ in records
+    )
+    distribution: Dict[str, int] = {}
+    for model, *_ in records:
+        distribution[model] = distribution.get(model, 0) + 1
+    return {
+        "policy": policy,
+        "requests": len(records),
+        "slo_seconds": slo,
+        "within_slo": sum(1 for latency in latencies if latency <= slo) / len(records),
+        "latency_p50": latencies[len(latencies) // 2],
+        "latency_p95": latencies[int(len(latencies) * 0.95)],
+        "error_rate": sum(1 for record in records if not record[3]) / len(records),
+        "cost_usd": cost,
+        "models": distribution,
+    }
+
+
+def check_end_to_end(port: int, contract_chars: int) -> bool:
+    """在模拟 Dify 服务上审核一份短合同和一份超长合同，核对服务收到的
+    model 输入与路由器记录的选择一致（总结请求不路由，以 default 计）"""
+    stop = run_server_in_thread("127.0.0.1", port, 0.01)
+    try:
+        router = ModelRouter.from_config()
+        reviewer = DifyLongContextContractReviewer(
+            f"http://127.0.0.1:{port}", "test-key", model_router=router
+        )
+        workflow_id = LongContextConfig.DIFY_WORKFLOWS["contract_review"]["workflow_id"]
+        with tempfile.TemporaryDirectory() as directory:
+            for name, chars in (("short", 20000), ("long", contract_chars)):
+                path = os.path.join(directory, f"{name}.txt")
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(build_synthetic_contract(chars))
+                result = reviewer.review_single_contract(path, workflow_id)
+                print(f"{name}: {result['processing_mode']}")
+        reviewer.close()
+        received = requests.get(f"http://127.0.0.1:{port}/stats").json()["models"]
+    finally:
+        stop()
+
+    routed = {
+        name: stats["requests"]
+        for name, stats in router.stats().items()
+        if stats["requests"]
+    }
+    received.pop("default", None)
+    print(f"路由选择: {routed}")
+    print(f"工作流收到: {received}")
+    return bool(routed) and routed == received
+
+
+async def main(args):
+    sizes = request_sizes(args.requests, random.Random(args.seed))
+    for policy in ("static", "router"):
+        result = await simulate(policy, sizes, args.rate, args.time_scale, args.seed)
+        print(
+            f"{result['policy']:>6}: SLO({result['slo_seconds']}s) 达成 "
+            f"{result['within_slo']:.1%}  p50 {result['latency_p50']:.1f}s  "
+            f"p95 {result['latency_p95']:.1f}s  错误率 {result['error_rate']:.1%}  "
+            f"成本 ${result['cost_usd']:.2f}"
+        )
+        print(f"        模型分布: {result['models']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="模型路由仿真")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=4, help="每仿真秒到达的请求数")
+    parser.add_argument(
+        "--time-scale", type=float, default=0.001, help="每仿真秒对应的实际秒数"
+    )
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--end-to-end", action="store_true", help="在模拟 Dify 服务上核对路由结果"
+    )
+    parser.add_argument("--port", type=int, default=18016)
+    parser.add_argument("--contract-chars", type=int, default=1_000_000)
+    args = parser.parse_args()
+    if args.end_to_end:
+        sys.exit(0 if check_end_to_end(args.port, args.contract_chars) else 1)
+    asyncio.run(main(args))
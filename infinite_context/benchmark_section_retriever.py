@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+章节检索性能基准 - 超长合同的向量化、top-k 检索耗时，以及检索模式相对逐块审核的 token 用量
+
+用法: python benchmark_section_retriever.py --chars 5000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmark_section_splitter import build_synthetic_contract
+from chunk_packer import ChunkPacker
+from contract_processor import LongContextContractProcessor
+from prompt_templates import REVIEW_CHECKLIST
+from section_retriever import HashingEmbedder, SectionRetriever, SectionVectorIndex
+
+
+def run_benchmark(chars: int, queries: int, repeat: int):
+    processor = LongContextContractProcessor()
+    text = build_synthetic_contract(chars)
+    sections = processor.split_into_sections(text)
+    processor.count_section_tokens(sections)
+    contract_tokens = sum(section.token_count for section in sections)
+
+    retriever = SectionRetriever.from_config(processor) or SectionRetriever(
+        processor, ChunkPacker.for_model(processor, processor.model_name).token_budget
+    )
+    start = time.perf_counter()
+    units = ChunkPacker(processor, retriever.unit_tokens).pack(sections)
+    pack_seconds = time.perf_counter() - start
+
+    texts = [f"{unit.title}\n{unit.content}" for unit in units]
+    start = time.perf_counter()
+    embedder = HashingEmbedder(retriever.embedding_dim, retriever.batch_chars)
+    embedder.fit(texts)
+    vectors = embedder.embed(texts)
+    embed_seconds = time.perf_counter() - start
+
+    index = SectionVectorIndex(vectors)
+    query_vectors = embedder.embed(list(REVIEW_CHECKLIST.values()))
+    search_seconds = min(
+        timed(lambda: index.search(query_vectors, retriever.units_per_item))
+        for _ in range(repeat)
+    )
+
+    selections = retriever.retrieve(sections, list(REVIEW_CHECKLIST.values()))
+    reviewed_tokens = sum(unit.token_count for units in selections for unit, _ in units)
+
+    print(f"合同 {len(text)} 字符，{contract_tokens} tokens，{len(units)} 个检索单元")
+    print(f"打包: {pack_seconds * 1000:.0f} ms")
+    print(
+        f"向量化({vectors.shape[1]} 维): {embed_seconds * 1000:.0f} ms  "
+        f"{len(text) / embed_seconds / 1e6:.1f}M 字符/秒  "
+        f"索引 {vectors.nbytes / 2**20:.1f} MB"
+    )
+    print(f"检索({len(REVIEW_CHECKLIST)} 个审核项): {search_seconds * 1000:.2f} ms")
+    print(
+        f"检索模式审核 {reviewed_tokens} tokens，逐块审核 {contract_tokens} tokens，"
+        f"减少 {contract_tokens / max(reviewed_tokens, 1):.1f}x"
+    )
+
+    # 大规模索引：随机单位向量，一批查询的 top-k
+    rng = np.random.default_rng(0)
+    large = rng.standard_normal((100000, retriever.embedding_dim), dtype=np.float32)
+    large /= np.linalg.norm(large, axis=1, keepdims=True)
+    large_index = SectionVectorIndex(large)
+    batch = large[:queries]
+    large_seconds = min(
+        timed(lambda: large_index.search(batch, retriever.units_per_item))
+        for _ in range(repeat)
+    )
+    print(
+        f"100000 个向量、{queries} 个查询的 top-{retriever.units_per_item}: "
+        f"{large_seconds * 1000:.2f} ms"
+    )
+
+
+def timed(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="章节检索性能基准")
+    parser.add_argument("--chars", type=int, default=5_000_000)
+    parser.add_argument("--queries", type=int, default=32)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run_benchmark(args.chars, args.queries, args.repeat)
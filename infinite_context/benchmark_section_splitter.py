@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+章节分割性能基准 - 对比逐行 any() + 字符串累加的旧实现与单次正则扫描的新实现
+"""
+
+import random
+import time
+from typing import Callable, Dict, List
+
+from contract_processor import (
+    LongContextContractProcessor,
+    compile_section_pattern,
+    find_section_bounds,
+)
+
+SECTION_MARKERS = LongContextContractProcessor.SECTION_MARKERS
+
+
+def legacy_split_into_sections(text: str) -> List[Dict[str, str]]:
+    """旧实现：逐行检查所有标记，并通过 += 累加章节内容"""
+    sections = []
+    current_section = {"title": "开头", "content": ""}
+
+    lines = text.split("\n")
+    for line in lines:
+        line = line.strip()
+        if any(marker in line for marker in SECTION_MARKERS):
+            if current_section["content"]:
+                sections.append(current_section)
+            current_section = {"title": line[:50], "content": line + "\n"}
+        else:
+            current_section["content"] += line + "\n"
+
+    if current_section["content"]:
+        sections.append(current_section)
+
+    return sections
+
+
+def build_synthetic_contract(target_chars: int = 1_000_000, seed: int = 42) -> str:
+    """生成指定长度的合成中文合同文本"""
+    rng = random.Random(seed)
+    body_lines = [
+        "本合同项下的服务费用应于每月十日前以银行转账方式支付至指定账户。",
+        "任何一方未经对方书面同意，不得将本合同项下的权利义务转让给第三方。",
+        "双方应对在履行本合同过程中知悉的商业秘密承担保密义务，保密期限为五年。",
+        "因不可抗力导致合同无法履行的，受影响一方应在七日内书面通知对方。",
+        "本合同未尽事宜，双方可另行协商并签订书面文件，与本合同具有同等效力。",
+        "验收标准以技术规格书为准，验收不合格的，供应方应在十五日内免费整改。",
+    ]
+    headings = ["第一条", "第二条", "第三条", "一、", "二、", "附件", "补充说明"]
+
+    parts = []
+    size = 0
+    while size < target_chars:
+        heading = f"{rng.choice(headings)} 合同条款说明"
+        parts.append(heading)
+        size += len(heading) + 1
+        # 长章节：放大旧实现中字符串累加的开销
+        for _ in range(rng.randint(20, 400)):
+            line = rng.choice(body_lines)
+            parts.append(line)
+            size += len(line) + 1
+    return "\n".join(parts)[:target_chars]
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """返回多次运行中的最短耗时（秒）"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(target_chars: int = 1_000_000, repeat: int = 5) -> Dict[str, float]:
+    """运行基准测试并返回结果"""
+    text = build_synthetic_contract(target_chars)
+    pattern = compile_section_pattern(SECTION_MARKERS)
+
+    legacy_count = len(legacy_split_into_sections(text))
+    compiled_count = len(find_section_bounds(text, pattern))
+    if legacy_count != compiled_count:
+        raise RuntimeError(f"章节数量不一致: {legacy_count} != {compiled_count}")
+
+    legacy_seconds = measure(lambda: legacy_split_into_sections(text), repeat)
+    bounds_seconds = measure(lambda: find_section_bounds(text, pattern), repeat)
+    sliced_seconds = measure(
+        lambda: [text[s:e] for s, e, _ in find_section_bounds(text, pattern)], repeat
+    )
+
+    return {
+        "chars": len(text),
+        "sections": compiled_count,
+        "legacy_seconds": legacy_seconds,
+        "compiled_bounds_seconds": bounds_seconds,
+        "compiled_sliced_seconds": sliced_seconds,
+        "speedup": legacy_seconds / sliced_seconds,
+    }
+
+
+if __name__ == "__main__":
+    result = run_benchmark()
+    print(f"文本长度: {result['chars']} 字符, 章节数: {result['sections']}")
+    print(f"旧实现:             {result['legacy_seconds'] * 1000:.2f} ms")
+    print(f"新实现（仅边界）:   {result['compiled_bounds_seconds'] * 1000:.2f} ms")
+    print(f"新实现（含切片）:   {result['compiled_sliced_seconds'] * 1000:.2f} ms")
+    print(f"加速比: {result['speedup']:.1f}x")
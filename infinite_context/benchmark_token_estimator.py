@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+token 估算基准 - 对比分层估算器与完整 tiktoken 编码的误差和耗时
+
+用法: python benchmark_token_estimator.py <合同目录>
+"""
+
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+from contract_processor import LongContextContractProcessor
+from deployment_config import LongContextConfig
+from token_estimator import TokenEstimator, detect_script
+
+
+def collect_files(corpus_dir: str) -> List[str]:
+    """收集目录下所有支持格式的文件"""
+    supported = tuple(LongContextConfig.FILE_PROCESSING["supported_formats"])
+    file_paths = []
+    for root, _, names in os.walk(corpus_dir):
+        for name in sorted(names):
+            if name.lower().endswith(supported):
+                file_paths.append(os.path.join(root, name))
+    return file_paths
+
+
+def extract_full_text(processor: LongContextContractProcessor, file_path: str) -> str:
+    """完整提取文本，用于计算基准 token 数"""
+    if file_path.endswith(".pdf"):
+        content = processor.extract_text_from_pdf(file_path)
+    elif file_path.endswith(".docx"):
+        content = processor.extract_text_from_docx(file_path)
+    else:
+        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+    return content
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def run_benchmark(corpus_dir: str) -> Dict[str, Any]:
+    """逐文件对比估算值与完整编码结果"""
+    processor = LongContextContractProcessor(pdf_workers=1)
+    estimator = TokenEstimator()
+
+    rows = []
+    for file_path in collect_files(corpus_dir):
+        start = time.perf_counter()
+        try:
+            content = extract_full_text(processor, file_path)
+        except Exception as e:
+            print(f"跳过 {file_path}: {e}")
+            continue
+        actual = processor.count_tokens(content)
+        full_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        estimate = estimator.estimate_file(file_path)
+        estimate_seconds = time.perf_counter() - start
+
+        error = abs(estimate["estimated_tokens"] - actual) / actual if actual else 0.0
+        rows.append(
+            {
+                "file_path": file_path,
+                "format": os.path.splitext(file_path)[1].lower(),
+                "script": detect_script(content[:65536]),
+                "file_size": os.path.getsize(file_path),
+                "actual_tokens": actual,
+                "estimated_tokens": estimate["estimated_tokens"],
+                "method": estimate["method"],
+                "error": error,
+                "full_seconds": full_seconds,
+                "estimate_seconds": estimate_seconds,
+            }
+        )
+
+    # 观测到的每 token 字节数，格式与 TOKEN_ESTIMATION["bytes_per_token"] 相同，
+    # 语料中没有的格式/文字类型沿用现有配置
+    calibration = defaultdict(lambda: [0, 0])
+    for row in rows:
+        key = (row["format"], row["script"])
+        calibration[key][0] += row["file_size"]
+        calibration[key][1] += row["actual_tokens"]
+    bytes_per_token = {
+        fmt: dict(ratios)
+        for fmt, ratios in LongContextConfig.TOKEN_ESTIMATION["bytes_per_token"].items()
+    }
+    observed = set()
+    for (fmt, script), (size, tokens) in calibration.items():
+        if tokens and script in bytes_per_token.get(fmt, {}):
+            bytes_per_token[fmt][script] = round(size / tokens, 2)
+            observed.add(f"{fmt}/{script}")
+
+    errors = [row["error"] for row in rows]
+    return {
+        "files": len(rows),
+        "mean_error": sum(errors) / len(errors) if errors else 0.0,
+        "p95_error": percentile(errors, 0.95),
+        "full_seconds": sum(row["full_seconds"] for row in rows),
+        "estimate_seconds": sum(row["estimate_seconds"] for row in rows),
+        "bytes_per_token": bytes_per_token,
+        "calibrated": sorted(observed),
+        "rows": rows,
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+
+    result = run_benchmark(sys.argv[1])
+    for row in result["rows"]:
+        print(
+            f"{os.path.basename(row['file_path'])[:40]:40s} "
+            f"{row['method']:8s} 实际 {row['actual_tokens']:>9d} "
+            f"估算 {row['estimated_tokens']:>9d} 误差 {row['error'] * 100:6.2f}%"
+        )
+    print(f"\n文件数: {result['files']}")
+    print(f"平均误差: {result['mean_error'] * 100:.2f}%")
+    print(f"P95 误差: {result['p95_error'] * 100:.2f}%")
+    print(f"完整编码耗时: {result['full_seconds'] * 1000:.1f} ms")
+    print(f"估算耗时:     {result['estimate_seconds'] * 1000:.1f} ms")
+    print(f"已校准: {', '.join(result['calibrated']) or '无'}")
+    print('TOKEN_ESTIMATION["bytes_per_token"] =')
+    print(json.dumps(result["bytes_per_token"], indent=4))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+章节打包器 - 按模型 token 预算合并相邻章节、拆分超长章节
+"""
+
+from typing import List
+
+from contract_processor import (
+    LongContextContractProcessor,
+    SectionView,
+    token_boundary_at,
+)
+from deployment_config import LongContextConfig
+
+
+class ChunkPacker:
+    """按 token 预算打包章节
+
+    相邻的小章节贪心合并到不超过预算的分块中，超出预算的章节先按行、
+    再按 token 拆开；可选地在分块开头重复上一分块末尾的章节作为重叠上下文。
+    分块仍是共享文档缓冲区上的 SectionView，不复制正文。
+    """
+
+    def __init__(
+        self,
+        processor: LongContextContractProcessor,
+        token_budget: int,
+        overlap_tokens: int = 0,
+    ):
+        if token_budget <= 0:
+            raise ValueError("token_budget 必须大于 0")
+        self.processor = processor
+        self.token_budget = token_budget
+        self.overlap_tokens = min(overlap_tokens, token_budget // 2)
+
+    @classmethod
+    def for_model(
+        cls, processor: LongContextContractProcessor, model_name: str
+    ) -> "ChunkPacker":
+        """使用 LongContextConfig.MODELS 中该模型的分块预算"""
+        model = LongContextConfig.MODELS.get(
+            model_name, LongContextConfig.MODELS["gpt-4-turbo"]
+        )
+        return cls(
+            processor,
+            model["chunk_token_budget"],
+            model.get("chunk_overlap_tokens", 0),
+        )
+
+    def pack(self, sections: List[SectionView]) -> List[SectionView]:
+        """将章节打包为不超过 token 预算的分块"""
+        self.processor.count_section_tokens(sections)
+
+        units = []
+        for section in sections:
+            if section.token_count > self.token_budget:
+                units.extend(self._split_section(section))
+            else:
+                units.append(section)
+
+        chunks = []
+        current = []
+        current_tokens = 0
+        new_from = 0
+        for unit in units:
+            if current and self._adjacent(current[-1], unit):
+                candidate_tokens = self._tokens_with(current, current_tokens, unit)
+                if candidate_tokens <= self.token_budget:
+                    current.append(unit)
+                    current_tokens = candidate_tokens
+                    continue
+
+            if current:
+                chunks.append(self._make_chunk(current, new_from))
+                current = self._overlap_seed(current, unit)
+            new_from = len(current)
+            current.append(unit)
+            current_tokens = self.processor.combine_token_counts(current)
+
+        if current:
+            chunks.append(self._make_chunk(current, new_from))
+        return chunks
+
+    def _overlap_seed(
+        self, previous: List[SectionView], unit: SectionView
+    ) -> List[SectionView]:
+        """取上一分块末尾不超过 overlap_tokens 的片段作为新分块的开头"""
+        seed = []
+        seed_tokens = 0
+        if self.overlap_tokens and self._adjacent(previous[-1], unit):
+            for candidate in reversed(previous):
+                if seed_tokens + candidate.token_count > self.overlap_tokens:
+                    break
+                seed.insert(0, candidate)
+                seed_tokens += candidate.token_count
+        # 重叠部分加上新片段会超出预算时放弃重叠，保证每个分块都有新内容
+        if seed and (
+            self._tokens_with(seed, self.processor.combine_token_counts(seed), unit)
+            > self.token_budget
+        ):
+            return []
+        return seed
+
+    def _tokens_with(
+        self, units: List[SectionView], tokens: int, unit: SectionView
+    ) -> int:
+        """在首尾相接的 units（共 tokens 个 token）后追加 unit 的精确 token 数"""
+        if token_boundary_at(unit.buffer, unit.start):
+            return tokens + unit.token_count
+        # 接缝不是安全切分点时，合并后的 token 数可能与两者之和不同
+        return self.processor.combine_token_counts(units + [unit])
+
+    @staticmethod
+    def _adjacent(left: SectionView, right: SectionView) -> bool:
+        """两个片段在同一缓冲区上首尾相接且来自同一文档"""
+        return (
+            left.buffer is right.buffer
+            and left.end == right.start
+            and left.source_document == right.source_document
+        )
+
+    def _make_chunk(self, units: List[SectionView], new_from: int) -> SectionView:
+        """由连续片段组成分块，标题取本分块新增内容的首尾章节"""
+        first, last = units[new_from], units[-1]
+        title = first.title if first is last else f"{first.title} ~ {last.title}"
+        return SectionView(
+            units[0].buffer,
+            units[0].start,
+            units[-1].end,
+            title,
+            units[0].source_document,
+            self.processor.combine_token_counts(units),
+        )
+
+    def _split_section(self, section: SectionView) -> List[SectionView]:
+        """将超出预算的章节拆分为不超过预算的片段"""
+        buffer = section.buffer
+        lines = []
+        start = section.start
+        while start < section.end:
+            end = buffer.find("\n", start, section.end)
+            end = section.end if end < 0 else end + 1
+            lines.append(SectionView(buffer, start, end, section.title))
+            start = end
+        self.processor.count_section_tokens(lines)
+
+        pieces = []
+        current = []
+        current_tokens = 0
+        for line in lines:
+            if line.token_count > self.token_budget:
+                if current:
+                    pieces.append(current)
+                    current, current_tokens = [], 0
+                pieces.extend([part] for part in self._split_line(line))
+                continue
+            if current:
+                candidate_tokens = self._tokens_with(current, current_tokens, line)
+                if candidate_tokens <= self.token_budget:
+                    current.append(line)
+                    current_tokens = candidate_tokens
+                    continue
+                pieces.append(current)
+            current = [line]
+            current_tokens = line.token_count
+        if current:
+            pieces.append(current)
+
+        return [
+            SectionView(
+                buffer,
+                piece[0].start,
+                piece[-1].end,
+                f"{section.title}（{i + 1}/{len(pieces)}）",
+                section.source_document,
+                self.processor.combine_token_counts(piece),
+            )
+            for i, piece in enumerate(pieces)
+        ]
+
+    def _split_line(self, line: SectionView) -> List[SectionView]:
+        """按 token 边界切分超长的单行"""
+        encoding = self.processor.encoding
+        text = line.content
+        _, offsets = encoding.decode_with_offsets(encoding.encode_ordinary(text))
+        offsets.append(len(text))
+
+        parts = []
+        first = 0
+        while offsets[first] < len(text):
+            last = min(first + self.token_budget, len(offsets) - 1)
+            # 片段单独编码时 token 数可能多于切分前，超出预算则回退切分点
+            while True:
+                start, end = offsets[first], offsets[last]
+                count = self.processor.count_tokens(text[start:end])
+                if count <= self.token_budget or last - first <= 1:
+                    break
+                last -= 1
+            # 多个 token 落在同一字符内时偏移相同，向后推进到下一个字符
+            while offsets[last] == start and last < len(offsets) - 1:
+                last += 1
+            end = offsets[last]
+            parts.append(
+                SectionView(
+                    line.buffer,
+                    line.start + start,
+                    line.start + end,
+                    line.title,
+                    token_count=self.processor.count_tokens(text[start:end]),
+                )
+            )
+            first = last
+        return parts
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+近重复条款检测 - 基于 MinHash/LSH 的已审核章节索引
+
+分块审核前先在索引中查找与当前分块近似重复的已审核内容：除空白外完全
+相同的直接复用原审核结果，高度相似的只审核差异部分。
+"""
+
+import os
+import re
+import json
+import time
+import zlib
+import difflib
+import hashlib
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from deployment_config import LongContextConfig
+
+# 条款编号（第3条、第十二章、1.2.3）不影响相似度
+_CLAUSE_NUMBER = re.compile(r"第[0-9一二三四五六七八九十百千零〇两]+[条章节款项]|\d+")
+_WHITESPACE = re.compile(r"\s+")
+_SENTENCE_END = re.compile(r"(?<=[。；;！？!?\n])")
+
+# 多项式滚动哈希的乘数（64 位奇数，乘法按 2^64 取模）
+_SHINGLE_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def normalize_clause(text: str) -> str:
+    """去掉空白并统一条款编号，用于计算签名"""
+    return _CLAUSE_NUMBER.sub("0", _WHITESPACE.sub("", text))
+
+
+def content_digest(text: str) -> str:
+    """去掉空白后的内容摘要，相同摘要才复用审核结果（金额、期限等数字不能忽略）"""
+    return hashlib.sha256(_WHITESPACE.sub("", text).encode("utf-8")).hexdigest()
+
+
+def clause_diff(previous: str, current: str, context: int = 1) -> str:
+    """按句子比较两个版本，返回 unified diff 文本"""
+    before = [s for s in _SENTENCE_END.split(previous) if s.strip()]
+    after = [s for s in _SENTENCE_END.split(current) if s.strip()]
+    return "\n".join(
+        line.rstrip("\n")
+        for line in difflib.unified_diff(
+            before, after, "已审核版本", "当前版本", lineterm="", n=context
+        )
+    )
+
+
+class MinHasher:
+    """字符 n-gram 的 MinHash 签名
+
+    n-gram 用多项式滚动哈希映射到 64 位整数，num_perm 个哈希函数为
+    multiply-shift 形式 ((a * x + b) mod 2^64) >> 32，全部用 NumPy 向量化计算。
+    参数由固定种子生成，不同进程计算的签名一致，可持久化。
+    """
+
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.a = rng.integers(1, 2**63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**63, size=num_perm, dtype=np.uint64)
+
+    def shingles(self, text: str) -> np.ndarray:
+        """规范化文本的字符 n-gram 哈希（去重）"""
+        codes = np.frombuffer(
+            normalize_clause(text).encode("utf-32-le"), dtype=np.uint32
+        ).astype(np.uint64)
+        size = min(self.shingle_size, len(codes))
+        if size == 0:
+            return codes
+        hashes = np.zeros(len(codes) - size + 1, dtype=np.uint64)
+        for offset in range(size):
+            hashes = hashes * _SHINGLE_BASE + codes[offset : offset + len(hashes)]
+        return np.unique(hashes)
+
+    def signature(self, text: str, block_size: int = 4096) -> np.ndarray:
+        """计算 MinHash 签名（num_perm 个 uint32）"""
+        shingles = self.shingles(text)
+        signature = np.full(self.num_perm, np.iinfo(np.uint64).max, dtype=np.uint64)
+        # 分块计算，避免 num_perm × n-gram 数的中间矩阵过大
+        for start in range(0, len(shingles), block_size):
+            block = shingles[start : start + block_size]
+            hashed = (self.a[:, None] * block[None, :] + self.b[:, None]) >> np.uint64(
+                32
+            )
+            signature = np.minimum(signature, hashed.min(axis=1))
+        return signature.astype(np.uint32)
+
+
+@dataclass
+class ClauseMatch:
+    """索引中与查询内容近似重复的已审核章节"""
+
+    section_id: int
+    title: str
+    content: str
+    review: Dict[str, Any]
+    similarity: float
+    # 内容除空白外完全相同
+    exact: bool
+
+
+class ClauseIndex:
+    """已审核章节的 LSH 索引（SQLite 持久化，多进程共享）
+
+    签名切分为 bands 段，每段的哈希作为分桶键；任一段分桶相同即为候选，
+    再用完整签名估算 Jaccard 相似度，不低于 diff_threshold 的最佳候选为匹配。
+    签名估算无法区分个别字词的改动，是否完全相同由内容摘要判断。
+    索引按工作流区分，超过 max_entries 时删除最早的章节。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        diff_threshold: float = 0.8,
+        min_chars: int = 200,
+        max_entries: int = 100000,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm 必须是 bands 的整数倍")
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.hasher = MinHasher(num_perm, shingle_size)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.diff_threshold = diff_threshold
+        self.min_chars = min_chars
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                workflow_id TEXT NOT NULL,
+                title TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                content BLOB NOT NULL,
+                signature BLOB NOT NULL,
+                review TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS buckets (
+                bucket INTEGER NOT NULL,
+                section_id INTEGER NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sections_digest "
+            "ON sections(workflow_id, digest)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_buckets_bucket ON buckets(bucket)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_buckets_section ON buckets(section_id)"
+        )
+        self._create_count_table()
+
+    def _create_count_table(self):
+        """创建章节数表和维护它的触发器，写入时不必统计全表；已有索引库只在
+        首次升级时统计一次"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS section_count ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO section_count (id, value) "
+                "SELECT 0, COUNT(*) FROM sections"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS sections_count_insert "
+                "AFTER INSERT ON sections BEGIN "
+                "UPDATE section_count SET value = value + 1 WHERE id = 0; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS sections_count_delete "
+                "AFTER DELETE ON sections BEGIN "
+                "UPDATE section_count SET value = value - 1 WHERE id = 0; END"
+            )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    @classmethod
+    def from_config(cls) -> Optional["ClauseIndex"]:
+        """按 LongContextConfig.CLAUSE_DEDUP 创建，未启用时返回 None"""
+        settings = LongContextConfig.CLAUSE_DEDUP
+        if not settings["enabled"]:
+            return None
+        return cls(
+            settings["storage_path"],
+            settings["num_perm"],
+            settings["bands"],
+            settings["shingle_size"],
+            settings["diff_threshold"],
+            settings["min_chars"],
+            settings["max_entries"],
+        )
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """计算签名，内容过短时返回 None（不参与去重）"""
+        if len(text) < self.min_chars:
+            return None
+        return self.hasher.signature(text)
+
+    def find(
+        self, workflow_id: str, content: str, signature: Optional[np.ndarray]
+    ) -> Optional[ClauseMatch]:
+        """查找内容相同或最相似的已审核章节"""
+        if signature is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM sections WHERE workflow_id = ? AND digest = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (workflow_id, content_digest(content)),
+            ).fetchone()
+        if row is not None:
+            return self._load(row[0], 1.0, True)
+
+        buckets = self._buckets(workflow_id, signature)
+        placeholders = ",".join("?" * len(buckets))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT id, signature FROM sections WHERE id IN ("
+                f"SELECT section_id FROM buckets WHERE bucket IN ({placeholders}))",
+                buckets,
+            ).fetchall()
+
+        best_id, best_similarity = None, 0.0
+        for section_id, stored in rows:
+            similarity = float(
+                np.mean(np.frombuffer(stored, dtype=np.uint32) == signature)
+            )
+            if similarity > best_similarity:
+                best_id, best_similarity = section_id, similarity
+        if best_id is None or best_similarity < self.diff_threshold:
+            return None
+        return self._load(best_id, best_similarity, False)
+
+    def add(
+        self,
+        workflow_id: str,
+        title: str,
+        content: str,
+        signature: Optional[np.ndarray],
+        review: Dict[str, Any],
+    ):
+        """记录一次完整审核的章节"""
+        if signature is None:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._conn.execute(
+                    "INSERT INTO sections (workflow_id, title, digest, content, "
+                    "signature, review, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        workflow_id,
+                        title,
+                        content_digest(content),
+                        zlib.compress(content.encode("utf-8"), 1),
+                        signature.astype(np.uint32).tobytes(),
+                        json.dumps(review, ensure_ascii=False),
+                        time.time(),
+                    ),
+                )
+                self._conn.executemany(
+                    "INSERT INTO buckets (bucket, section_id) VALUES (?, ?)",
+                    [
+                        (bucket, cursor.lastrowid)
+                        for bucket in self._buckets(workflow_id, signature)
+                    ],
+                )
+                self._evict()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _load(
+        self, section_id: int, similarity: float, exact: bool
+    ) -> Optional[ClauseMatch]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT title, content, review FROM sections WHERE id = ?",
+                (section_id,),
+            ).fetchone()
+        if row is None:
+            # 查询期间被其他进程淘汰
+            return None
+        return ClauseMatch(
+            section_id,
+            row[0],
+            zlib.decompress(row[1]).decode("utf-8"),
+            json.loads(row[2]),
+            similarity,
+            exact,
+        )
+
+    def _buckets(self, workflow_id: str, signature: np.ndarray) -> List[int]:
+        """每个 band 的分桶键（工作流 + band 序号 + 该段签名的 64 位哈希）"""
+        buckets = []
+        for band in range(self.bands):
+            rows = signature[band * self.rows : (band + 1) * self.rows]
+            digest = hashlib.blake2b(
+                f"{workflow_id}:{band}:".encode("utf-8") + rows.tobytes(),
+                digest_size=8,
+            ).digest()
+            buckets.append(int.from_bytes(digest, "little", signed=True))
+        return buckets
+
+    def _evict(self):
+        count = self._conn.execute(
+            "SELECT value FROM section_count WHERE id = 0"
+        ).fetchone()[0]
+        excess = count - self.max_entries
+        if excess <= 0:
+            return
+        victims = self._conn.execute(
+            "SELECT id FROM sections ORDER BY id LIMIT ?", (excess,)
+        ).fetchall()
+        self._conn.executemany("DELETE FROM buckets WHERE section_id = ?", victims)
+        self._conn.executemany("DELETE FROM sections WHERE id = ?", victims)
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+"""
+条款全文检索 - 已处理合同章节的倒排索引（中文按二元组切分，BM25 排序）
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from deployment_config import LongContextConfig
+
+_CJK = r"\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+# 中日韩字符串，或不含中日韩字符的字母数字串
+_TERM_PATTERN = re.compile(rf"(?P<cjk>[{_CJK}]+)|(?:(?![{_CJK}])[^\W_])+")
+
+# 倒排表按章节 ID 分块存放，每块覆盖的章节 ID 数
+POSTING_BLOCK_SECTIONS = 1024
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def clause_terms(text: str) -> List[str]:
+    """检索词切分
+
+    中文没有空格分词，连续的中日韩字符切为重叠二元组（单字保留为一元），
+    字母数字按词切分，均经 NFKC 规范化并转小写（全角字母数字与半角一致）。
+    """
+    terms = []
+    for match in _TERM_PATTERN.finditer(unicodedata.normalize("NFKC", text).lower()):
+        run = match.group()
+        if len(run) == 1 or match.lastgroup != "cjk":
+            terms.append(run)
+        else:
+            terms.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return terms
+
+
+@dataclass
+class ClauseHit:
+    """检索命中的章节"""
+
+    section_id: int
+    content_hash: str
+    file_path: str
+    title: str
+    snippet: str
+    score: float
+
+
+class ClauseSearchIndex:
+    """合同章节全文索引（SQLite 持久化，多进程共享）
+
+    倒排表按 (检索词, 章节 ID 分块) 存放，每块是 (章节 ID, 词频, 章节长度)
+    的 int32 数组；查询读取检索词的全部分块，用 NumPy 向量化计算 BM25 后取
+    前 k 个。同一合同的章节 ID 连续，加入或删除合同只改写涉及的分块，文档
+    频率和章节总数、总长度同步增量更新，无需重建。查询只使用文档频率最低的
+    max_query_terms 个检索词，长查询的耗时不随长度增长。
+    """
+
+    def __init__(
+        self, db_path: str, max_query_terms: int = 32, snippet_chars: int = 120
+    ):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.max_query_terms = max_query_terms
+        self.snippet_chars = snippet_chars
+        self.snippet_scan_chars = 100 * snippet_chars
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                content_hash TEXT NOT NULL UNIQUE,
+                file_path TEXT NOT NULL,
+                indexed_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                document_id INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                content TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_sections_document ON sections(document_id)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                block INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (term, block)
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """
+        )
+
+    @classmethod
+    def from_config(cls) -> Optional["ClauseSearchIndex"]:
+        """按 LongContextConfig.CLAUSE_SEARCH 创建，未启用时返回 None"""
+        settings = LongContextConfig.CLAUSE_SEARCH
+        if not settings["enabled"]:
+            return None
+        return cls(
+            settings["storage_path"],
+            settings["max_query_terms"],
+            settings["snippet_chars"],
+        )
+
+    def contains(self, content_hash: str) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return row is not None
+
+    def add_document(
+        self,
+        content_hash: str,
+        file_path: str,
+        sections: Iterable[Tuple[str, str]],
+    ) -> bool:
+        """索引合同的 (标题, 正文) 章节，已索引相同内容时返回 False"""
+        if self.contains(content_hash):
+            return False
+        # 检索词在事务外切分，缩短写锁的持有时间
+        prepared = [
+            (title, content, Counter(clause_terms(f"{title}\n{content}")))
+            for title, content in sections
+        ]
+
+        with self._lock, self._transaction():
+            try:
+                document_id = self._conn.execute(
+                    "INSERT INTO documents (content_hash, file_path, indexed_at) "
+                    "VALUES (?, ?, ?)",
+                    (content_hash, file_path, time.time()),
+                ).lastrowid
+            except sqlite3.IntegrityError:
+                # 其他进程已索引同一合同
+                return False
+
+            added: Dict[Tuple[str, int], List[Tuple[int, int, int]]] = {}
+            document_frequency: Counter = Counter()
+            total_length = 0
+            for title, content, counts in prepared:
+                section_id = self._conn.execute(
+                    "INSERT INTO sections (document_id, title, content) "
+                    "VALUES (?, ?, ?)",
+                    (document_id, title, content),
+                ).lastrowid
+                length = sum(counts.values())
+                total_length += length
+                block = section_id // POSTING_BLOCK_SECTIONS
+                for term, tf in counts.items():
+                    added.setdefault((term, block), []).append((section_id, tf, length))
+                document_frequency.update(counts.keys())
+
+            for (term, block), rows in added.items():
+                postings = np.asarray(rows, dtype=np.int32)
+                existing = self._read_block(term, block)
+                if existing is not None:
+                    postings = np.concatenate([existing, postings])
+                self._write_block(term, block, postings)
+            self._conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, ?) "
+                "ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                document_frequency.items(),
+            )
+            self._add_counters(len(prepared), total_length)
+        return True
+
+    def remove_document(self, content_hash: str) -> bool:
+        """删除合同的全部章节，未索引时返回 False"""
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                "SELECT id FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+            if row is None:
+                return False
+            sections = self._conn.execute(
+                "SELECT id, title, content FROM sections WHERE document_id = ?",
+                (row[0],),
+            ).fetchall()
+
+            # 倒排表不记录章节包含哪些检索词，由章节正文重新切分得到涉及的分块
+            blocks = set()
+            document_frequency: Counter = Counter()
+            total_length = 0
+            for section_id, title, content in sections:
+                terms = clause_terms(f"{title}\n{content}")
+                total_length += len(terms)
+                unique_terms = set(terms)
+                document_frequency.update(unique_terms)
+                block = section_id // POSTING_BLOCK_SECTIONS
+                blocks.update((term, block) for term in unique_terms)
+
+            removed_ids = np.array([section[0] for section in sections], np.int32)
+            for term, block in blocks:
+                postings = self._read_block(term, block)
+                if postings is not None:
+                    keep = ~np.isin(postings[:, 0], removed_ids)
+                    self._write_block(term, block, postings[keep])
+            self._conn.executemany(
+                "UPDATE terms SET df = df - ? WHERE term = ?",
+                [(df, term) for term, df in document_frequency.items()],
+            )
+            self._conn.execute("DELETE FROM terms WHERE df <= 0")
+            self._add_counters(-len(sections), -total_length)
+            self._conn.execute("DELETE FROM sections WHERE document_id = ?", (row[0],))
+            self._conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+        return True
+
+    def search(self, query: str, limit: int = 20) -> List[ClauseHit]:
+        """检索与 query 相似的章节，按 BM25 相关度从高到低排序"""
+        terms = list(dict.fromkeys(clause_terms(query)))
+        if not terms or limit <= 0:
+            return []
+        with self._lock:
+            section_count, total_length = self._counters()
+            if section_count <= 0:
+                return []
+            placeholders = ",".join("?" * len(terms))
+            selected = self._conn.execute(
+                f"SELECT term, df FROM terms WHERE term IN ({placeholders}) "
+                "ORDER BY df LIMIT ?",
+                (*terms, self.max_query_terms),
+            ).fetchall()
+            if not selected:
+                return []
+
+            average_length = total_length / section_count
+            ids, scores = [], []
+            for term, df in selected:
+                blobs = self._conn.execute(
+                    "SELECT data FROM postings WHERE term = ?", (term,)
+                ).fetchall()
+                postings = np.frombuffer(
+                    b"".join(blob for (blob,) in blobs), dtype=np.int32
+                ).reshape(-1, 3)
+                idf = math.log(1 + (section_count - df + 0.5) / (df + 0.5))
+                tf = postings[:, 1].astype(np.float64)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * postings[:, 2] / average_length)
+                ids.append(postings[:, 0])
+                scores.append(idf * (BM25_K1 + 1) * tf / (tf + norm))
+
+            # 按章节 ID 累加各检索词的得分
+            ids = np.concatenate(ids)
+            offset = int(ids.min())
+            totals = np.bincount(ids - offset, weights=np.concatenate(scores))
+            matched = np.flatnonzero(totals)
+            if len(matched) > limit:
+                matched = matched[np.argpartition(-totals[matched], limit - 1)[:limit]]
+            top = {int(i) + offset: float(totals[i]) for i in matched}
+
+            placeholders = ",".join("?" * len(top))
+            rows = self._conn.execute(
+                f"""
+                SELECT s.id, d.content_hash, d.file_path, s.title, s.content
+                FROM sections s JOIN documents d ON d.id = s.document_id
+                WHERE s.id IN ({placeholders})
+                """,
+                tuple(top),
+            ).fetchall()
+
+        hits = [
+            ClauseHit(
+                section_id,
+                content_hash,
+                file_path,
+                title,
+                self._snippet(content, terms),
+                top[section_id],
+            )
+            for section_id, content_hash, file_path, title, content in rows
+        ]
+        hits.sort(key=lambda hit: (-hit.score, hit.section_id))
+        return hits
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            documents = self._conn.execute("SELECT COUNT(*) FROM documents").fetchone()
+            sections, _ = self._counters()
+        return {"documents": documents[0], "sections": sections}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _read_block(self, term: str, block: int) -> Optional[np.ndarray]:
+        row = self._conn.execute(
+            "SELECT data FROM postings WHERE term = ? AND block = ?", (term, block)
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.int32).reshape(-1, 3)
+
+    def _write_block(self, term: str, block: int, postings: np.ndarray):
+        if len(postings) == 0:
+            self._conn.execute(
+                "DELETE FROM postings WHERE term = ? AND block = ?", (term, block)
+            )
+            return
+        self._conn.execute(
+            "INSERT OR REPLACE INTO postings (term, block, data) VALUES (?, ?, ?)",
+            (term, block, postings.tobytes()),
+        )
+
+    def _counters(self) -> Tuple[int, int]:
+        values = dict(self._conn.execute("SELECT name, value FROM counters"))
+        return values.get("sections", 0), values.get("total_length", 0)
+
+    def _add_counters(self, sections: int, total_length: int):
+        self._conn.executemany(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [("sections", sections), ("total_length", total_length)],
+        )
+
+    def _snippet(self, content: str, terms: List[str]) -> str:
+        """截取最早命中检索词附近的正文（只在开头 snippet_scan_chars 内查找）"""
+        normalized = unicodedata.normalize(
+            "NFKC", content[: self.snippet_scan_chars]
+        ).lower()
+        positions = [normalized.find(term) for term in terms]
+        first = min((pos for pos in positions if pos >= 0), default=0)
+        # NFKC 可能改变长度，仅用作大致位置
+        start = max(0, min(first - self.snippet_chars // 4, len(content) - 1))
+        return content[start : start + self.snippet_chars].strip()
+
+    @contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
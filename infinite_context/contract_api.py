@@ -3,28 +3,64 @@
 合同审核 API 服务
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import JSONResponse
-from typing import List, Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
 import asyncio
+import hashlib
 import uuid
 import json
+from dataclasses import asdict
 from datetime import datetime
 import os
 
-from dify_contract_reviewer import DifyLongContextContractReviewer
+from admission_control import AdmissionController
+from clause_search import ClauseSearchIndex
 from deployment_config import LongContextConfig
-
-app = FastAPI(title="长上下文合同审核系统", version="1.0.0")
+from metrics import get_registry
+from model_router import get_router
+from response_cache import WorkflowResponseCache
+from review_worker import start_workers, stop_workers
+from task_events import TERMINAL_STATUSES, TaskEventBroadcaster
+from task_queue import create_task_queue
+from token_estimator import TokenEstimator
 
 # 全局配置
-reviewer = DifyLongContextContractReviewer(
-    dify_api_base=os.getenv("DIFY_API_BASE", "https://api.dify.ai/v1"),
-    api_key=os.getenv("DIFY_API_KEY", "default-key"),
+token_estimator = TokenEstimator()
+
+# 任务状态和审核作业队列（TASK_QUEUE.backend 选择 SQLite 或 Redis），
+# 审核由 review_worker 工作进程执行
+task_queue = create_task_queue()
+
+# 审核在工作进程中执行，API 进程只读取响应缓存的累计统计
+response_cache = WorkflowResponseCache.from_config()
+
+# 审核请求准入控制（ADMISSION_CONTROL.enabled 为 False 时为 None）
+admission = AdmissionController.from_config(task_queue)
+
+# 条款全文索引（由工作进程在处理合同时写入，未启用时为 None）
+clause_search = ClauseSearchIndex.from_config()
+
+# 长轮询和 SSE 共用的任务状态广播（每个 API 进程一个轮询协程）
+task_events = TaskEventBroadcaster(
+    task_queue, LongContextConfig.TASK_QUEUE["event_poll_interval_seconds"]
 )
 
-# 任务状态存储（生产环境建议使用 Redis）
-task_status = {}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 本地部署时随 API 启动工作进程；独立部署工作进程时 embedded_workers 为 0
+    workers = start_workers(LongContextConfig.TASK_QUEUE["embedded_workers"])
+    yield
+    await task_events.close()
+    await asyncio.to_thread(stop_workers, workers)
+    task_queue.close()
+    if response_cache is not None:
+        response_cache.close()
+
+
+app = FastAPI(title="长上下文合同审核系统", version="1.0.0", lifespan=lifespan)
 
 
 @app.post("/api/contracts/upload")
@@ -42,25 +78,114 @@ async def upload_contracts(files: List[UploadFile] = File(...)):
                 status_code=400, detail=f"不支持的文件格式: {file.filename}"
             )
 
-        # 保存文件
-        file_path = f"/tmp/contract_processing/{uuid.uuid4()}_{file.filename}"
-        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # 分块写入磁盘，按内容哈希去重
+        saved = await save_upload(file)
 
-        with open(file_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
+        # 新文件提交预处理作业，审核前完成文本提取和 token 计数
+        if (
+            not saved["deduplicated"]
+            and LongContextConfig.FILE_PROCESSING["warm_cache_on_upload"]
+        ):
+            saved["prepare_task_id"] = await submit_prepare_job(
+                saved["path"], saved["content_hash"]
+            )
 
-        uploaded_files.append(
-            {"filename": file.filename, "path": file_path, "size": len(content)}
-        )
+        uploaded_files.append({"filename": file.filename, **saved})
 
     return {"message": "文件上传成功", "files": uploaded_files}
 
 
+async def save_upload(file: UploadFile) -> Dict[str, Any]:
+    """将上传文件按固定大小分块写入磁盘，同时增量计算 SHA-256
+
+    文件以内容哈希命名，已存在相同内容时直接复用；超过 max_file_size_mb
+    时删除已写入部分并返回 413。
+    """
+    settings = LongContextConfig.FILE_PROCESSING
+    max_bytes = settings["max_file_size_mb"] * 1024 * 1024
+    upload_dir = settings["upload_storage_path"]
+    os.makedirs(upload_dir, exist_ok=True)
+
+    temp_path = os.path.join(upload_dir, f".{uuid.uuid4()}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(temp_path, "wb") as f:
+            while chunk := await file.read(settings["upload_chunk_bytes"]):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"文件超过 {settings['max_file_size_mb']} MB: {file.filename}",
+                    )
+                digest.update(chunk)
+                f.write(chunk)
+
+        content_hash = digest.hexdigest()
+        extension = os.path.splitext(file.filename or "")[1]
+        file_path = os.path.join(upload_dir, f"{content_hash}{extension}")
+        deduplicated = os.path.exists(file_path)
+        if deduplicated:
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    return {
+        "path": file_path,
+        "size": size,
+        "content_hash": content_hash,
+        "deduplicated": deduplicated,
+    }
+
+
+async def submit_prepare_job(file_path: str, content_hash: str) -> str:
+    """提交预处理作业，返回任务 ID"""
+    task_id = str(uuid.uuid4())
+    await asyncio.to_thread(
+        task_queue.create_task,
+        task_id,
+        {
+            "status": "queued",
+            "created_at": datetime.now().isoformat(),
+            "file_path": file_path,
+            "progress": 0,
+        },
+        {
+            "task_id": task_id,
+            "kind": "prepare",
+            "file_path": file_path,
+            "content_hash": content_hash,
+        },
+    )
+    return task_id
+
+
+async def admit_review(
+    workflow_id: str, file_paths: List[str], kind: str
+) -> Dict[str, Any]:
+    """预估作业 token 数并做准入检查，返回写入作业的字段；超载时返回 429"""
+    if admission is None:
+        return {}
+    file_info = await asyncio.to_thread(token_estimator.estimate_files, file_paths)
+    estimated_tokens = sum(info["estimated_tokens"] for info in file_info)
+    decision = await asyncio.to_thread(
+        admission.admit, workflow_id, estimated_tokens, kind
+    )
+    if not decision.admitted:
+        raise HTTPException(
+            status_code=429,
+            detail=decision.reason,
+            headers={"Retry-After": str(decision.retry_after)},
+        )
+    return {"estimated_tokens": estimated_tokens, "priority": decision.priority}
+
+
 @app.post("/api/contracts/review/single")
-async def review_single_contract(
-    background_tasks: BackgroundTasks, file_path: str, workflow_id: Optional[str] = None
-):
+async def review_single_contract(file_path: str, workflow_id: Optional[str] = None):
     """审核单个合同"""
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail="文件不存在")
@@ -72,25 +197,33 @@ async def review_single_contract(
     if not workflow_id:
         workflow_id = LongContextConfig.DIFY_WORKFLOWS["contract_review"]["workflow_id"]
 
-    # 初始化任务状态
-    task_status[task_id] = {
-        "status": "processing",
-        "created_at": datetime.now().isoformat(),
-        "file_path": file_path,
-        "progress": 0,
-    }
-
-    # 启动后台任务
-    background_tasks.add_task(process_single_contract, task_id, file_path, workflow_id)
+    admitted = await admit_review(workflow_id, [file_path], "single")
+
+    # 初始化任务状态并提交审核作业
+    await asyncio.to_thread(
+        task_queue.create_task,
+        task_id,
+        {
+            "status": "queued",
+            "created_at": datetime.now().isoformat(),
+            "file_path": file_path,
+            "progress": 0,
+        },
+        {
+            "task_id": task_id,
+            "kind": "single",
+            "file_path": file_path,
+            "workflow_id": workflow_id,
+            **admitted,
+        },
+    )
 
     return {"task_id": task_id, "status": "started"}
 
 
 @app.post("/api/contracts/review/batch")
 async def review_batch_contracts(
-    background_tasks: BackgroundTasks,
-    file_paths: List[str],
-    workflow_id: Optional[str] = None,
+    file_paths: List[str], workflow_id: Optional[str] = None
 ):
     """批量审核合同"""
     # 验证所有文件是否存在
@@ -107,47 +240,145 @@ async def review_batch_contracts(
             "workflow_id"
         ]
 
-    # 初始化任务状态
-    task_status[task_id] = {
-        "status": "processing",
-        "created_at": datetime.now().isoformat(),
-        "file_paths": file_paths,
-        "progress": 0,
-        "total_files": len(file_paths),
-    }
-
-    # 启动后台任务
-    background_tasks.add_task(process_batch_contracts, task_id, file_paths, workflow_id)
+    admitted = await admit_review(workflow_id, file_paths, "batch")
+
+    # 初始化任务状态并提交审核作业
+    await asyncio.to_thread(
+        task_queue.create_task,
+        task_id,
+        {
+            "status": "queued",
+            "created_at": datetime.now().isoformat(),
+            "file_paths": file_paths,
+            "progress": 0,
+            "total_files": len(file_paths),
+        },
+        {
+            "task_id": task_id,
+            "kind": "batch",
+            "file_paths": file_paths,
+            "workflow_id": workflow_id,
+            **admitted,
+        },
+    )
 
     return {"task_id": task_id, "status": "started", "total_files": len(file_paths)}
 
 
 @app.get("/api/contracts/status/{task_id}")
-async def get_task_status(task_id: str):
-    """获取任务状态"""
-    if task_id not in task_status:
+async def get_task_status(
+    task_id: str, wait_seconds: float = 0, since_revision: int = -1
+):
+    """获取任务状态
+
+    wait_seconds > 0 时为长轮询：等到任务 revision 超过 since_revision
+    （或任务结束、超时）再返回。
+    """
+    if wait_seconds > 0:
+        wait_seconds = min(
+            wait_seconds, LongContextConfig.TASK_QUEUE["long_poll_max_seconds"]
+        )
+        status = await task_events.wait_for_update(
+            task_id, since_revision, wait_seconds
+        )
+    else:
+        status = await asyncio.to_thread(task_queue.get_task, task_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="任务不存在")
 
-    return task_status[task_id]
+    return status
+
+
+@app.get("/api/contracts/events/{task_id}")
+async def stream_task_events(task_id: str, last_event_id: Optional[str] = Header(None)):
+    """以 SSE 推送任务进度（事件 id 为任务 revision，断线重连时从 Last-Event-ID 继续）"""
+    if await asyncio.to_thread(task_queue.get_task, task_id) is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    since_revision = (
+        int(last_event_id) if last_event_id and last_event_id.isdigit() else -1
+    )
+
+    async def event_source():
+        async for status in task_events.stream(
+            task_id,
+            since_revision,
+            LongContextConfig.TASK_QUEUE["sse_heartbeat_seconds"],
+        ):
+            if status is None:
+                yield ": keep-alive\n\n"
+                continue
+            # 审核结果可能很大，通过 /api/contracts/result 获取
+            data = {key: value for key, value in status.items() if key != "result"}
+            event = (
+                status["status"]
+                if status["status"] in TERMINAL_STATUSES
+                else "progress"
+            )
+            yield (
+                f"id: {status['revision']}\nevent: {event}\n"
+                f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+            )
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/api/contracts/result/{task_id}")
 async def get_review_result(task_id: str):
     """获取审核结果"""
-    if task_id not in task_status:
+    status = await asyncio.to_thread(task_queue.get_task, task_id)
+    if status is None:
         raise HTTPException(status_code=404, detail="任务不存在")
 
-    status = task_status[task_id]
     if status["status"] != "completed":
         raise HTTPException(status_code=400, detail="任务尚未完成")
 
     return status.get("result", {})
 
 
+@app.get("/api/clauses/search")
+async def search_clauses(q: str, limit: int = 20):
+    """检索已处理合同中与 q 相似的条款，按相关度排序"""
+    if clause_search is None:
+        raise HTTPException(status_code=404, detail="条款检索未启用")
+    limit = max(1, min(limit, 100))
+    hits = await asyncio.to_thread(clause_search.search, q, limit)
+    return {"query": q, "hits": [asdict(hit) for hit in hits]}
+
+
+@app.delete("/api/clauses/documents/{content_hash}")
+async def remove_clause_document(content_hash: str):
+    """从条款索引中删除合同（按内容哈希）"""
+    if clause_search is None:
+        raise HTTPException(status_code=404, detail="条款检索未启用")
+    if not await asyncio.to_thread(clause_search.remove_document, content_hash):
+        raise HTTPException(status_code=404, detail="合同未被索引")
+    return {"content_hash": content_hash, "removed": True}
+
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """获取 Dify 工作流响应缓存的命中统计"""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.to_thread(response_cache.stats)}
+
+
 @app.get("/api/models/info")
 async def get_model_info():
-    """获取可用模型信息"""
-    return {"models": LongContextConfig.MODELS}
+    """获取可用模型信息和当前进程的路由统计"""
+    return {"models": LongContextConfig.MODELS, "routing": get_router().stats()}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 格式的运行指标（合并 API 和各工作进程）"""
+    text = await asyncio.to_thread(get_registry().render)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 
 @app.post("/api/contracts/estimate-cost")
@@ -155,20 +386,9 @@ async def estimate_processing_cost(
     file_paths: List[str], model_name: Optional[str] = None
 ):
     """估算处理成本"""
-    total_tokens = 0
-    file_info = []
-
-    for file_path in file_paths:
-        if not os.path.exists(file_path):
-            continue
-
-        # 简单估算（实际应该使用 tiktoken）
-        with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-            content = f.read()
-            token_count = len(content) // 4  # 粗略估算
-
-        total_tokens += token_count
-        file_info.append({"file_path": file_path, "estimated_tokens": token_count})
+    # 抽样精确编码并外推，避免完整解析和编码所有文件
+    file_info = await asyncio.to_thread(token_estimator.estimate_files, file_paths)
+    total_tokens = sum(info["estimated_tokens"] for info in file_info)
 
     # 选择最优模型
     if not model_name:
@@ -182,65 +402,11 @@ async def estimate_processing_cost(
         "recommended_model": model_name,
         "estimated_cost_usd": estimated_cost,
         "file_breakdown": file_info,
+        # 不存在或无法读取的文件不计入 total_tokens
+        "failed_files": [info for info in file_info if info["method"] == "error"],
     }
 
 
-async def process_single_contract(task_id: str, file_path: str, workflow_id: str):
-    """处理单个合同的后台任务"""
-    try:
-        task_status[task_id]["progress"] = 10
-
-        # 执行审核
-        result = reviewer.review_single_contract(file_path, workflow_id)
-
-        task_status[task_id].update(
-            {
-                "status": "completed",
-                "progress": 100,
-                "result": result,
-                "completed_at": datetime.now().isoformat(),
-            }
-        )
-
-    except Exception as e:
-        task_status[task_id].update(
-            {
-                "status": "failed",
-                "error": str(e),
-                "failed_at": datetime.now().isoformat(),
-            }
-        )
-
-
-async def process_batch_contracts(
-    task_id: str, file_paths: List[str], workflow_id: str
-):
-    """处理批量合同的后台任务"""
-    try:
-        task_status[task_id]["progress"] = 10
-
-        # 执行批量审核
-        result = reviewer.review_multiple_contracts(file_paths, workflow_id)
-
-        task_status[task_id].update(
-            {
-                "status": "completed",
-                "progress": 100,
-                "result": result,
-                "completed_at": datetime.now().isoformat(),
-            }
-        )
-
-    except Exception as e:
-        task_status[task_id].update(
-            {
-                "status": "failed",
-                "error": str(e),
-                "failed_at": datetime.now().isoformat(),
-            }
-        )
-
-
 if __name__ == "__main__":
     import uvicorn
 
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+合同处理结果缓存 - 基于文件内容哈希的本地磁盘 LRU 缓存
+"""
+
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+
+class DiskLRUCache:
+    """基于 SQLite 的容量受限 LRU 磁盘缓存，缓存项可设置过期时间
+
+    同一数据库文件可被多个进程共享；counters 表保存跨进程累计的统计计数，
+    usage 表保存由触发器维护的缓存总字节数，写入时不必汇总全表。
+    """
+
+    def __init__(self, db_path: str, max_size_mb: int = 512):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL
+            )
+            """
+        )
+        # 兼容没有 expires_at 列的旧缓存库
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(entries)")}
+        if "expires_at" not in columns:
+            self._conn.execute("ALTER TABLE entries ADD COLUMN expires_at REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_entries_expires ON entries(expires_at)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """
+        )
+        self._create_usage_table()
+
+    def _create_usage_table(self):
+        """创建总字节数表和维护它的触发器；已有缓存库只在首次升级时汇总一次"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS usage ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO usage (id, total_size) "
+                "SELECT 0, COALESCE(SUM(size), 0) FROM entries"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_usage_insert "
+                "AFTER INSERT ON entries BEGIN "
+                "UPDATE usage SET total_size = total_size + NEW.size WHERE id = 0; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_usage_update "
+                "AFTER UPDATE OF size ON entries BEGIN "
+                "UPDATE usage SET total_size = total_size - OLD.size + NEW.size "
+                "WHERE id = 0; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS entries_usage_delete "
+                "AFTER DELETE ON entries BEGIN "
+                "UPDATE usage SET total_size = total_size - OLD.size WHERE id = 0; END"
+            )
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存并刷新访问时间，已过期的缓存项视为不存在并删除"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            return row[0]
+
+    def set(self, key: str, value: bytes, ttl_seconds: Optional[float] = None):
+        """写入缓存，超出容量时先清理过期项，再按最近最少使用淘汰"""
+        if len(value) > self.max_size_bytes:
+            return
+
+        now = time.time()
+        expires_at = now + ttl_seconds if ttl_seconds is not None else None
+        with self._lock:
+            # 使用 UPSERT 而不是 INSERT OR REPLACE：REPLACE 删除旧行时不触发
+            # 删除触发器，总字节数会偏大
+            self._conn.execute(
+                "INSERT INTO entries (key, value, size, accessed_at, expires_at) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "value = excluded.value, size = excluded.size, "
+                "accessed_at = excluded.accessed_at, expires_at = excluded.expires_at",
+                (key, value, len(value), now, expires_at),
+            )
+            if self._total_size() > self.max_size_bytes:
+                self._evict()
+
+    def delete(self, key: str):
+        """删除缓存项"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def increment(self, name: str, delta: int = 1):
+        """累加统计计数"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO counters (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                (name, delta),
+            )
+
+    def add_counters(self, deltas: Dict[str, int]):
+        """在一个事务中累加多个统计计数"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO counters (name, value) VALUES (?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                    deltas.items(),
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def counters(self) -> Dict[str, int]:
+        """读取全部统计计数"""
+        with self._lock:
+            return dict(self._conn.execute("SELECT name, value FROM counters"))
+
+    def entry_count(self) -> int:
+        """当前缓存项数"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def total_size(self) -> int:
+        """当前缓存占用字节数"""
+        with self._lock:
+            return self._total_size()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _total_size(self) -> int:
+        return self._conn.execute(
+            "SELECT total_size FROM usage WHERE id = 0"
+        ).fetchone()[0]
+
+    def _evict(self):
+        self._conn.execute(
+            "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?",
+            (time.time(),),
+        )
+        excess = self._total_size() - self.max_size_bytes
+        if excess <= 0:
+            return
+
+        rows = self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at ASC"
+        )
+        victims = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            victims.append((key,))
+            excess -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", victims)
+
+
+class ContractCache:
+    """合同处理结果缓存，键为文件内容哈希 + 处理器配置"""
+
+    def __init__(self, cache_dir: str, max_size_mb: int = 512):
+        self.store = DiskLRUCache(os.path.join(cache_dir, "contracts.db"), max_size_mb)
+
+    @staticmethod
+    def hash_file(file_path: str, chunk_size: int = 1024 * 1024) -> str:
+        """流式计算文件内容的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @staticmethod
+    def make_key(content_hash: str, settings: Dict[str, Any]) -> str:
+        """由内容哈希和处理器配置生成缓存键"""
+        payload = json.dumps(settings, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{content_hash}:{payload}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取处理结果"""
+        value = self.store.get(key)
+        if value is None:
+            return None
+        return json.loads(zlib.decompress(value))
+
+    def set(self, key: str, result: Dict[str, Any]):
+        """保存处理结果（文本、token 数、章节）"""
+        data = json.dumps(result, ensure_ascii=False).encode("utf-8")
+        self.store.set(key, zlib.compress(data, 1))
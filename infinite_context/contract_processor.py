@@ -4,12 +4,87 @@
 """
 
 import os
+import re
+import io
+import hashlib
 import json
-from typing import List, Dict, Any
+import mmap
+import multiprocessing
+import threading
+import codecs
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ElementTree
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Iterator, Optional, Pattern, Tuple
 from dataclasses import dataclass
 import tiktoken
 import PyPDF2
-from docx import Document
+
+from clause_search import ClauseSearchIndex
+from contract_cache import ContractCache
+from metrics import get_registry, measure
+
+
+class SectionView:
+    """合同章节视图
+
+    章节以 (start, end, title) 区间引用共享的文档缓冲区，只有访问 content
+    时才切片生成字符串，避免每个章节再保存一份正文副本。同时兼容原有的
+    section["title"] / section["content"] 字典式访问。
+    """
+
+    __slots__ = ("buffer", "start", "end", "title", "source_document", "token_count")
+
+    def __init__(
+        self,
+        buffer: str,
+        start: int,
+        end: int,
+        title: str,
+        source_document: Optional[str] = None,
+        token_count: Optional[int] = None,
+    ):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+        self.title = title
+        self.source_document = source_document
+        # 章节 token 数，计算一次后随章节缓存
+        self.token_count = token_count
+
+    @property
+    def content(self) -> str:
+        return self.buffer[self.start : self.end]
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in ("title", "content", "source_document"):
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self) -> Dict[str, str]:
+        """转换为普通字典（会生成正文副本）"""
+        section = {"title": self.title, "content": self.content}
+        if self.source_document is not None:
+            section["source_document"] = self.source_document
+        return section
+
+    def __repr__(self) -> str:
+        return f"SectionView(start={self.start}, end={self.end}, title={self.title!r})"
 
 
 @dataclass
@@ -19,14 +94,301 @@ class ContractDocument:
     content: str
     metadata: Dict[str, Any]
     token_count: int
-    sections: List[Dict[str, str]]
+    sections: List[SectionView]
+
+
+# cl100k 预分词在“换行符之后、下一行以非空白字符开头”的位置总会切开，
+# 在这些位置两侧分别编码的 token 数之和与整体编码完全一致
+_TOKEN_BOUNDARY_START = re.compile(r"[^\S\r\n]*\S")
+
+
+def token_boundary_at(buffer: str, pos: int) -> bool:
+    """判断 pos 是否为安全的 token 切分点"""
+    if pos <= 0 or pos >= len(buffer):
+        return True
+    return (
+        buffer[pos - 1] == "\n" and _TOKEN_BOUNDARY_START.match(buffer, pos) is not None
+    )
+
+
+def _last_token_boundary(buffer: str, start: int, end: int) -> int:
+    """[start, end) 内最后一个安全切分点，不存在时返回 start"""
+    pos = end
+    while True:
+        i = buffer.rfind("\n", start, pos)
+        if i < 0:
+            return start
+        if _TOKEN_BOUNDARY_START.match(buffer, i + 1, end):
+            return i + 1
+        pos = i
+
+
+def _first_token_boundary(buffer: str, start: int, end: int) -> int:
+    """[start, end) 内第一个安全切分点，不存在时返回 end"""
+    pos = start
+    while True:
+        i = buffer.find("\n", pos, end)
+        if i < 0:
+            return end
+        if _TOKEN_BOUNDARY_START.match(buffer, i + 1, end):
+            return i + 1
+        pos = i + 1
+
+
+def token_windows(
+    buffer: str, start: int, end: int, window: int
+) -> List[Tuple[int, int]]:
+    """将 [start, end) 在安全切分点切成约 window 个字符的区间
+
+    各区间分别编码的 token 数之和与整体编码一致；窗口内没有安全切分点
+    （超长单行）时延伸到其后第一个切分点。
+    """
+    windows = []
+    while end - start > window:
+        cut = _last_token_boundary(buffer, start, start + window)
+        if cut == start:
+            cut = _first_token_boundary(buffer, start + window, end)
+        windows.append((start, cut))
+        start = cut
+    if start < end or not windows:
+        windows.append((start, end))
+    return windows
+
+
+def read_text_file(file_path: str, chunk_bytes: int = 1024 * 1024) -> str:
+    """以内存映射读取 UTF-8 文本文件，结果与文本模式 open().read() 一致
+
+    不含 \r 时直接从映射区解码，不再先读出一份完整的 bytes；含 \r 时
+    按块增量解码并转换换行符。
+    """
+    with open(file_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped.find(b"\r") < 0:
+                return str(mapped, "utf-8")
+            decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder("utf-8")(), translate=True
+            )
+            parts = []
+            with memoryview(mapped) as view:
+                for offset in range(0, len(view), chunk_bytes):
+                    parts.append(decoder.decode(view[offset : offset + chunk_bytes]))
+            parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_OFFICE_DOCUMENT_TYPE = (
+    "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+)
+
+
+def docx_main_part(archive: zipfile.ZipFile) -> str:
+    """从包关系中找到主文档部件，通常为 word/document.xml"""
+    try:
+        with archive.open("_rels/.rels") as rels:
+            for relationship in ElementTree.parse(rels).getroot():
+                if relationship.get("Type") == _OFFICE_DOCUMENT_TYPE:
+                    return posixpath.normpath(relationship.get("Target").lstrip("/"))
+    except KeyError:
+        pass
+    return "word/document.xml"
+
+
+def _docx_run_text(run: ElementTree.Element) -> str:
+    """与 python-docx 的 Run.text 一致：文本、制表符、换行和不换行连字符"""
+    parts = []
+    for child in run:
+        tag = child.tag
+        if tag == f"{_W}t":
+            parts.append(child.text or "")
+        elif tag in (f"{_W}tab", f"{_W}ptab"):
+            parts.append("\t")
+        elif tag == f"{_W}cr":
+            parts.append("\n")
+        elif tag == f"{_W}br":
+            # 分页符、分栏符不产生文本
+            if child.get(f"{_W}type", "textWrapping") == "textWrapping":
+                parts.append("\n")
+        elif tag == f"{_W}noBreakHyphen":
+            parts.append("-")
+    return "".join(parts)
+
+
+def _docx_paragraph_text(paragraph: ElementTree.Element) -> str:
+    """与 python-docx 的 Paragraph.text 一致：直属的 run 和超链接中的 run"""
+    parts = []
+    for child in paragraph:
+        if child.tag == f"{_W}r":
+            parts.append(_docx_run_text(child))
+        elif child.tag == f"{_W}hyperlink":
+            parts.extend(_docx_run_text(run) for run in child if run.tag == f"{_W}r")
+    return "".join(parts)
+
+
+def iter_docx_paragraphs(file_path: str) -> Iterator[str]:
+    """流式产出 DOCX 正文段落文本（与 python-docx Document.paragraphs 相同）
+
+    从压缩包中增量解析主文档 XML，只保留当前正文块（段落或表格）的元素，
+    处理后立即丢弃，不构建整个文档树。
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        with archive.open(docx_main_part(archive)) as part:
+            depth = 0
+            body = None
+            for event, element in ElementTree.iterparse(part, ("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if element.tag == f"{_W}body" and depth == 2:
+                        body = element
+                    continue
+                depth -= 1
+                # 正文的直接子元素（段落、表格等）解析完成
+                if body is not None and depth == 2:
+                    if element.tag == f"{_W}p":
+                        yield _docx_paragraph_text(element)
+                    body.remove(element)
+
+
+def _extract_pdf_page_range(file_path: str, start: int, end: int) -> List[str]:
+    """提取PDF指定页码区间 [start, end) 的文本（在子进程中执行）"""
+    with open(file_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        return [reader.pages[i].extract_text() for i in range(start, end)]
+
+
+# 批量导入子进程内复用的处理器（由 _init_ingest_worker 创建）
+_ingest_processor = None
+
+
+def _init_ingest_worker(model_name: str):
+    """导入进程池初始化：每个子进程只加载一次编码器"""
+    global _ingest_processor
+    # 文件间已并行，子进程内按页顺序提取（不会创建 PDF 进程池），也不启用编码线程
+    _ingest_processor = LongContextContractProcessor(
+        model_name, pdf_workers=1, token_threads=1
+    )
+
+
+def _ingest_contract(file_path: str) -> Tuple[str, int, List[list], Dict[str, float]]:
+    """在子进程中解析、分章并计算 token 数，返回可序列化的结果和各阶段耗时"""
+    timings: Dict[str, float] = {}
+    content, token_count, sections = _ingest_processor.extract_and_count(
+        file_path, timings
+    )
+    return content, token_count, section_records(sections), timings
+
+
+def section_records(sections: List["SectionView"]) -> List[list]:
+    """章节的可序列化表示 [start, end, title, token_count]（缓存和进程间传递）"""
+    return [[s.start, s.end, s.title, s.token_count] for s in sections]
+
+
+def compile_section_pattern(markers: List[str]) -> Pattern[str]:
+    """将章节标记编译为单个正则（多模式匹配）"""
+    return re.compile("|".join(re.escape(marker) for marker in markers))
+
+
+def find_section_bounds(text: str, pattern: Pattern[str]) -> List[Tuple[int, int, str]]:
+    """单次扫描定位章节边界
+
+    含章节标记的行作为新章节的起始行，返回覆盖全文的 (start, end, title)
+    偏移区间，调用方按需切片，扫描过程中不复制章节文本。
+    """
+    starts = []
+    search = pattern.search
+    pos = 0
+    while True:
+        match = search(text, pos)
+        if match is None:
+            break
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        line_end = text.find("\n", match.end())
+        if line_end < 0:
+            line_end = len(text)
+        starts.append((line_start, text[line_start:line_end].strip()[:50]))
+        # 同一行只需命中一次，直接跳到下一行
+        pos = line_end + 1
+
+    bounds = []
+    first_start = starts[0][0] if starts else len(text)
+    if first_start > 0:
+        bounds.append((0, first_start, "开头"))
+    for i, (start, title) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(text)
+        bounds.append((start, end, title))
+    return bounds
 
 
 class LongContextContractProcessor:
     """长上下文合同处理器"""
 
-    def __init__(self, model_name: str = "gpt-4-turbo"):
+    # 基于常见合同结构分割
+    SECTION_MARKERS = [
+        "第一条",
+        "第二条",
+        "第三条",
+        "第四条",
+        "第五条",
+        "甲方",
+        "乙方",
+        "丙方",
+        "1.",
+        "2.",
+        "3.",
+        "4.",
+        "5.",
+        "一、",
+        "二、",
+        "三、",
+        "四、",
+        "五、",
+        "条款",
+        "协议",
+        "附件",
+        "补充说明",
+    ]
+
+    # 缓存数据格式版本，处理结果结构变化时递增
+    CACHE_VERSION = 3
+
+    def __init__(
+        self,
+        model_name: str = "gpt-4-turbo",
+        pdf_workers: Optional[int] = None,
+        pdf_pages_per_task: int = 16,
+        pdf_parallel_min_pages: int = 64,
+        cache: Optional[ContractCache] = None,
+        token_batch_size: int = 64,
+        token_threads: int = 8,
+        token_window_chars: int = 256 * 1024,
+        ingest_workers: Optional[int] = None,
+        ingest_parallel_min_files: int = 4,
+        search_index: Optional[ClauseSearchIndex] = None,
+    ):
         self.model_name = model_name
+        self.cache = cache
+        # 处理过的合同章节写入全文索引
+        self.search_index = search_index
+        # 章节 token 计数按批次多线程编码
+        self.token_batch_size = token_batch_size
+        self.token_threads = token_threads
+        # 长文本按安全切分点分段编码，限制 token 列表的内存占用
+        self.token_window_chars = token_window_chars
+        # PDF 分页并行提取配置：页数达到阈值时按页码区间分发到进程池
+        self.pdf_workers = pdf_workers or os.cpu_count() or 1
+        self.pdf_pages_per_task = pdf_pages_per_task
+        self.pdf_parallel_min_pages = pdf_parallel_min_pages
+        # 批量导入：未命中缓存的文件数达到阈值时分发到进程池
+        self.ingest_workers = ingest_workers or os.cpu_count() or 1
+        self.ingest_parallel_min_files = ingest_parallel_min_files
+        # PDF 提取（"pdf"）和批量导入（"ingest"）进程池在首次需要时创建，同一
+        # 处理器复用；以 spawn 启动，避免在已有 to_thread 线程、指标刷新线程和
+        # SQLite 锁的进程中 fork
+        self._executors: Dict[str, ProcessPoolExecutor] = {}
+        self._executor_lock = threading.Lock()
+        self._section_pattern = compile_section_pattern(self.SECTION_MARKERS)
         self.encoding = tiktoken.encoding_for_model("gpt-4")
         self.max_context_length = {
             "gpt-4-turbo": 128000,
@@ -34,87 +396,311 @@ class LongContextContractProcessor:
             "gemini-1.5-pro": 1000000,
         }
 
-    def extract_text_from_pdf(self, file_path: str) -> str:
-        """从PDF提取文本"""
-        text = ""
+    def iter_pdf_pages(self, file_path: str) -> Iterator[str]:
+        """按页流式提取PDF文本，大文件按页码区间分发到进程池"""
         with open(file_path, "rb") as file:
             reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() + "\n"
-        return text
+            page_count = len(reader.pages)
+            if self.pdf_workers <= 1 or page_count < self.pdf_parallel_min_pages:
+                for page in reader.pages:
+                    yield page.extract_text()
+                return
+
+        yield from self._iter_pdf_pages_parallel(file_path, page_count)
+
+    def _iter_pdf_pages_parallel(
+        self, file_path: str, page_count: int
+    ) -> Iterator[str]:
+        """多进程提取PDF页面，按页序产出，最多同时保留 2 * workers 个区间的结果"""
+        ranges = [
+            (start, min(start + self.pdf_pages_per_task, page_count))
+            for start in range(0, page_count, self.pdf_pages_per_task)
+        ]
+        workers = min(self.pdf_workers, len(ranges))
+        executor = self._get_executor("pdf")
+        pending = deque()
+        try:
+            for start, end in ranges:
+                pending.append(
+                    executor.submit(_extract_pdf_page_range, file_path, start, end)
+                )
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        except BrokenProcessPool:
+            # 子进程异常退出后进程池不可再用，丢弃后下次重新创建
+            self._discard_executor("pdf", executor)
+            raise
+        finally:
+            # 提前结束迭代时取消尚未开始的区间，进程池保留给后续文件
+            for future in pending:
+                future.cancel()
+
+    def _get_executor(self, kind: str) -> ProcessPoolExecutor:
+        """获取（必要时创建）进程池"""
+        with self._executor_lock:
+            if kind not in self._executors:
+                self._executors[kind] = self._create_executor(kind)
+            return self._executors[kind]
+
+    def _create_executor(self, kind: str) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context("spawn")
+        if kind == "ingest":
+            # 每个子进程只加载一次编码器
+            return ProcessPoolExecutor(
+                max_workers=self.ingest_workers,
+                mp_context=context,
+                initializer=_init_ingest_worker,
+                initargs=(self.model_name,),
+            )
+        return ProcessPoolExecutor(max_workers=self.pdf_workers, mp_context=context)
+
+    def _discard_executor(self, kind: str, executor: ProcessPoolExecutor):
+        """丢弃不可再用的进程池（子进程异常退出），下次使用时重新创建"""
+        with self._executor_lock:
+            if self._executors.get(kind) is executor:
+                del self._executors[kind]
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """关闭 PDF 提取和批量导入进程池"""
+        with self._executor_lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def extract_text_from_pdf(self, file_path: str) -> str:
+        """从PDF提取文本"""
+        return "".join(f"{page}\n" for page in self.iter_pdf_pages(file_path))
 
     def extract_text_from_docx(self, file_path: str) -> str:
-        """从DOCX提取文本"""
-        doc = Document(file_path)
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        """从DOCX提取文本（流式解析段落）"""
+        return "\n".join(iter_docx_paragraphs(file_path))
 
     def count_tokens(self, text: str) -> int:
-        """计算token数量"""
-        return len(self.encoding.encode(text))
+        """计算token数量（长文本分段编码，结果与整体编码一致）"""
+        if len(text) <= self.token_window_chars:
+            return len(self.encoding.encode_ordinary(text))
+        return sum(
+            len(self.encoding.encode_ordinary(text[start:end]))
+            for start, end in token_windows(text, 0, len(text), self.token_window_chars)
+        )
+
+    def count_section_tokens(self, sections: List[SectionView]) -> int:
+        """计算章节 token 数并返回全文精确 token 数
 
-    def split_into_sections(self, text: str) -> List[Dict[str, str]]:
+        只编码 token_count 为空的章节（按批次多线程编码），已有计数的章节
+        直接复用，因此新增或修改章节后的重新计数只需编码变化部分。超长
+        章节在安全切分点切成多个窗口；每批最多 token_batch_size 个窗口、
+        约 token_window_chars × token_threads 个字符，同时存在的 token 列表
+        大小与文档长度无关。
+        """
+        pending = [section for section in sections if section.token_count is None]
+        for section in pending:
+            section.token_count = 0
+
+        batch_chars = self.token_window_chars * self.token_threads
+        batch: List[Tuple[SectionView, int, int]] = []
+        size = 0
+        for section in pending:
+            for start, end in token_windows(
+                section.buffer, section.start, section.end, self.token_window_chars
+            ):
+                batch.append((section, start, end))
+                size += end - start
+                if len(batch) >= self.token_batch_size or size >= batch_chars:
+                    self._count_windows(batch)
+                    batch, size = [], 0
+        self._count_windows(batch)
+        return self.combine_token_counts(sections)
+
+    def _count_windows(self, windows: List[Tuple[SectionView, int, int]]):
+        """多线程编码一批窗口，token 数累加到所属章节"""
+        if not windows:
+            return
+        encoded = self.encoding.encode_ordinary_batch(
+            [section.buffer[start:end] for section, start, end in windows],
+            num_threads=self.token_threads,
+        )
+        for (section, _, _), tokens in zip(windows, encoded):
+            section.token_count += len(tokens)
+
+    def combine_token_counts(self, segments: List[SectionView]) -> int:
+        """合并同一缓冲区上首尾相接片段的 token 数
+
+        片段之间是安全切分点时直接相加；否则只重新编码接缝两侧到最近安全
+        切分点之间的局部文本进行修正，结果与整体编码一致。
+        """
+        total = 0
+        i = 0
+        while i < len(segments):
+            j = i
+            while j + 1 < len(segments) and not token_boundary_at(
+                segments[j + 1].buffer, segments[j + 1].start
+            ):
+                j += 1
+
+            if i == j:
+                total += segments[i].token_count
+            else:
+                first, last = segments[i], segments[j]
+                buffer = first.buffer
+                p = _last_token_boundary(buffer, first.start, first.end)
+                q = _first_token_boundary(buffer, last.start, last.end)
+                total += first.token_count - self.count_tokens(buffer[p : first.end])
+                total += self.count_tokens(buffer[p:q])
+                total += last.token_count - self.count_tokens(buffer[last.start : q])
+            i = j + 1
+        return total
+
+    def split_into_sections(self, text: str) -> List[SectionView]:
         """将合同分割为逻辑章节"""
-        # 基于常见合同结构分割
-        section_markers = [
-            "第一条",
-            "第二条",
-            "第三条",
-            "第四条",
-            "第五条",
-            "甲方",
-            "乙方",
-            "丙方",
-            "1.",
-            "2.",
-            "3.",
-            "4.",
-            "5.",
-            "一、",
-            "二、",
-            "三、",
-            "四、",
-            "五、",
-            "条款",
-            "协议",
-            "附件",
-            "补充说明",
+        return [
+            SectionView(text, start, end, title)
+            for start, end, title in find_section_bounds(text, self._section_pattern)
         ]
 
-        sections = []
-        current_section = {"title": "开头", "content": ""}
+    def cache_settings(self) -> Dict[str, Any]:
+        """影响处理结果的配置，作为缓存键的一部分"""
+        return {
+            "model_name": self.model_name,
+            "encoding": self.encoding.name,
+            "section_markers": self.SECTION_MARKERS,
+            "version": self.CACHE_VERSION,
+        }
 
-        lines = text.split("\n")
-        for line in lines:
-            line = line.strip()
-            if any(marker in line for marker in section_markers):
-                if current_section["content"]:
-                    sections.append(current_section)
-                current_section = {"title": line[:50], "content": line + "\n"}
-            else:
-                current_section["content"] += line + "\n"
+    def process_contract(
+        self, file_path: str, content_hash: Optional[str] = None
+    ) -> ContractDocument:
+        """处理单个合同文档
 
-        if current_section["content"]:
-            sections.append(current_section)
+        content_hash 为调用方已知的文件 SHA-256（如上传时增量计算），
+        传入时不再重新读取文件计算哈希。
+        """
+        timings: Dict[str, float] = {}
+        with measure(timings, "cache_lookup"):
+            cached, cache_key, content_hash = self._lookup_cache(
+                file_path, content_hash
+            )
+        if cached is not None:
+            return self._finish_document(cached, timings, "cache")
 
-        return sections
+        content, token_count, sections = self.extract_and_count(file_path, timings)
+        with measure(timings, "cache_store"):
+            document = self._store_processed(
+                file_path, content, token_count, sections, cache_key, content_hash
+            )
+        return self._finish_document(document, timings, "parsed")
 
-    def process_contract(self, file_path: str) -> ContractDocument:
-        """处理单个合同文档"""
+    def extract_and_count(
+        self, file_path: str, timings: Optional[Dict[str, float]] = None
+    ) -> Tuple[str, int, List[SectionView]]:
+        """提取文本、分割章节并计算 token 数（不使用缓存），各阶段耗时累加到 timings"""
+        timings = {} if timings is None else timings
         # 根据文件类型提取文本
         if file_path.endswith(".pdf"):
-            content = self.extract_text_from_pdf(file_path)
+            with measure(timings, "extract_pdf"):
+                content = self.extract_text_from_pdf(file_path)
         elif file_path.endswith(".docx"):
-            content = self.extract_text_from_docx(file_path)
+            with measure(timings, "extract_docx"):
+                content = self.extract_text_from_docx(file_path)
         else:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-
-        # 计算token数量
-        token_count = self.count_tokens(content)
+            with measure(timings, "read_text"):
+                content = read_text_file(file_path)
 
         # 分割章节
-        sections = self.split_into_sections(content)
+        with measure(timings, "split_sections"):
+            sections = self.split_into_sections(content)
+
+        # 按章节计算token数量
+        with measure(timings, "count_tokens"):
+            token_count = self.count_section_tokens(sections)
+        return content, token_count, sections
 
+    def _finish_document(
+        self, document: ContractDocument, timings: Dict[str, float], source: str
+    ) -> ContractDocument:
+        """加入全文索引，记录各阶段耗时（metadata["stage_seconds"]）和处理计数"""
+        with measure(timings, "search_index"):
+            self._index_document(document)
+        document.metadata["stage_seconds"] = {
+            stage: round(seconds, 6) for stage, seconds in timings.items()
+        }
+        registry = get_registry()
+        registry.observe_stages(timings)
+        registry.inc("contracts_processed_total", source=source)
+        registry.inc("contract_tokens_total", document.token_count, source=source)
+        return document
+
+    def _lookup_cache(
+        self, file_path: str, content_hash: Optional[str] = None
+    ) -> Tuple[Optional[ContractDocument], Optional[str], Optional[str]]:
+        """按文件内容哈希查询缓存，返回 (命中的文档, 缓存键, 内容哈希)"""
+        if self.cache is None:
+            return None, None, content_hash
+        content_hash = content_hash or self.cache.hash_file(file_path)
+        cache_key = self.cache.make_key(content_hash, self.cache_settings())
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None, cache_key, content_hash
+        content = cached["content"]
+        sections = [
+            SectionView(content, start, end, title, token_count=count)
+            for start, end, title, count in cached["sections"]
+        ]
+        document = self._build_document(
+            file_path, content, cached["token_count"], sections, content_hash
+        )
+        return document, cache_key, content_hash
+
+    def _store_processed(
+        self,
+        file_path: str,
+        content: str,
+        token_count: int,
+        sections: List[SectionView],
+        cache_key: Optional[str],
+        content_hash: Optional[str],
+    ) -> ContractDocument:
+        """写入缓存并组装文档"""
+        if cache_key is not None:
+            self.cache.set(
+                cache_key,
+                {
+                    "content": content,
+                    "token_count": token_count,
+                    "sections": section_records(sections),
+                },
+            )
+
+        return self._build_document(
+            file_path, content, token_count, sections, content_hash
+        )
+
+    def _index_document(self, document: ContractDocument):
+        """将合同章节加入全文索引（按内容哈希，已索引的合同跳过）"""
+        if self.search_index is None:
+            return
+        content_hash = (
+            document.metadata.get("content_hash")
+            or hashlib.sha256(document.content.encode("utf-8")).hexdigest()
+        )
+        self.search_index.add_document(
+            content_hash,
+            document.metadata["file_path"],
+            ((section.title, section.content) for section in document.sections),
+        )
+
+    def _build_document(
+        self,
+        file_path: str,
+        content: str,
+        token_count: int,
+        sections: List[SectionView],
+        content_hash: Optional[str] = None,
+    ) -> ContractDocument:
+        """组装合同文档及元数据"""
         # 生成元数据
         metadata = {
             "file_path": file_path,
@@ -124,6 +710,8 @@ class LongContextContractProcessor:
             "can_fit_in_context": token_count
             < self.max_context_length.get(self.model_name, 128000),
         }
+        if content_hash is not None:
+            metadata["content_hash"] = content_hash
 
         return ContractDocument(
             content=content,
@@ -134,30 +722,133 @@ class LongContextContractProcessor:
 
     def combine_multiple_contracts(self, file_paths: List[str]) -> ContractDocument:
         """合并多个合同文档"""
-        combined_content = ""
-        combined_sections = []
-        total_tokens = 0
-        metadata_list = []
+        return self.combine_processed_contracts(
+            file_paths, self.process_contracts(file_paths)
+        )
 
-        for i, file_path in enumerate(file_paths):
-            contract = self.process_contract(file_path)
+    def process_contracts(self, file_paths: List[str]) -> List[ContractDocument]:
+        """处理多个合同文档，结果与 file_paths 顺序一致
 
-            # 添加文档分隔符
-            combined_content += (
-                f"\n\n=== 合同文档 {i + 1}: {os.path.basename(file_path)} ===\n\n"
-            )
-            combined_content += contract.content
+        先在当前进程查询缓存，未命中的文件较多时按文件分发到进程池并行
+        解析、分章和编码（CPU 密集，线程受 GIL 限制），缓存写入仍在当前
+        进程完成。
+        """
+        documents: List[Optional[ContractDocument]] = []
+        timings: List[Dict[str, float]] = []
+        misses = []
+        for index, file_path in enumerate(file_paths):
+            timings.append({})
+            with measure(timings[index], "cache_lookup"):
+                cached, cache_key, content_hash = self._lookup_cache(file_path)
+            documents.append(cached)
+            if cached is None:
+                misses.append((index, cache_key, content_hash))
+        sources = ["cache"] * len(file_paths)
+
+        workers = min(self.ingest_workers, len(misses))
+        if workers <= 1 or len(misses) < self.ingest_parallel_min_files:
+            for index, cache_key, content_hash in misses:
+                content, token_count, sections = self.extract_and_count(
+                    file_paths[index], timings[index]
+                )
+                with measure(timings[index], "cache_store"):
+                    documents[index] = self._store_processed(
+                        file_paths[index],
+                        content,
+                        token_count,
+                        sections,
+                        cache_key,
+                        content_hash,
+                    )
+                sources[index] = "parsed"
+            return [
+                self._finish_document(document, stage_timings, source)
+                for document, stage_timings, source in zip(documents, timings, sources)
+            ]
+
+        executor = self._get_executor("ingest")
+        results = executor.map(
+            _ingest_contract, [file_paths[index] for index, _, _ in misses]
+        )
+        try:
+            for (index, cache_key, content_hash), result in zip(misses, results):
+                content, token_count, records, child_timings = result
+                # 子进程内的阶段耗时由本进程计入指标
+                timings[index].update(child_timings)
+                sections = [
+                    SectionView(content, start, end, title, token_count=count)
+                    for start, end, title, count in records
+                ]
+                with measure(timings[index], "cache_store"):
+                    documents[index] = self._store_processed(
+                        file_paths[index],
+                        content,
+                        token_count,
+                        sections,
+                        cache_key,
+                        content_hash,
+                    )
+                sources[index] = "parsed"
+        except BrokenProcessPool:
+            self._discard_executor("ingest", executor)
+            raise
+        return [
+            self._finish_document(document, stage_timings, source)
+            for document, stage_timings, source in zip(documents, timings, sources)
+        ]
+
+    @staticmethod
+    def document_header(index: int, file_path: str) -> str:
+        """合并文本中第 index 个文档（从 0 开始）前的分隔符"""
+        return f"\n\n=== 合同文档 {index + 1}: {os.path.basename(file_path)} ===\n\n"
 
-            # 为每个章节添加文档标识
+    def combine_processed_contracts(
+        self, file_paths: List[str], contracts: List[ContractDocument]
+    ) -> ContractDocument:
+        """合并已处理的合同文档，章节复用已有的 token 计数"""
+        parts = []
+        spans = []
+        offset = 0
+        metadata_list = []
+
+        for i, (file_path, contract) in enumerate(zip(file_paths, contracts)):
+            # 添加文档分隔符（分隔符作为无标题片段参与 token 计数）
+            header = self.document_header(i, file_path)
+            parts.append(header)
+            parts.append(contract.content)
+            spans.append((offset, offset + len(header), None, None, None))
+            offset += len(header)
+
+            # 记录章节在合并文本中的偏移及文档标识
+            source_document = f"文档{i + 1}: {os.path.basename(file_path)}"
             for section in contract.sections:
-                section["source_document"] = (
-                    f"文档{i + 1}: {os.path.basename(file_path)}"
+                spans.append(
+                    (
+                        offset + section.start,
+                        offset + section.end,
+                        section.title,
+                        source_document,
+                        section.token_count,
+                    )
                 )
-                combined_sections.append(section)
+            offset += len(contract.content)
 
-            total_tokens += contract.token_count
             metadata_list.append(contract.metadata)
 
+        combined_content = "".join(parts)
+        # 释放各文档的独立文本，章节只引用合并后的缓冲区
+        del parts
+        segments = [
+            SectionView(combined_content, start, end, title, source_document, count)
+            for start, end, title, source_document, count in spans
+        ]
+
+        # 只需编码分隔符，各章节复用已有计数
+        total_tokens = self.count_section_tokens(segments)
+        combined_sections = [
+            segment for segment in segments if segment.title is not None
+        ]
+
         combined_metadata = {
             "total_documents": len(file_paths),
             "total_tokens": total_tokens,
@@ -10,23 +10,37 @@ from typing import Dict, Any
 class LongContextConfig:
     """长上下文配置管理"""
 
-    # 模型配置
+    # 模型配置（chunk_token_budget: 超长合同分块审核时每块的 token 上限；
+    # max_concurrent: 端点同时进行的请求上限，达到即视为饱和；
+    # latency_per_1k_tokens: 没有实测数据时路由使用的每 1k tokens 预估耗时）
     MODELS = {
         "gemini-1.5-pro": {
             "max_tokens": 1000000,
             "cost_per_1k_tokens": 0.0035,
+            "chunk_token_budget": 200000,
+            "chunk_overlap_tokens": 500,
+            "max_concurrent": 8,
+            "latency_per_1k_tokens": 0.6,
             "suitable_for": ["massive_contracts", "complex_legal_documents"],
             "api_endpoint": "https://generativelanguage.googleapis.com/v1/models/gemini-1.5-pro",
         },
         "claude-3-sonnet": {
             "max_tokens": 200000,
             "cost_per_1k_tokens": 0.003,
+            "chunk_token_budget": 64000,
+            "chunk_overlap_tokens": 300,
+            "max_concurrent": 16,
+            "latency_per_1k_tokens": 0.5,
             "suitable_for": ["standard_contracts", "medium_documents"],
             "api_endpoint": "https://api.anthropic.com/v1/messages",
         },
         "gpt-4-turbo": {
             "max_tokens": 128000,
             "cost_per_1k_tokens": 0.01,
+            "chunk_token_budget": 32000,
+            "chunk_overlap_tokens": 200,
+            "max_concurrent": 16,
+            "latency_per_1k_tokens": 0.8,
             "suitable_for": ["standard_contracts", "quick_reviews"],
             "api_endpoint": "https://api.openai.com/v1/chat/completions",
         },
@@ -51,23 +65,194 @@ class LongContextConfig:
         },
     }
 
+    # Dify HTTP 客户端配置（连接池、超时）
+    HTTP_CLIENT = {
+        "timeout_seconds": 300,
+        "connect_timeout_seconds": 10,
+        "max_connections": 100,
+        "max_keepalive_connections": 20,
+        "keepalive_expiry_seconds": 30,
+        "http2": True,
+    }
+
+    # 模型路由（latency_slo_seconds: 按合同复杂度的 p95 延迟目标，单位秒）
+    MODEL_ROUTING = {
+        "enabled": True,
+        "latency_slo_seconds": {"low": 60, "medium": 120, "high": 300},
+        "window_seconds": 300,
+        "min_samples": 5,
+        "max_error_rate": 0.2,
+        "latency_quantile": 0.95,
+    }
+
+    # Dify 工作流响应缓存（工作流 ID、规范化输入和路由选择的模型都相同的请求
+    # 直接复用结果）
+    RESPONSE_CACHE = {
+        "enabled": True,
+        "storage_path": "/tmp/contract_processing/cache/responses.db",
+        "memory_entries": 1024,
+        "ttl_seconds": 7 * 24 * 3600,
+        "max_size_mb": 512,
+        # 命中/未命中计数在内存中累加，按此间隔批量写入磁盘库
+        "counter_flush_seconds": 5,
+    }
+
+    # 近重复条款检测（MinHash/LSH）：内容与已审核分块相同的复用原审核结果，
+    # 估算相似度达到 diff_threshold 的只审核差异，短于 min_chars 的不参与
+    CLAUSE_DEDUP = {
+        "enabled": True,
+        "storage_path": "/tmp/contract_processing/cache/clauses.db",
+        "num_perm": 128,
+        "bands": 16,
+        "shingle_size": 5,
+        "diff_threshold": 0.8,
+        "min_chars": 200,
+        "max_entries": 100000,
+    }
+
+    # 条款全文检索（已处理合同章节的倒排索引，查询只用文档频率最低的
+    # max_query_terms 个检索词）
+    CLAUSE_SEARCH = {
+        "enabled": True,
+        "storage_path": "/tmp/contract_processing/cache/clause_search.db",
+        "max_query_terms": 32,
+        "snippet_chars": 120,
+    }
+
+    # 检索模式审核（超出上下文的合同只审核与各审核项相关的章节）：章节按
+    # unit_tokens 打包为检索单元，以 embedding_dim 维哈希向量检索，每个审核项
+    # 取相似度不低于 min_similarity 的前 units_per_item 个单元，总量不超过
+    # 模型的 chunk_token_budget。与审核清单无关的条款不会送审，因此默认关闭，
+    # 逐块审核全部章节；结果中的 coverage 为实际送审 token 占全文的比例
+    RETRIEVAL_REVIEW = {
+        "enabled": False,
+        "unit_tokens": 2000,
+        "units_per_item": 12,
+        "min_similarity": 0.1,
+        "embedding_dim": 256,
+        "batch_chars": 1024 * 1024,
+    }
+
+    # 批量审核分组（合并请求中为审核提示词和输出预留的 token 数）
+    BATCH_SCHEDULING = {
+        "prompt_reserve_tokens": 4000,
+    }
+
+    # 分层总结配置（分块审核、批量审核的总结步骤）
+    SUMMARY = {
+        "batch_token_budget": 24000,
+        "max_fan_in": 16,
+    }
+
+    # 审核任务队列配置（backend: sqlite 单机 / redis 多主机）
+    TASK_QUEUE = {
+        "backend": os.getenv("TASK_QUEUE_BACKEND", "sqlite"),
+        "sqlite_path": "/tmp/contract_processing/tasks.db",
+        "redis_url": os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        "key_prefix": "contract_review:",
+        "workers": 2,
+        "worker_concurrency": 4,
+        # API 进程启动时随之启动的工作进程数，独立部署 review_worker 时设为 0
+        "embedded_workers": int(os.getenv("EMBEDDED_REVIEW_WORKERS", "1")),
+        "poll_interval_seconds": 0.5,
+        "lease_seconds": 300,
+        "max_attempts": 3,
+        # 进度推送：API 进程轮询任务状态的间隔、SSE 保活间隔、长轮询最长等待
+        "event_poll_interval_seconds": 0.5,
+        "sse_heartbeat_seconds": 15,
+        "long_poll_max_seconds": 60,
+    }
+
+    # 审核请求准入控制（超载时返回 429 + Retry-After）：
+    # 每个工作流未完成作业数上限为 max_concurrent × queue_factor，全部未完成
+    # 作业的预估 token 总量上限为 max_pending_tokens；预估 token 不超过
+    # priority_max_tokens 的单个审核走优先通道，上限放宽 priority_headroom，
+    # 工作进程为其保留 priority_slots 个并发槽位
+    ADMISSION_CONTROL = {
+        "enabled": True,
+        "queue_factor": 8,
+        "max_pending_tokens": 20000000,
+        "priority_max_tokens": 50000,
+        "priority_headroom": 0.25,
+        "priority_slots": 1,
+        "min_retry_after_seconds": 1,
+        "max_retry_after_seconds": 300,
+    }
+
+    # 运行指标（/metrics）：各进程每 flush_interval_seconds 秒把累计值写入
+    # storage_path，导出时合并；超过 stale_flush_intervals 个间隔未更新的
+    # 文件（已退出的进程）并入归档；buckets 为耗时直方图的分桶上界（秒）
+    METRICS = {
+        "enabled": True,
+        "storage_path": "/tmp/contract_processing/metrics",
+        "flush_interval_seconds": 5,
+        "stale_flush_intervals": 6,
+        "buckets": [
+            0.005,
+            0.01,
+            0.025,
+            0.05,
+            0.1,
+            0.25,
+            0.5,
+            1,
+            2.5,
+            5,
+            10,
+            30,
+            60,
+            120,
+            300,
+        ],
+    }
+
     # 文件处理配置
     FILE_PROCESSING = {
         "max_file_size_mb": 100,
         "supported_formats": [".pdf", ".docx", ".txt", ".doc"],
         "temp_storage_path": "/tmp/contract_processing",
+        # 上传文件按内容哈希命名存放，重复上传同一文件不再占用空间
+        "upload_storage_path": "/tmp/contract_processing/uploads",
+        "upload_chunk_bytes": 1024 * 1024,
+        # 上传后提交预处理作业（文本提取、分章、token 计数写入缓存）
+        "warm_cache_on_upload": True,
         "output_storage_path": "/app/contract_reviews",
+        "cache_storage_path": "/tmp/contract_processing/cache",
+        "cache_max_size_mb": 1024,
+    }
+
+    # token 估算配置（/api/contracts/estimate-cost）
+    TOKEN_ESTIMATION = {
+        "sample_chunks": 8,
+        "sample_chunk_bytes": 8192,
+        "sample_pages": 5,
+        "exact_threshold_bytes": 256 * 1024,
+        # 无法解析文件时使用的每 token 字节数（cl100k，按文件格式和文字类型）。
+        # 现有数值是按各格式的典型压缩和排版开销给出的经验初值，未经语料校准；
+        # 在代表性的合同目录上运行 python benchmark_token_estimator.py <目录>，
+        # 用输出的“bytes_per_token”整体替换（更换编码器或文档来源后需重新校准）
+        "bytes_per_token": {
+            ".txt": {"cjk": 2.6, "latin": 4.2, "mixed": 3.2},
+            ".pdf": {"cjk": 9.0, "latin": 14.0, "mixed": 11.0},
+            ".docx": {"cjk": 4.5, "latin": 7.0, "mixed": 5.5},
+            ".doc": {"cjk": 6.0, "latin": 9.0, "mixed": 7.5},
+        },
     }
 
     @classmethod
     def get_optimal_model(cls, token_count: int, complexity: str = "medium") -> str:
-        """根据token数量和复杂度选择最优模型"""
-        if token_count > 500000:
-            return "gemini-1.5-pro"
-        elif token_count > 100000:
-            return "claude-3-sonnet"
-        else:
-            return "gpt-4-turbo"
+        """根据token数量和复杂度选择最优模型（委托给进程内的模型路由器）"""
+        from model_router import get_router
+
+        return get_router().choose(token_count, complexity)
+
+    @classmethod
+    def get_max_concurrent(cls, workflow_id: str, default: int = 1) -> int:
+        """按 workflow_id 查询工作流的并发上限"""
+        for workflow in cls.DIFY_WORKFLOWS.values():
+            if workflow["workflow_id"] == workflow_id:
+                return workflow["max_concurrent"]
+        return default
 
     @classmethod
     def estimate_cost(cls, token_count: int, model_name: str) -> float:
@@ -92,6 +277,9 @@ services:
       - OPENAI_API_KEY=${OPENAI_API_KEY}
       - ANTHROPIC_API_KEY=${ANTHROPIC_API_KEY}
       - GOOGLE_API_KEY=${GOOGLE_API_KEY}
+      - TASK_QUEUE_BACKEND=redis
+      - REDIS_URL=redis://redis:6379/0
+      - EMBEDDED_REVIEW_WORKERS=0
     volumes:
       - ./contracts:/app/contracts
       - ./reviews:/app/reviews
@@ -101,6 +289,20 @@ services:
     depends_on:
       - redis
       - postgres
+
+  review-worker:
+    build: .
+    command: python review_worker.py --workers 4
+    environment:
+      - DIFY_API_KEY=${DIFY_API_KEY}
+      - DIFY_API_BASE=${DIFY_API_BASE}
+      - TASK_QUEUE_BACKEND=redis
+      - REDIS_URL=redis://redis:6379/0
+    volumes:
+      - ./contracts:/app/contracts
+      - ./temp:/tmp/contract_processing
+    depends_on:
+      - redis
   
   redis:
     image: redis:alpine
@@ -4,223 +4,612 @@ Dify 长上下文合同审核工作流
 """
 
 import json
+import os
+import time
+import threading
 import requests
-from typing import List, Dict, Any
-from contract_processor import LongContextContractProcessor
-
-
-class DifyLongContextContractReviewer:
-    """Dify 长上下文合同审核器"""
-
-    def __init__(self, dify_api_base: str, api_key: str):
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Any, Callable, Optional, Tuple
+from batch_scheduler import BatchScheduler
+from clause_dedup import ClauseIndex, ClauseMatch, clause_diff
+from clause_search import ClauseSearchIndex
+from contract_cache import ContractCache
+from chunk_packer import ChunkPacker
+from contract_processor import LongContextContractProcessor, SectionView
+from deployment_config import LongContextConfig
+from metrics import get_registry, timed_stage
+from model_router import ModelRouter
+from prompt_templates import REVIEW_CHECKLIST, PromptTemplates
+from response_cache import WorkflowResponseCache
+from section_retriever import SectionRetriever
+from summary_reducer import SummaryReducer
+
+# 审核进度回调，参数为进度事件 {"stage", "progress", ...}
+ProgressCallback = Callable[[Dict[str, Any]], Any]
+
+# 各阶段完成时的整体进度（百分比），分块/逐个文件审核在两者之间按完成数推进
+PROGRESS_EXTRACTED = 20
+PROGRESS_CHUNKED = 25
+PROGRESS_SUMMARY = 85
+
+
+def review_coverage(contract_tokens: int, reviewed_tokens: int) -> Dict[str, Any]:
+    """大型合同审核的覆盖情况，未覆盖全文时附带 coverage_warning"""
+    # 分块重叠会使送审 token 数超过全文，按全文封顶
+    reviewed_tokens = min(reviewed_tokens, contract_tokens)
+    coverage = reviewed_tokens / contract_tokens if contract_tokens else 1.0
+    result = {
+        "contract_tokens": contract_tokens,
+        "reviewed_tokens": reviewed_tokens,
+        "coverage": round(coverage, 4),
+    }
+    if reviewed_tokens < contract_tokens:
+        result["coverage_warning"] = (
+            f"仅审核了合同 {coverage:.1%} 的内容，其余章节未送审"
+        )
+    return result
+
+
+class ContractReviewerBase:
+    """同步和异步审核器共用的部分
+
+    包括组件初始化、请求构建、模型路由、结果组装和进度事件，不发送请求；
+    审核流程和 Dify 调用由子类分别以同步或异步方式实现。
+    """
+
+    def __init__(
+        self,
+        dify_api_base: str,
+        api_key: str,
+        cache: Optional[ContractCache] = None,
+        response_cache: Optional[WorkflowResponseCache] = None,
+        clause_index: Optional[ClauseIndex] = None,
+        model_router: Optional[ModelRouter] = None,
+        search_index: Optional[ClauseSearchIndex] = None,
+    ):
         self.dify_api_base = dify_api_base
         self.api_key = api_key
         self.headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
         }
-        self.processor = LongContextContractProcessor()
+        self.processor = LongContextContractProcessor(
+            cache=cache, search_index=search_index
+        )
+        self.summary_reducer = SummaryReducer.from_config(self.processor)
+        self.section_retriever = SectionRetriever.from_config(self.processor)
+        self.prompts = PromptTemplates(self.processor)
+        self.batch_scheduler = BatchScheduler.for_model(
+            self.processor, self.processor.model_name
+        )
+        self.response_cache = response_cache
+        self.clause_index = clause_index
+        self.model_router = model_router
+        self.http_settings = LongContextConfig.HTTP_CLIENT
 
     def create_contract_review_prompt(self, contract_content: str) -> str:
-        """创建合同审核提示词"""
-        return f"""
-你是一名专业的法律顾问，请对以下合同进行全面审核。请按照以下结构提供详细分析：
-
-## 合同基本信息分析
-- 合同类型和性质
-- 合同当事方信息
-- 合同期限和生效条件
-
-## 关键条款审核
-- 权利义务条款分析
-- 违约责任条款
-- 争议解决机制
-- 终止和解除条款
-
-## 风险识别
-- 法律风险点
-- 商业风险点
-- 操作风险点
-
-## 合规性检查
-- 法律法规符合性
-- 行业标准符合性
-- 内部政策符合性
-
-## 修改建议
-- 条款优化建议
-- 风险防范措施
-- 补充条款建议
-
-## 总体评估
-- 合同整体评级（1-10分）
-- 主要优势
-- 主要风险
-- 是否建议签署
-
-请基于以下合同内容进行审核：
-
-{contract_content}
-"""
+        """创建完整的合同审核提示词（审核请求中指令和正文分开发送）"""
+        return f"{self.prompts.render('contract_review').text}\n{contract_content}\n"
+
+    @timed_stage("retrieval")
+    def _retrieve_checklist_sections(
+        self, contract
+    ) -> Dict[str, List[Tuple[SectionView, float]]]:
+        """按审核清单检索各审核项的相关章节（按原文顺序）"""
+        selections = self.section_retriever.retrieve(
+            contract.sections, list(REVIEW_CHECKLIST.values())
+        )
+        return dict(zip(REVIEW_CHECKLIST, selections))
+
+    @timed_stage("dedup_lookup")
+    def _find_reviewed_chunks(
+        self, workflow_id: str, chunks: List[SectionView]
+    ) -> List[Tuple]:
+        """每个分块的 (签名, 近似重复的已审核章节)，未启用去重时均为 None"""
+        if self.clause_index is None:
+            return [(None, None)] * len(chunks)
+        lookups = []
+        for chunk in chunks:
+            signature = self.clause_index.signature(chunk.content)
+            lookups.append(
+                (
+                    signature,
+                    self.clause_index.find(workflow_id, chunk.content, signature),
+                )
+            )
+        return lookups
+
+    @staticmethod
+    def _is_reusable(match: Optional[ClauseMatch]) -> bool:
+        """内容与已审核分块相同时直接复用原审核结果"""
+        return match is not None and match.exact
+
+    def _index_chunk_review(
+        self, workflow_id: str, chunk: SectionView, signature, response: Dict[str, Any]
+    ):
+        """只索引成功的完整审核，差异审核和复用结果不入索引"""
+        if self.clause_index is not None and self._is_cacheable(response):
+            self.clause_index.add(
+                workflow_id, chunk.title, chunk.content, signature, response
+            )
 
-    def review_single_contract(
-        self, file_path: str, workflow_id: str
+    def _record_request(
+        self,
+        workflow_id: str,
+        queued: float,
+        sent: float,
+        result: Optional[Dict[str, Any]],
+    ):
+        """记录等待并发名额和请求本身的耗时；result 为 None 表示请求未完成（被取消）"""
+        if result is None:
+            outcome = "cancelled"
+        else:
+            outcome = "ok" if self._is_cacheable(result) else "error"
+        metrics = get_registry()
+        metrics.observe(
+            "dify_queue_wait_seconds", sent - queued, workflow_id=workflow_id
+        )
+        metrics.observe(
+            "dify_request_seconds",
+            time.perf_counter() - sent,
+            workflow_id=workflow_id,
+            outcome=outcome,
+        )
+
+    @staticmethod
+    def _record_review(
+        workflow_id: str, started: float, result: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """审核单个合同"""
-        # 处理合同文档
-        contract = self.processor.process_contract(file_path)
+        """记录整个审核的耗时（review_seconds），按处理模式计入指标"""
+        elapsed = time.perf_counter() - started
+        get_registry().observe(
+            "contract_review_seconds",
+            elapsed,
+            workflow_id=workflow_id,
+            mode=result.get("processing_mode", "unknown"),
+        )
+        result["review_seconds"] = round(elapsed, 3)
+        return result
+
+    @staticmethod
+    def _encode_body(data: Dict[str, Any]) -> bytes:
+        """请求体直接编码为 UTF-8，中文不转义为 \\uXXXX，体积约为默认 JSON 的一半"""
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    @staticmethod
+    def _prompt_token_count(data: Dict[str, Any]) -> int:
+        """请求提示词的 token 数（审核请求构建时记录，总结请求没有）"""
+        return data.get("inputs", {}).get("prompt_tokens", 0)
+
+    def _route(self, data: Dict[str, Any]) -> Optional[str]:
+        """选择模型；未启用路由或请求规模未知（如总结步骤）时使用工作流默认模型
+
+        带 section_title 的请求（章节、差异和检索审核）是超长合同的分块，
+        只路由到分块预算放得下的模型。
+        """
+        token_count = self._prompt_token_count(data)
+        if self.model_router is None or not token_count:
+            return None
+        chunked = "section_title" in data.get("inputs", {})
+        return self.model_router.choose(token_count, chunked=chunked)
+
+    @staticmethod
+    def _with_model(data: Dict[str, Any], model: str) -> Dict[str, Any]:
+        """工作流通过 model 输入变量切换模型"""
+        return {**data, "inputs": {**data.get("inputs", {}), "model": model}}
+
+    def _finish_route(
+        self,
+        model: str,
+        token_count: int,
+        started: float,
+        result: Optional[Dict[str, Any]],
+    ):
+        """记录请求耗时和结果；result 为 None 表示请求未完成（被取消）"""
+        self.model_router.finish(
+            model,
+            token_count,
+            time.perf_counter() - started,
+            None if result is None else self._is_cacheable(result),
+        )
 
-        # 检查是否适合长上下文处理
-        if not contract.metadata["can_fit_in_context"]:
-            return self._review_large_contract_in_chunks(contract, workflow_id)
+    def _response_cache_key(
+        self, workflow_id: str, data: Dict[str, Any], model: Optional[str]
+    ) -> Optional[str]:
+        if self.response_cache is None:
+            return None
+        return self.response_cache.make_key(workflow_id, data.get("inputs", {}), model)
+
+    @staticmethod
+    def _is_cacheable(response: Dict[str, Any]) -> bool:
+        """只缓存成功的工作流运行结果"""
+        if "error" in response:
+            return False
+        data = response.get("data")
+        return (
+            not isinstance(data, dict) or data.get("status", "succeeded") == "succeeded"
+        )
 
-        # 创建审核提示
-        prompt = self.create_contract_review_prompt(contract.content)
+    @timed_stage("pack_sections")
+    def _pack_sections(self, contract) -> List[SectionView]:
+        """按处理模型的分块预算打包章节"""
+        packer = ChunkPacker.for_model(self.processor, self.processor.model_name)
+        return packer.pack(contract.sections)
 
-        # 调用 Dify API
-        response = self._call_dify_workflow(
-            workflow_id,
-            {
-                "inputs": {
-                    "contract_content": contract.content,
-                    "review_prompt": prompt,
-                    "file_name": file_path.split("/")[-1],
-                }
-            },
+    @staticmethod
+    def _extraction_event(contract) -> Dict[str, Any]:
+        return {
+            "stage": "extraction",
+            "progress": PROGRESS_EXTRACTED,
+            "token_count": contract.token_count,
+            "can_fit_in_context": contract.metadata["can_fit_in_context"],
+        }
+
+    @staticmethod
+    def _batch_extraction_event(
+        contracts: List, groups: List[List[int]]
+    ) -> Dict[str, Any]:
+        return {
+            "stage": "extraction",
+            "progress": PROGRESS_EXTRACTED,
+            "token_count": sum(contract.token_count for contract in contracts),
+            "can_fit_in_context": len(groups) == 1,
+            "groups": len(groups),
+        }
+
+    @staticmethod
+    def _chunking_event(chunks: List[SectionView]) -> Dict[str, Any]:
+        return {
+            "stage": "chunking",
+            "progress": PROGRESS_CHUNKED,
+            "total_chunks": len(chunks),
+        }
+
+    @staticmethod
+    def _retrieval_event(
+        selections: Dict[str, List[Tuple[SectionView, float]]],
+    ) -> Dict[str, Any]:
+        return {
+            "stage": "retrieval",
+            "progress": PROGRESS_CHUNKED,
+            "total_items": sum(1 for units in selections.values() if units),
+            "selected_sections": len(
+                {unit.start for units in selections.values() for unit, _ in units}
+            ),
+        }
+
+    @staticmethod
+    def _item_reviewed_event(stage: str, completed: int, total: int) -> Dict[str, Any]:
+        """分块或批量中的单个文件审核完成"""
+        progress = PROGRESS_CHUNKED + (PROGRESS_SUMMARY - PROGRESS_CHUNKED) * (
+            completed / total
         )
+        return {
+            "stage": stage,
+            "progress": int(progress),
+            "completed": completed,
+            "total": total,
+        }
+
+    @staticmethod
+    def _summary_event() -> Dict[str, Any]:
+        return {"stage": "summary", "progress": PROGRESS_SUMMARY}
+
+    def _workflow_url(self, workflow_id: str) -> str:
+        return f"{self.dify_api_base}/workflows/{workflow_id}/run"
+
+    @timed_stage("build_request")
+    def _single_review_request(self, contract, file_path: str) -> Dict[str, Any]:
+        """构建单个合同审核请求，合同正文只在 contract_content 中发送一次"""
+        instruction = self.prompts.render("contract_review")
+        return {
+            "inputs": {
+                "contract_content": contract.content,
+                "review_prompt": instruction.text,
+                "file_name": file_path.split("/")[-1],
+                "prompt_tokens": instruction.token_count + contract.token_count,
+            }
+        }
 
+    def _single_review_result(
+        self, contract, file_path: str, response: Dict[str, Any]
+    ) -> Dict[str, Any]:
         return {
             "file_path": file_path,
             "metadata": contract.metadata,
+            "prompt_tokens": self.prompts.render("contract_review").token_count
+            + contract.token_count,
             "review_result": response,
             "processing_mode": "single_context",
         }
 
-    def review_multiple_contracts(
-        self, file_paths: List[str], workflow_id: str
+    @timed_stage("build_request")
+    def _combined_review_request(
+        self, combined_contract, file_paths: List[str]
     ) -> Dict[str, Any]:
-        """批量审核多个合同"""
-        # 合并多个合同
-        combined_contract = self.processor.combine_multiple_contracts(file_paths)
-
-        if not combined_contract.metadata["can_fit_in_context"]:
-            # 如果合并后仍然超出上下文，分别处理
-            results = []
-            for file_path in file_paths:
-                result = self.review_single_contract(file_path, workflow_id)
-                results.append(result)
-
-            # 生成综合分析
-            summary_prompt = self._create_batch_summary_prompt(results)
-            summary_response = self._call_dify_workflow(
-                workflow_id,
-                {
-                    "inputs": {
-                        "contract_content": summary_prompt,
-                        "review_type": "batch_summary",
-                    }
-                },
-            )
-
-            return {
-                "individual_reviews": results,
-                "batch_summary": summary_response,
-                "processing_mode": "chunked_processing",
+        """构建多合同合并审核请求"""
+        instruction = self.prompts.render("combined_review")
+        return {
+            "inputs": {
+                "contract_content": combined_contract.content,
+                "review_prompt": instruction.text,
+                "file_count": len(file_paths),
+                "prompt_tokens": instruction.token_count
+                + combined_contract.token_count,
             }
+        }
 
-        # 如果可以在单个上下文中处理
-        prompt = self.create_contract_review_prompt(combined_contract.content)
-        prompt += "\n\n特别说明：这是多个合同的合并审核，请在分析中明确区分各个合同的特点和风险。"
-
-        response = self._call_dify_workflow(
-            workflow_id,
-            {
-                "inputs": {
-                    "contract_content": combined_contract.content,
-                    "review_prompt": prompt,
-                    "file_count": len(file_paths),
-                }
-            },
-        )
-
+    def _combined_review_result(
+        self, combined_contract, file_paths: List[str], response: Dict[str, Any]
+    ) -> Dict[str, Any]:
         return {
             "file_paths": file_paths,
             "combined_metadata": combined_contract.metadata,
+            "prompt_tokens": self.prompts.render("combined_review").token_count
+            + combined_contract.token_count,
             "review_result": response,
             "processing_mode": "combined_context",
         }
 
-    def _review_large_contract_in_chunks(
-        self, contract, workflow_id: str
+    @staticmethod
+    def _scheduled_batch_result(
+        group_results: List[Dict], summary_response: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """分块处理大型合同"""
-        chunk_reviews = []
+        return {
+            "group_reviews": group_results,
+            "batch_summary": summary_response,
+            "processing_mode": "scheduled_groups",
+        }
 
-        for i, section in enumerate(contract.sections):
-            section_prompt = f"""
-请审核合同的第{i + 1}部分：{section["title"]}
+    @timed_stage("build_request")
+    def _chunk_review_request(self, section) -> Dict[str, Any]:
+        """构建单个章节的审核请求
 
-{section["content"]}
+        提示词不含分块序号，不同合同中相同的章节生成相同请求，可命中响应缓存。
+        """
+        instruction = self.prompts.render("section_review", title=section.title)
+        return {
+            "inputs": {
+                "contract_content": section.content,
+                "review_prompt": instruction.text,
+                "section_title": section.title,
+                "prompt_tokens": instruction.token_count + section.token_count,
+            }
+        }
 
-请重点关注：
-1. 本部分的核心内容
-2. 潜在的法律风险
-3. 需要注意的条款
-4. 与其他部分的关联性
-"""
+    @timed_stage("build_request")
+    def _chunk_diff_review_request(self, section, match: ClauseMatch) -> Dict[str, Any]:
+        """构建差异审核请求：只提交与已审核版本的差异和原审核结论"""
+        diff = clause_diff(match.content, section.content)
+        instruction = self.prompts.render(
+            "diff_review",
+            title=section.title,
+            matched_title=match.title,
+            similarity=match.similarity,
+            base_review=self._response_text(match.review),
+        )
+        return {
+            "inputs": {
+                "contract_content": diff,
+                "review_prompt": instruction.text,
+                "section_title": section.title,
+                "prompt_tokens": instruction.token_count
+                + self.processor.count_tokens(diff),
+            }
+        }
 
-            response = self._call_dify_workflow(
-                workflow_id,
-                {
-                    "inputs": {
-                        "contract_content": section["content"],
-                        "review_prompt": section_prompt,
-                        "section_title": section["title"],
-                    }
-                },
-            )
+    @timed_stage("build_request")
+    def _checklist_review_request(
+        self, item: str, units: List[Tuple[SectionView, float]]
+    ) -> Dict[str, Any]:
+        """构建单个审核项的审核请求，正文为检索出的相关章节"""
+        instruction = self.prompts.render("checklist_review", item=item)
+        content = "".join(
+            f"=== {unit.title} ===\n{unit.content}\n" for unit, _ in units
+        )
+        return {
+            "inputs": {
+                "contract_content": content,
+                "review_prompt": instruction.text,
+                "section_title": item,
+                "prompt_tokens": instruction.token_count
+                + self.processor.count_tokens(content),
+            }
+        }
 
-            chunk_reviews.append({"section": section["title"], "review": response})
+    @staticmethod
+    def _checklist_review_entry(
+        item: str,
+        units: List[Tuple[SectionView, float]],
+        response: Optional[Dict[str, Any]],
+    ) -> Dict[str, Any]:
+        """审核项结果，未检索到相关章节时 review 为 None"""
+        return {
+            "item": item,
+            "sections": [
+                {"title": unit.title, "similarity": round(similarity, 3)}
+                for unit, similarity in units
+            ],
+            "reviewed_tokens": sum(unit.token_count for unit, _ in units),
+            "review": response,
+        }
 
-        # 生成整体总结
-        summary_prompt = self._create_chunk_summary_prompt(chunk_reviews)
-        summary_response = self._call_dify_workflow(
-            workflow_id,
-            {
-                "inputs": {
-                    "contract_content": summary_prompt,
-                    "review_type": "chunk_summary",
-                }
-            },
-        )
+    @staticmethod
+    def _retrieval_review_result(
+        contract,
+        selections: Dict[str, List[Tuple[SectionView, float]]],
+        item_reviews: List[Dict],
+        summary_response: Dict[str, Any],
+    ) -> Dict[str, Any]:
+        # 同一检索单元可能被多个审核项选中，覆盖率按去重后的单元计算
+        reviewed_units = {
+            (unit.start, unit.end): unit.token_count
+            for units in selections.values()
+            for unit, _ in units
+        }
+        return {
+            "checklist_reviews": item_reviews,
+            "overall_summary": summary_response,
+            "processing_mode": "retrieved_sections",
+            **review_coverage(contract.token_count, sum(reviewed_units.values())),
+        }
 
+    def _chunk_review_entry(
+        self, chunk: SectionView, response: Dict[str, Any], match: Optional[ClauseMatch]
+    ) -> Dict[str, Any]:
+        """分块审核结果，去重命中时记录匹配信息"""
+        entry = {
+            "section": chunk.title,
+            "reviewed_tokens": chunk.token_count,
+            "review": response,
+        }
+        if match is not None:
+            entry["dedup"] = {
+                "mode": "reused" if self._is_reusable(match) else "diff",
+                "matched_section": match.title,
+                "similarity": round(match.similarity, 3),
+            }
+            if entry["dedup"]["mode"] == "diff":
+                entry["dedup"]["base_review"] = match.review
+        return entry
+
+    @staticmethod
+    def _chunk_review_result(
+        contract, chunk_reviews: List[Dict], summary_response: Dict[str, Any]
+    ) -> Dict[str, Any]:
         return {
             "chunk_reviews": chunk_reviews,
             "overall_summary": summary_response,
             "processing_mode": "chunked_sections",
+            **review_coverage(
+                contract.token_count,
+                sum(entry["reviewed_tokens"] for entry in chunk_reviews),
+            ),
         }
 
-    def _call_dify_workflow(
-        self, workflow_id: str, data: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        """调用 Dify 工作流 API"""
-        url = f"{self.dify_api_base}/workflows/{workflow_id}/run"
+    def _chunk_summary_blocks(self, chunk_reviews: List[Dict]) -> List[str]:
+        """分块审核结果，每个分块一条"""
+        return [self._chunk_summary_block(chunk) for chunk in chunk_reviews]
+
+    def _chunk_summary_block(self, chunk: Dict[str, Any]) -> str:
+        """差异审核的分块同时带上原审核结论"""
+        dedup = chunk.get("dedup", {})
+        if dedup.get("mode") != "diff":
+            return f"=== {chunk['section']} ===\n{chunk['review']}\n\n"
+        return (
+            f"=== {chunk['section']} ===\n"
+            f"原审核结论（{dedup['matched_section']}）："
+            f"{self._response_text(dedup['base_review'])}\n"
+            f"差异审核：{self._response_text(chunk['review'])}\n\n"
+        )
 
-        try:
-            response = requests.post(url, headers=self.headers, json=data)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            return {"error": str(e), "status": "failed"}
+    def _checklist_summary_blocks(self, item_reviews: List[Dict]) -> List[str]:
+        """检索模式各审核项的结果，未检索到相关章节的审核项也列出"""
+        blocks = []
+        for entry in item_reviews:
+            if entry["review"] is None:
+                blocks.append(f"=== {entry['item']} ===\n合同中未检索到相关章节\n\n")
+                continue
+            titles = "、".join(section["title"] for section in entry["sections"])
+            blocks.append(
+                f"=== {entry['item']} ===\n"
+                f"审核章节：{titles}\n"
+                f"{self._response_text(entry['review'])}\n\n"
+            )
+        return blocks
+
+    def _group_summary_blocks(self, group_results: List[Dict]) -> List[str]:
+        """批量审核中各组的审核结果，每组一条"""
+        return [
+            f"=== 合同组 {i + 1} ===\n"
+            f"文件：{'、'.join(self._group_file_names(result))}\n"
+            f"审核结果：{self._response_text(self._group_review(result))}\n\n"
+            for i, result in enumerate(group_results)
+        ]
+
+    @staticmethod
+    def _group_file_names(result: Dict[str, Any]) -> List[str]:
+        paths = result.get("file_paths") or [result.get("file_path", "")]
+        return [os.path.basename(path) for path in paths]
+
+    @staticmethod
+    def _group_review(result: Dict[str, Any]) -> Dict[str, Any]:
+        """单独或合并审核取审核结果，分块审核取整体总结"""
+        if "review_result" in result:
+            return result["review_result"]
+        return result.get("overall_summary", {})
+
+    def _partial_summary_blocks(
+        self, level: int, responses: List[Dict[str, Any]]
+    ) -> List[str]:
+        """上一层的中间总结，作为下一层的待总结内容"""
+        return [
+            f"=== 中间总结 {level}-{i + 1} ===\n{self._response_text(response)}\n\n"
+            for i, response in enumerate(responses)
+        ]
+
+    @staticmethod
+    def _response_text(response: Dict[str, Any]) -> str:
+        """取工作流输出文本，没有时（包括 data 为 null 的错误响应）使用完整响应"""
+        data = response.get("data")
+        outputs = data.get("outputs") if isinstance(data, dict) else None
+        if isinstance(outputs, dict) and isinstance(outputs.get("text"), str):
+            return outputs["text"]
+        return str(response)
+
+    def _summary_request(self, review_type: str, blocks: List[str]) -> Dict[str, Any]:
+        """构建最终总结请求"""
+        if review_type == "batch_summary":
+            prompt = self._create_batch_summary_prompt(blocks)
+        else:
+            prompt = self._create_chunk_summary_prompt(blocks)
+        return {
+            "inputs": {
+                "contract_content": prompt,
+                "review_type": review_type,
+            }
+        }
+
+    def _partial_summary_requests(
+        self, review_type: str, batches: List[List[str]], level: int
+    ) -> List[Dict[str, Any]]:
+        """构建某一层各组的中间总结请求"""
+        return [
+            {
+                "inputs": {
+                    "contract_content": self._create_partial_summary_prompt(
+                        review_type, batch, i, len(batches)
+                    ),
+                    "review_type": review_type,
+                    "summary_level": level,
+                }
+            }
+            for i, batch in enumerate(batches)
+        ]
+
+    def _create_partial_summary_prompt(
+        self, review_type: str, blocks: List[str], index: int, total: int
+    ) -> str:
+        """创建中间总结提示"""
+        scope = "多个合同" if review_type == "batch_summary" else "合同各部分"
+        summary_content = (
+            f"以下是{scope}的部分审核结果（第 {index + 1}/{total} 组），"
+            "请合并为一份中间总结：\n\n"
+        )
+        summary_content += "".join(blocks)
+        summary_content += """
+请在中间总结中保留：
+1. 全部风险点及涉及的条款或合同
+2. 关键问题和修改建议
+3. 各部分之间的关联
+"""
+        return summary_content
 
-    def _create_batch_summary_prompt(self, individual_results: List[Dict]) -> str:
+    def _create_batch_summary_prompt(self, blocks: List[str]) -> str:
         """创建批量审核总结提示"""
         summary_content = "以下是多个合同的个别审核结果，请提供综合分析：\n\n"
-
-        for i, result in enumerate(individual_results):
-            summary_content += f"=== 合同 {i + 1} ===\n"
-            summary_content += f"文件：{result['file_path']}\n"
-            summary_content += f"审核结果：{result['review_result']}\n\n"
+        summary_content += "".join(blocks)
 
         summary_content += """
 请提供以下综合分析：
@@ -231,13 +620,10 @@ class DifyLongContextContractReviewer:
 """
         return summary_content
 
-    def _create_chunk_summary_prompt(self, chunk_reviews: List[Dict]) -> str:
+    def _create_chunk_summary_prompt(self, blocks: List[str]) -> str:
         """创建分块审核总结提示"""
         summary_content = "以下是合同各部分的详细审核结果，请提供整体总结：\n\n"
-
-        for chunk in chunk_reviews:
-            summary_content += f"=== {chunk['section']} ===\n"
-            summary_content += f"{chunk['review']}\n\n"
+        summary_content += "".join(blocks)
 
         summary_content += """
 请基于以上分块审核结果，提供：
@@ -249,6 +635,357 @@ class DifyLongContextContractReviewer:
         return summary_content
 
 
+class DifyLongContextContractReviewer(ContractReviewerBase):
+    """Dify 长上下文合同审核器（同步，线程池并发）"""
+
+    def __init__(
+        self,
+        dify_api_base: str,
+        api_key: str,
+        cache: Optional[ContractCache] = None,
+        response_cache: Optional[WorkflowResponseCache] = None,
+        clause_index: Optional[ClauseIndex] = None,
+        model_router: Optional[ModelRouter] = None,
+        search_index: Optional[ClauseSearchIndex] = None,
+    ):
+        super().__init__(
+            dify_api_base,
+            api_key,
+            cache=cache,
+            response_cache=response_cache,
+            clause_index=clause_index,
+            model_router=model_router,
+            search_index=search_index,
+        )
+
+        # 复用连接的 HTTP 会话
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.http_settings["max_connections"],
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # 按工作流限制同时进行的调用数（DIFY_WORKFLOWS.max_concurrent）
+        self._workflow_limits = {}
+        self._workflow_limits_lock = threading.Lock()
+
+    def close(self):
+        """关闭连接池和进程池，写入尚未落盘的响应缓存计数"""
+        self.session.close()
+        self.processor.close()
+        if self.response_cache is not None:
+            self.response_cache.flush_counters()
+
+    def review_single_contract(
+        self,
+        file_path: str,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """审核单个合同，progress_callback 接收各阶段的进度事件"""
+        started = time.perf_counter()
+        # 处理合同文档
+        contract = self.processor.process_contract(file_path)
+        self._report(progress_callback, self._extraction_event(contract))
+        result = self._review_processed_contract(
+            contract, file_path, workflow_id, progress_callback
+        )
+        return self._record_review(workflow_id, started, result)
+
+    def _review_processed_contract(
+        self,
+        contract,
+        file_path: str,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        # 检查是否适合长上下文处理
+        if not contract.metadata["can_fit_in_context"]:
+            if self.section_retriever is not None:
+                return self._review_large_contract_by_retrieval(
+                    contract, workflow_id, progress_callback
+                )
+            return self._review_large_contract_in_chunks(
+                contract, workflow_id, progress_callback
+            )
+
+        # 调用 Dify API
+        response = self._call_dify_workflow(
+            workflow_id, self._single_review_request(contract, file_path)
+        )
+
+        return self._single_review_result(contract, file_path, response)
+
+    def review_multiple_contracts(
+        self,
+        file_paths: List[str],
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """批量审核多个合同，progress_callback 接收各阶段的进度事件
+
+        合同按上下文长度装箱分组：全部放得下时合并为一次审核，否则各组
+        并发审核后汇总，超出上下文的单个合同分块审核。
+        """
+        started = time.perf_counter()
+        contracts = self.processor.process_contracts(file_paths)
+        groups = self.batch_scheduler.plan(file_paths, contracts)
+        self._report(progress_callback, self._batch_extraction_event(contracts, groups))
+
+        if len(groups) == 1:
+            return self._record_review(
+                workflow_id,
+                started,
+                self._review_group(workflow_id, file_paths, contracts),
+            )
+
+        # 各组并发审核，并发数受工作流 max_concurrent 限制，结果保持分组顺序
+        max_workers = LongContextConfig.get_max_concurrent(workflow_id)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self._review_group,
+                    workflow_id,
+                    [file_paths[i] for i in group],
+                    [contracts[i] for i in group],
+                )
+                for group in groups
+            ]
+            for completed, _ in enumerate(as_completed(futures), 1):
+                self._report(
+                    progress_callback,
+                    self._item_reviewed_event("group_reviewed", completed, len(groups)),
+                )
+            results = [future.result() for future in futures]
+
+        # 生成综合分析
+        self._report(progress_callback, self._summary_event())
+        summary_response = self._reduce_summaries(
+            workflow_id, "batch_summary", self._group_summary_blocks(results)
+        )
+
+        return self._record_review(
+            workflow_id,
+            started,
+            self._scheduled_batch_result(results, summary_response),
+        )
+
+    def _review_group(
+        self, workflow_id: str, file_paths: List[str], contracts: List
+    ) -> Dict[str, Any]:
+        """审核一组合同：单个合同按单独审核处理，多个合同合并为一次请求"""
+        if len(contracts) == 1:
+            return self._review_processed_contract(
+                contracts[0], file_paths[0], workflow_id
+            )
+        combined_contract = self.processor.combine_processed_contracts(
+            file_paths, contracts
+        )
+        response = self._call_dify_workflow(
+            workflow_id, self._combined_review_request(combined_contract, file_paths)
+        )
+        return self._combined_review_result(combined_contract, file_paths, response)
+
+    def _review_large_contract_in_chunks(
+        self,
+        contract,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """分块处理大型合同"""
+        # 按模型 token 预算打包章节，减少调用次数
+        chunks = self._pack_sections(contract)
+        self._report(progress_callback, self._chunking_event(chunks))
+
+        # 与已审核内容近似重复的分块复用原结果或只审核差异
+        lookups = self._find_reviewed_chunks(workflow_id, chunks)
+
+        # 各分块并发审核，并发数受工作流 max_concurrent 限制，结果保持分块顺序
+        max_workers = LongContextConfig.get_max_concurrent(workflow_id)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(self._review_chunk, workflow_id, chunk, lookup)
+                for chunk, lookup in zip(chunks, lookups)
+            ]
+            for completed, _ in enumerate(as_completed(futures), 1):
+                self._report(
+                    progress_callback,
+                    self._item_reviewed_event("chunk_reviewed", completed, len(chunks)),
+                )
+            responses = [future.result() for future in futures]
+
+        chunk_reviews = [
+            self._chunk_review_entry(chunk, response, match)
+            for chunk, response, (_, match) in zip(chunks, responses, lookups)
+        ]
+
+        # 生成整体总结
+        self._report(progress_callback, self._summary_event())
+        summary_response = self._reduce_summaries(
+            workflow_id, "chunk_summary", self._chunk_summary_blocks(chunk_reviews)
+        )
+
+        return self._chunk_review_result(contract, chunk_reviews, summary_response)
+
+    def _review_large_contract_by_retrieval(
+        self,
+        contract,
+        workflow_id: str,
+        progress_callback: Optional[ProgressCallback] = None,
+    ) -> Dict[str, Any]:
+        """检索模式审核大型合同：每个审核项只审核检索出的相关章节"""
+        selections = self._retrieve_checklist_sections(contract)
+        self._report(progress_callback, self._retrieval_event(selections))
+
+        # 各审核项并发审核，未检索到相关章节的审核项不发送请求
+        items = [item for item, units in selections.items() if units]
+        max_workers = LongContextConfig.get_max_concurrent(workflow_id)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                item: executor.submit(
+                    self._call_dify_workflow,
+                    workflow_id,
+                    self._checklist_review_request(item, selections[item]),
+                )
+                for item in items
+            }
+            for completed, _ in enumerate(as_completed(futures.values()), 1):
+                self._report(
+                    progress_callback,
+                    self._item_reviewed_event(
+                        "checklist_item_reviewed", completed, len(items)
+                    ),
+                )
+            responses = {item: future.result() for item, future in futures.items()}
+
+        item_reviews = [
+            self._checklist_review_entry(item, units, responses.get(item))
+            for item, units in selections.items()
+        ]
+
+        self._report(progress_callback, self._summary_event())
+        summary_response = self._reduce_summaries(
+            workflow_id, "chunk_summary", self._checklist_summary_blocks(item_reviews)
+        )
+
+        return self._retrieval_review_result(
+            contract, selections, item_reviews, summary_response
+        )
+
+    def _review_chunk(
+        self, workflow_id: str, chunk: SectionView, lookup: Tuple
+    ) -> Dict[str, Any]:
+        """审核单个分块：近似重复时复用原结果或只审核差异，完整审核后加入索引"""
+        signature, match = lookup
+        if self._is_reusable(match):
+            return match.review
+        if match is not None:
+            return self._call_dify_workflow(
+                workflow_id, self._chunk_diff_review_request(chunk, match)
+            )
+        response = self._call_dify_workflow(
+            workflow_id, self._chunk_review_request(chunk)
+        )
+        self._index_chunk_review(workflow_id, chunk, signature, response)
+        return response
+
+    def _call_dify_workflow(
+        self, workflow_id: str, data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """调用 Dify 工作流 API，相同工作流和输入的请求优先使用响应缓存
+
+        启用模型路由时按输入中的 prompt_tokens 选择模型。
+        """
+        model = self._route(data)
+        cache_key = self._response_cache_key(workflow_id, data, model)
+        if cache_key is not None:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        token_count = self._prompt_token_count(data)
+        if model is None:
+            result = self._post_workflow(workflow_id, data)
+        else:
+            self.model_router.begin(model)
+            started, result = time.perf_counter(), None
+            try:
+                result = self._post_workflow(workflow_id, self._with_model(data, model))
+            finally:
+                self._finish_route(model, token_count, started, result)
+
+        if cache_key is not None and self._is_cacheable(result):
+            self.response_cache.set(cache_key, result)
+        return result
+
+    def _post_workflow(self, workflow_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        queued = sent = time.perf_counter()
+        result = None
+        try:
+            with self._workflow_limit(workflow_id):
+                sent = time.perf_counter()
+                response = self.session.post(
+                    self._workflow_url(workflow_id),
+                    data=self._encode_body(data),
+                    timeout=(
+                        self.http_settings["connect_timeout_seconds"],
+                        self.http_settings["timeout_seconds"],
+                    ),
+                )
+            response.raise_for_status()
+            result = response.json()
+        except requests.exceptions.RequestException as e:
+            result = {"error": str(e), "status": "failed"}
+        finally:
+            self._record_request(workflow_id, queued, sent, result)
+        return result
+
+    def _reduce_summaries(
+        self, workflow_id: str, review_type: str, blocks: List[str]
+    ) -> Dict[str, Any]:
+        """分层归并总结
+
+        待总结内容按 token 预算分组，各组并发生成中间总结，再对中间总结
+        继续分组归并，直到只剩一组时生成最终总结。
+        """
+        batches = self.summary_reducer.plan(blocks)
+        level = 0
+        while len(batches) > 1:
+            level += 1
+            max_workers = LongContextConfig.get_max_concurrent(workflow_id)
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                responses = list(
+                    executor.map(
+                        lambda request: self._call_dify_workflow(workflow_id, request),
+                        self._partial_summary_requests(review_type, batches, level),
+                    )
+                )
+            batches = self.summary_reducer.plan(
+                self._partial_summary_blocks(level, responses)
+            )
+
+        return self._call_dify_workflow(
+            workflow_id, self._summary_request(review_type, batches[0])
+        )
+
+    def _workflow_limit(self, workflow_id: str) -> threading.BoundedSemaphore:
+        """获取工作流的并发信号量（同一审核器的所有请求共享）"""
+        with self._workflow_limits_lock:
+            if workflow_id not in self._workflow_limits:
+                self._workflow_limits[workflow_id] = threading.BoundedSemaphore(
+                    LongContextConfig.get_max_concurrent(workflow_id)
+                )
+            return self._workflow_limits[workflow_id]
+
+    @staticmethod
+    def _report(progress_callback: Optional[ProgressCallback], event: Dict[str, Any]):
+        if progress_callback is not None:
+            progress_callback(event)
+
+
 # 使用示例
 if __name__ == "__main__":
     # 初始化审核器
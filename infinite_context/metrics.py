@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+运行指标 - 合同处理各阶段的计时直方图和计数器，以 Prometheus 文本格式导出
+"""
+
+import atexit
+import bisect
+import fcntl
+import functools
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager, suppress
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from deployment_config import LongContextConfig
+
+# 指标名 -> (类型, 说明)
+METRICS: Dict[str, Tuple[str, str]] = {
+    "contract_stage_seconds": ("histogram", "合同处理和审核各阶段耗时（秒）"),
+    "contract_review_seconds": ("histogram", "单次审核请求的总耗时（秒）"),
+    "dify_request_seconds": ("histogram", "Dify 工作流请求耗时（秒）"),
+    "dify_queue_wait_seconds": (
+        "histogram",
+        "Dify 请求等待工作流并发名额的耗时（秒）",
+    ),
+    "contracts_processed_total": ("counter", "处理的合同数"),
+    "contract_tokens_total": ("counter", "处理的合同 token 数"),
+    "review_jobs_total": ("counter", "工作进程完成的作业数"),
+}
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """进程内指标注册表
+
+    记录一次观测只需加锁更新几个数字（微秒级），适合在热路径上按阶段
+    计时。API 和审核工作进程各自计数：storage_path 不为空时后台线程每
+    flush_interval 秒把本进程的累计值写入 <主机名>-<进程号>-<启动时间>.json
+    （共享卷上多台主机、进程号复用均不冲突），collect 合并目录下所有进程
+    的数据。超过 stale_intervals 个写出间隔未更新的文件属于已退出的进程，
+    collect 把它并入归档 _retired.json 后删除，导出的计数器不因进程退出或
+    重启而减小。
+    """
+
+    def __init__(
+        self,
+        storage_path: Optional[str] = None,
+        flush_interval: float = 5.0,
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        enabled: bool = True,
+        stale_intervals: int = 6,
+    ):
+        self.storage_path = storage_path
+        self.flush_interval = flush_interval
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = enabled
+        self.stale_intervals = stale_intervals
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        # 直方图：[各区间计数（最后一个为 +Inf）, 总和, 次数]
+        self._histograms: Dict[Tuple[str, LabelKey], List[Any]] = {}
+        # 已随归档计入的部分（本进程文件被误判为失效时），写出时扣除
+        self._baseline: Tuple[Dict, Dict] = ({}, {})
+        self._flushed: Tuple[Dict, Dict] = ({}, {})
+        self._written = False
+        self._pid = os.getpid()
+        self._key = self._new_key()
+        if storage_path and enabled:
+            os.makedirs(storage_path, exist_ok=True)
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+            atexit.register(self.flush)
+
+    @classmethod
+    def from_config(cls) -> "MetricsRegistry":
+        """按 LongContextConfig.METRICS 创建"""
+        settings = LongContextConfig.METRICS
+        return cls(
+            settings["storage_path"],
+            settings["flush_interval_seconds"],
+            settings["buckets"],
+            settings["enabled"],
+            settings["stale_flush_intervals"],
+        )
+
+    def inc(self, name: str, value: float = 1, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        if not self.enabled:
+            return
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._histograms[key] = histogram
+            histogram[0][bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def stage(
+        self, stage: str, timings: Optional[Dict[str, float]] = None
+    ) -> Iterator[None]:
+        """计时一个处理阶段，计入 contract_stage_seconds，并累加到 timings"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("contract_stage_seconds", elapsed, stage=stage)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0) + elapsed
+
+    def observe_stages(self, timings: Dict[str, float]):
+        """把 measure 记录的各阶段耗时计入 contract_stage_seconds"""
+        for stage, elapsed in timings.items():
+            self.observe("contract_stage_seconds", elapsed, stage=stage)
+
+    def flush(self):
+        """把本进程的累计值写入 storage_path（原子替换）"""
+        if not self.storage_path or not self.enabled:
+            return
+        with self._flush_lock:
+            with self._lock:
+                if self._written and not os.path.exists(self._own_file()):
+                    # 长时间未写出，文件已被当作失效进程归档：已归档的部分
+                    # 不再重复计入，换一个文件名继续
+                    self._baseline = self._flushed
+                    self._key = self._new_key()
+                snapshot = self._snapshot()
+                self._flushed = (
+                    dict(self._counters),
+                    {
+                        key: [list(counts), total, count]
+                        for key, (counts, total, count) in self._histograms.items()
+                    },
+                )
+            self._write_file(self._own_file(), snapshot)
+            self._written = True
+
+    def collect(self) -> Dict[str, Any]:
+        """合并本进程、其他进程和已归档的累计值"""
+        counters: Dict[Tuple[str, LabelKey], float] = {}
+        histograms: Dict[Tuple[str, LabelKey], List[Any]] = {}
+        with self._lock:
+            self._merge_snapshot(counters, histograms, self._snapshot())
+        if self.storage_path:
+            with self._directory_lock():
+                retired = self._retire_stale()
+                self._merge_snapshot(counters, histograms, retired)
+                own_file = self._own_file()
+                for entry in self._process_files():
+                    if entry.path != own_file and entry.name not in retired["files"]:
+                        self._merge_snapshot(
+                            counters, histograms, self._read_file(entry.path)
+                        )
+        return {"counters": counters, "histograms": histograms}
+
+    def render(self) -> str:
+        """Prometheus 文本格式（text/plain; version=0.0.4）"""
+        collected = self.collect()
+        series: Dict[str, List[str]] = {}
+        for (name, labels), value in sorted(collected["counters"].items()):
+            series.setdefault(name, []).append(
+                f"{name}{_format_labels(labels)} {_format_value(value)}"
+            )
+        for (name, labels), (counts, total, count) in sorted(
+            collected["histograms"].items()
+        ):
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                bucket_labels = labels + (("le", _format_value(bound)),)
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labels)} {count}")
+
+        output = []
+        for name, lines in series.items():
+            kind, description = METRICS.get(name, ("untyped", name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(lines)
+        return "\n".join(output) + "\n"
+
+    def _flush_loop(self):
+        # 空闲时也定期写出，文件的修改时间即进程存活的依据
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def _new_key(self) -> str:
+        return f"{socket.gethostname()}-{self._pid}-{time.time_ns()}"
+
+    def _own_file(self) -> str:
+        return os.path.join(self.storage_path, f"{self._key}.json")
+
+    def _process_files(self) -> List[os.DirEntry]:
+        """各进程写出的文件（归档和锁文件以 _ 开头）"""
+        return [
+            entry
+            for entry in os.scandir(self.storage_path)
+            if entry.name.endswith(".json") and not entry.name.startswith("_")
+        ]
+
+    @contextmanager
+    def _directory_lock(self) -> Iterator[None]:
+        """同一存储目录的归档和读取互斥（多个 API 进程同时导出时）"""
+        with open(os.path.join(self.storage_path, "_retired.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _retire_stale(self) -> Dict[str, Any]:
+        """把失效进程的文件并入归档后删除，返回归档（调用方持有目录锁）
+
+        归档记录本次并入的文件名，写入归档后中断、文件未删除时下次只删除
+        不再并入，同一文件不会重复计入。
+        """
+        archive_path = os.path.join(self.storage_path, "_retired.json")
+        archive = self._read_file(archive_path) or {
+            "buckets": list(self.buckets),
+            "counters": [],
+            "histograms": [],
+            "files": [],
+        }
+        for name in archive["files"]:
+            with suppress(FileNotFoundError):
+                os.remove(os.path.join(self.storage_path, name))
+
+        own_file = self._own_file()
+        threshold = time.time() - self.flush_interval * self.stale_intervals
+        stale = [
+            entry
+            for entry in self._process_files()
+            if entry.path != own_file and entry.stat().st_mtime < threshold
+        ]
+        if not stale:
+            return archive
+
+        counters: Dict[Tuple[str, LabelKey], float] = {}
+        histograms: Dict[Tuple[str, LabelKey], List[Any]] = {}
+        self._merge_snapshot(counters, histograms, archive)
+        for entry in stale:
+            self._merge_snapshot(counters, histograms, self._read_file(entry.path))
+        archive = {
+            **self._serialize(counters, histograms),
+            "files": [entry.name for entry in stale],
+        }
+        self._write_file(archive_path, archive)
+        for entry in stale:
+            with suppress(FileNotFoundError):
+                os.remove(entry.path)
+        return archive
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """可序列化的累计值，扣除已归档的部分（调用方持有锁）"""
+        base_counters, base_histograms = self._baseline
+        counters = {
+            key: value - base_counters.get(key, 0)
+            for key, value in self._counters.items()
+        }
+        histograms = {}
+        for key, (counts, total, count) in self._histograms.items():
+            base = base_histograms.get(key)
+            if base is not None:
+                counts = [a - b for a, b in zip(counts, base[0])]
+                total, count = total - base[1], count - base[2]
+            histograms[key] = [counts, total, count]
+        return self._serialize(counters, histograms)
+
+    def _serialize(
+        self,
+        counters: Dict[Tuple[str, LabelKey], float],
+        histograms: Dict[Tuple[str, LabelKey], List[Any]],
+    ) -> Dict[str, Any]:
+        return {
+            "buckets": list(self.buckets),
+            "counters": [
+                [name, list(labels), value]
+                for (name, labels), value in counters.items()
+            ],
+            "histograms": [
+                [name, list(labels), list(counts), total, count]
+                for (name, labels), (counts, total, count) in histograms.items()
+            ],
+        }
+
+    @staticmethod
+    def _write_file(path: str, data: Dict[str, Any]):
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read_file(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # 文件不存在或正在被替换
+            return None
+
+    def _merge_snapshot(
+        self,
+        counters: Dict[Tuple[str, LabelKey], float],
+        histograms: Dict[Tuple[str, LabelKey], List[Any]],
+        snapshot: Optional[Dict[str, Any]],
+    ):
+        if not snapshot:
+            return
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        # 分桶配置变化前写入的直方图无法合并，跳过
+        if tuple(snapshot["buckets"]) != self.buckets:
+            return
+        for name, labels, counts, total, count in snapshot["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+            merged[0] = [a + b for a, b in zip(merged[0], counts)]
+            merged[1] += total
+            merged[2] += count
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: LabelKey) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+_default_registry: Optional[MetricsRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_registry() -> MetricsRegistry:
+    """进程内共享的指标注册表（fork 出的子进程重新创建，写自己的文件）"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None or _default_registry._pid != os.getpid():
+            _default_registry = MetricsRegistry.from_config()
+        return _default_registry
+
+
+@contextmanager
+def measure(timings: Dict[str, float], stage: str) -> Iterator[None]:
+    """只把阶段耗时累加到 timings（不写注册表，可在进程池子进程中使用）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0) + time.perf_counter() - started
+
+
+def timed_stage(stage: str) -> Callable:
+    """方法装饰器：每次调用计入 contract_stage_seconds{stage=...}"""
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_registry().stage(stage):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
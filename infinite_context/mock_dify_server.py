@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+本地 Dify 工作流模拟服务 - 用于在无网络环境下压测合同审核
+
+响应延迟 = 按分布抽样的基础延迟 + 与输入长度成正比的部分；可按比例
+注入 500 错误和 429 限流，并用 capacity 模拟后端同时处理能力（超出排队）。
+请求的 model 输入（模型路由选择的模型）计入 /stats 的 models 并在响应中
+返回，可用于核对路由结果是否到达工作流。
+
+用法: python mock_dify_server.py --port 8001 --latency 0.2 \
+          --distribution lognormal --per-1k-chars 0.05 --error-rate 0.01
+"""
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from aiohttp import web
+
+DISTRIBUTIONS = ("fixed", "exponential", "lognormal", "uniform")
+
+
+class LatencyProfile:
+    """模拟延迟分布
+
+    latency_seconds 为基础延迟的均值（lognormal 为中位数），sigma 为
+    lognormal 的形状参数；per_1k_chars 为每 1000 个输入字符增加的延迟。
+    """
+
+    def __init__(
+        self,
+        latency_seconds: float = 0.2,
+        distribution: str = "fixed",
+        sigma: float = 0.5,
+        per_1k_chars: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"不支持的延迟分布: {distribution}")
+        self.latency_seconds = latency_seconds
+        self.distribution = distribution
+        self.sigma = sigma
+        self.per_1k_chars = per_1k_chars
+        self.rng = random.Random(seed)
+
+    def sample(self, input_chars: int) -> float:
+        mean = self.latency_seconds
+        if self.distribution == "exponential":
+            base = self.rng.expovariate(1 / mean) if mean > 0 else 0.0
+        elif self.distribution == "lognormal":
+            base = mean * self.rng.lognormvariate(0, self.sigma)
+        elif self.distribution == "uniform":
+            base = self.rng.uniform(0, 2 * mean)
+        else:
+            base = mean
+        return base + self.per_1k_chars * input_chars / 1000
+
+
+def create_app(
+    latency_seconds: float = 0.2,
+    distribution: str = "fixed",
+    sigma: float = 0.5,
+    per_1k_chars: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    capacity: int = 0,
+    seed: Optional[int] = None,
+) -> web.Application:
+    """创建模拟 Dify 工作流接口的应用（capacity 为 0 表示不限并发）"""
+    profile = LatencyProfile(latency_seconds, distribution, sigma, per_1k_chars, seed)
+    rng = random.Random(seed)
+    slots = asyncio.Semaphore(capacity) if capacity > 0 else None
+
+    async def run_workflow(request: web.Request) -> web.Response:
+        body = await request.read()
+        stats = request.app["stats"]
+        stats["requests"] += 1
+        stats["bytes_received"] += len(body)
+        started = time.perf_counter()
+
+        if rng.random() < rate_limit_rate:
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"code": "too_many_requests", "message": "模拟限流"},
+                status=429,
+                headers={"Retry-After": "1"},
+            )
+
+        payload = await request.json()
+        inputs = payload.get("inputs", {})
+        content = inputs.get("contract_content", "")
+        model = inputs.get("model", "default")
+        stats["models"][model] = stats["models"].get(model, 0) + 1
+        input_chars = len(content) + len(inputs.get("review_prompt", ""))
+
+        stats["in_flight"] += 1
+        try:
+            if slots is None:
+                await asyncio.sleep(profile.sample(input_chars))
+            else:
+                async with slots:
+                    await asyncio.sleep(profile.sample(input_chars))
+        finally:
+            stats["in_flight"] -= 1
+
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return web.json_response(
+                {"code": "internal_error", "message": "模拟工作流错误"}, status=500
+            )
+
+        return web.json_response(
+            {
+                "workflow_run_id": str(uuid.uuid4()),
+                "task_id": str(uuid.uuid4()),
+                "data": {
+                    "workflow_id": request.match_info["workflow_id"],
+                    "model": model,
+                    "status": "succeeded",
+                    "outputs": {
+                        "text": f"模拟审核结果（输入 {len(content)} 字符）",
+                    },
+                    "elapsed_time": time.perf_counter() - started,
+                    "total_tokens": len(content) // 2,
+                },
+            }
+        )
+
+    async def stats(request: web.Request) -> web.Response:
+        return web.json_response(request.app["stats"])
+
+    app = web.Application(client_max_size=1024**3)
+    app["stats"] = {
+        "requests": 0,
+        "errors": 0,
+        "rate_limited": 0,
+        "in_flight": 0,
+        "bytes_received": 0,
+        "models": {},
+    }
+    app.router.add_post("/workflows/{workflow_id}/run", run_workflow)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+async def start_server(
+    host: str = "127.0.0.1",
+    port: int = 8001,
+    latency_seconds: float = 0.2,
+    **options: Any,
+) -> web.AppRunner:
+    """在当前事件循环中启动模拟服务，返回 runner 以便调用方关闭
+
+    options 为 create_app 的其余参数（延迟分布、错误率等）。
+    """
+    runner = web.AppRunner(create_app(latency_seconds, **options))
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def run_server_in_thread(
+    host: str = "127.0.0.1",
+    port: int = 8001,
+    latency_seconds: float = 0.2,
+    **options: Any,
+) -> Callable[[], None]:
+    """在后台线程的独立事件循环中运行模拟服务，返回停止函数
+
+    被测代码阻塞调用方事件循环时，模拟服务仍能正常响应。
+    """
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state: Dict[str, Any] = {}
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        try:
+            state["runner"] = loop.run_until_complete(
+                start_server(host, port, latency_seconds, **options)
+            )
+        except Exception as e:
+            state["error"] = e
+            return
+        finally:
+            started.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait()
+    if "error" in state:
+        raise state["error"]
+    runner = state["runner"]
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    return stop
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    """模拟服务的命令行参数（benchmark_load 复用）"""
+    parser.add_argument("--latency", type=float, default=0.2, help="基础延迟（秒）")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal 形状参数")
+    parser.add_argument(
+        "--per-1k-chars", type=float, default=0.0, help="每 1000 输入字符增加的延迟"
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0, help="500 错误比例")
+    parser.add_argument(
+        "--rate-limit-rate", type=float, default=0.0, help="429 限流比例"
+    )
+    parser.add_argument(
+        "--capacity", type=int, default=0, help="同时处理的请求数，0 为不限"
+    )
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def server_options(args: argparse.Namespace) -> Dict[str, Any]:
+    """命令行参数转换为 create_app 的关键字参数（不含 latency_seconds）"""
+    return {
+        "distribution": args.distribution,
+        "sigma": args.sigma,
+        "per_1k_chars": args.per_1k_chars,
+        "error_rate": args.error_rate,
+        "rate_limit_rate": args.rate_limit_rate,
+        "capacity": args.capacity,
+        "seed": args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本地 Dify 工作流模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(args.latency, **server_options(args)),
+        host=args.host,
+        port=args.port,
+    )
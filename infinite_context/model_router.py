@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+模型路由 - 按实测延迟、错误率和负载为每个请求选择满足延迟 SLO 的最低成本模型
+"""
+
+import math
+import time
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from deployment_config import LongContextConfig
+
+
+class _ModelStats:
+    """单个模型端点的滑动窗口统计"""
+
+    __slots__ = ("samples", "in_flight")
+
+    def __init__(self):
+        # (完成时间, 每 1k tokens 耗时, 是否成功, tokens)
+        self.samples: deque = deque()
+        self.in_flight = 0
+
+    def prune(self, horizon: float):
+        while self.samples and self.samples[0][0] < horizon:
+            self.samples.popleft()
+
+
+class ModelRouter:
+    """成本和延迟感知的模型路由
+
+    每个模型记录窗口内请求的每 1k tokens 耗时、成功与否和进行中的请求数。
+    选择时只考虑上下文放得下的模型（分块请求还要求不超过模型的
+    chunk_token_budget），排除进行中请求数达到 max_concurrent 的
+    饱和端点和错误率过高的端点，在预测延迟（耗时分位数 × tokens）满足 SLO
+    的模型中取单价最低的；都不满足时取预测最快的，全部不可用时取负载最低的。
+    样本不足 min_samples 时使用配置中的 latency_per_1k_tokens 作为先验。
+
+    统计只在当前进程内累计，各工作进程独立路由。
+    """
+
+    def __init__(
+        self,
+        models: Dict[str, Dict[str, Any]],
+        latency_slo_seconds: Dict[str, float],
+        window_seconds: float = 300,
+        min_samples: int = 5,
+        max_error_rate: float = 0.2,
+        latency_quantile: float = 0.95,
+    ):
+        self.models = models
+        self.latency_slo_seconds = latency_slo_seconds
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.latency_quantile = latency_quantile
+        self._stats = {name: _ModelStats() for name in models}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls) -> "ModelRouter":
+        """按 LongContextConfig.MODEL_ROUTING 创建"""
+        settings = LongContextConfig.MODEL_ROUTING
+        return cls(
+            LongContextConfig.MODELS,
+            settings["latency_slo_seconds"],
+            settings["window_seconds"],
+            settings["min_samples"],
+            settings["max_error_rate"],
+            settings["latency_quantile"],
+        )
+
+    def choose(
+        self, token_count: int, complexity: str = "medium", chunked: bool = False
+    ) -> str:
+        """为 token_count 大小的请求选择模型
+
+        chunked 为 True 表示请求是超长合同的一个分块（章节、差异或检索
+        审核），只考虑 chunk_token_budget 不小于 token_count 的模型。
+        """
+        slo = self.latency_slo_seconds.get(
+            complexity, self.latency_slo_seconds["medium"]
+        )
+        limit = "chunk_token_budget" if chunked else "max_tokens"
+        fitting = [
+            name
+            for name, model in self.models.items()
+            if model["max_tokens"] > token_count
+            and (not chunked or model["chunk_token_budget"] >= token_count)
+        ]
+        if not fitting:
+            # 没有模型放得下时用上限最大的模型（整份合同由调用方分块审核）
+            return max(self.models, key=lambda name: self.models[name][limit])
+
+        with self._lock:
+            now = time.monotonic()
+            available = []
+            for name in fitting:
+                stats = self._stats[name]
+                stats.prune(now - self.window_seconds)
+                if not self._saturated(name, stats) and self._healthy(stats):
+                    available.append((self._predict(name, stats, token_count), name))
+            if not available:
+                # 全部饱和或异常时选负载比例最低的，避免请求失败
+                return min(fitting, key=self._load)
+
+        within_slo = [name for latency, name in available if latency <= slo]
+        if within_slo:
+            return min(
+                within_slo, key=lambda name: self.models[name]["cost_per_1k_tokens"]
+            )
+        return min(available)[1]
+
+    def begin(self, model: str):
+        """请求发出前调用，计入进行中的请求"""
+        with self._lock:
+            self._stats[model].in_flight += 1
+
+    def finish(self, model: str, token_count: int, latency: float, ok: Optional[bool]):
+        """请求结束后调用；ok 为 None 表示请求被取消，只释放进行中计数"""
+        with self._lock:
+            stats = self._stats[model]
+            stats.in_flight -= 1
+            if ok is None:
+                return
+            now = time.monotonic()
+            stats.samples.append(
+                (now, latency / max(token_count / 1000, 1.0), ok, token_count)
+            )
+            stats.prune(now - self.window_seconds)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各模型窗口内的延迟、错误率、吞吐量和负载"""
+        result = {}
+        with self._lock:
+            now = time.monotonic()
+            for name, stats in self._stats.items():
+                stats.prune(now - self.window_seconds)
+                samples = stats.samples
+                result[name] = {
+                    "requests": len(samples),
+                    "error_rate": self._error_rate(stats),
+                    "latency_per_1k_tokens": self._quantile(stats),
+                    # 窗口内的平均吞吐量
+                    "tokens_per_second": sum(
+                        sample[3] for sample in samples if sample[2]
+                    )
+                    / self.window_seconds,
+                    "in_flight": stats.in_flight,
+                    "saturated": self._saturated(name, stats),
+                }
+        return result
+
+    def _predict(self, name: str, stats: _ModelStats, token_count: int) -> float:
+        """预测延迟：每 1k tokens 耗时分位数 × 请求规模（不足 1k 按 1k 计）"""
+        per_1k = self._quantile(stats)
+        if per_1k is None:
+            per_1k = self.models[name]["latency_per_1k_tokens"]
+        return per_1k * max(token_count / 1000, 1.0)
+
+    def _quantile(self, stats: _ModelStats) -> Optional[float]:
+        """成功请求每 1k tokens 耗时的分位数，样本不足时返回 None"""
+        values: List[float] = sorted(sample[1] for sample in stats.samples if sample[2])
+        if len(values) < self.min_samples:
+            return None
+        index = min(len(values) - 1, math.ceil(self.latency_quantile * len(values)) - 1)
+        return values[index]
+
+    def _healthy(self, stats: _ModelStats) -> bool:
+        return self._error_rate(stats) <= self.max_error_rate
+
+    def _error_rate(self, stats: _ModelStats) -> float:
+        if len(stats.samples) < self.min_samples:
+            return 0.0
+        failures = sum(1 for sample in stats.samples if not sample[2])
+        return failures / len(stats.samples)
+
+    def _saturated(self, name: str, stats: _ModelStats) -> bool:
+        return stats.in_flight >= self.models[name]["max_concurrent"]
+
+    def _load(self, name: str) -> float:
+        return self._stats[name].in_flight / self.models[name]["max_concurrent"]
+
+
+_default_router: Optional[ModelRouter] = None
+_default_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """进程内共享的路由器（统计在同一进程的所有审核器间共享）"""
+    global _default_router
+    with _default_router_lock:
+        if _default_router is None:
+            _default_router = ModelRouter.from_config()
+        return _default_router
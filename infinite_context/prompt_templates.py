@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+审核提示词模板 - 指令与合同正文分离，指令文本和 token 数只计算一次
+"""
+
+from dataclasses import dataclass
+from typing import Dict
+
+from contract_processor import LongContextContractProcessor
+
+CONTRACT_REVIEW_BODY = """
+你是一名专业的法律顾问，请对以下合同进行全面审核。请按照以下结构提供详细分析：
+
+## 合同基本信息分析
+- 合同类型和性质
+- 合同当事方信息
+- 合同期限和生效条件
+
+## 关键条款审核
+- 权利义务条款分析
+- 违约责任条款
+- 争议解决机制
+- 终止和解除条款
+
+## 风险识别
+- 法律风险点
+- 商业风险点
+- 操作风险点
+
+## 合规性检查
+- 法律法规符合性
+- 行业标准符合性
+- 内部政策符合性
+
+## 修改建议
+- 条款优化建议
+- 风险防范措施
+- 补充条款建议
+
+## 总体评估
+- 合同整体评级（1-10分）
+- 主要优势
+- 主要风险
+- 是否建议签署
+"""
+
+# 指令末尾引出合同正文的一句，补充说明需放在它之前
+CONTRACT_LEAD_IN = """
+请基于以下合同内容进行审核：
+"""
+
+CONTRACT_REVIEW = CONTRACT_REVIEW_BODY + CONTRACT_LEAD_IN
+
+# 模板中的 {字段} 在 render 时填充，不含参数的模板原样使用
+TEMPLATES: Dict[str, str] = {
+    "contract_review": CONTRACT_REVIEW,
+    "combined_review": CONTRACT_REVIEW_BODY
+    + "\n特别说明：这是多个合同的合并审核，请在分析中明确区分各个合同的特点和风险。\n"
+    + CONTRACT_LEAD_IN,
+    "section_review": """
+请审核合同的以下部分：{title}
+
+请重点关注：
+1. 本部分的核心内容
+2. 潜在的法律风险
+3. 需要注意的条款
+4. 与其他部分的关联性
+""",
+    "diff_review": """
+合同的以下部分：{title}
+与已审核的「{matched_title}」高度相似（相似度 {similarity:.0%}），请只审核差异。
+待审核内容为与已审核版本的差异（unified diff）。
+
+## 已审核版本的审核结论
+{base_review}
+
+请重点关注：
+1. 差异内容引入或消除的法律风险
+2. 原审核结论是否仍然适用
+3. 针对差异的修改建议
+""",
+    "checklist_review": """
+请审核合同中与「{item}」相关的条款。
+以下章节是按相关度从合同全文中检索出的部分（按原文顺序排列），其余章节不在本次审核范围内。
+
+请重点关注：
+1. 相关条款是否完整、明确
+2. 潜在的法律风险
+3. 明显不利于一方或缺失的约定
+4. 修改建议
+""",
+}
+
+# 检索模式的审核清单：审核项 -> 检索相关章节用的查询文本
+REVIEW_CHECKLIST: Dict[str, str] = {
+    "合同基本信息": "合同当事方 甲方 乙方 合同标的 合同期限 生效条件 签订日期",
+    "权利义务": "权利 义务 应当 负责 提供 交付 履行",
+    "价款与支付": "价款 费用 支付 付款 结算 发票 税费 银行转账",
+    "验收与质量": "验收 质量 标准 技术规格 检验 整改 缺陷",
+    "违约责任": "违约 违约金 赔偿 损失 违约责任 逾期 承担责任",
+    "保密与知识产权": "保密 商业秘密 保密义务 知识产权 专利 著作权 披露",
+    "不可抗力": "不可抗力 无法履行 通知 免除责任",
+    "转让与变更": "转让 变更 书面同意 第三方 补充协议",
+    "终止和解除": "终止 解除 期满 续约 提前通知 解除合同",
+    "争议解决": "争议 协商 仲裁 诉讼 法院 管辖 适用法律",
+}
+
+
+@dataclass(frozen=True)
+class RenderedPrompt:
+    """渲染后的审核指令及其精确 token 数"""
+
+    text: str
+    token_count: int
+
+
+class PromptTemplates:
+    """审核指令模板
+
+    指令作为 review_prompt、合同正文作为 contract_content 分别发送，由
+    工作流模板拼接，正文每个请求只发送一次。不含参数的模板 token 数
+    只编码一次；带参数的模板（章节标题、差异审核嵌入的原审核结论等）
+    渲染结果基本不会重复，每次直接计数。提示词总 token 数为指令与正文
+    token 数之和，正文计数直接复用文档处理阶段的结果。
+    """
+
+    def __init__(self, processor: LongContextContractProcessor):
+        self.processor = processor
+        self._static_counts: Dict[str, int] = {}
+
+    def render(self, name: str, **fields) -> RenderedPrompt:
+        template = TEMPLATES[name]
+        if fields:
+            text = template.format(**fields)
+            return RenderedPrompt(text, self.processor.count_tokens(text))
+        if name not in self._static_counts:
+            self._static_counts[name] = self.processor.count_tokens(template)
+        return RenderedPrompt(template, self._static_counts[name])
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Dify 工作流响应缓存 - 相同工作流和输入的请求复用已有审核结果
+"""
+
+import json
+import time
+import zlib
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from contract_cache import DiskLRUCache
+from deployment_config import LongContextConfig
+
+
+def normalize_inputs(value: Any) -> Any:
+    """规范化工作流输入：统一 Unicode 形式和换行符，去掉首尾空白"""
+    if isinstance(value, str):
+        value = unicodedata.normalize("NFC", value)
+        return value.replace("\r\n", "\n").replace("\r", "\n").strip()
+    if isinstance(value, dict):
+        return {key: normalize_inputs(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_inputs(item) for item in value]
+    return value
+
+
+class WorkflowResponseCache:
+    """工作流响应两级缓存
+
+    进程内 LRU（按条数）在前，多进程共享的磁盘 LRU（按容量）在后，两级
+    使用相同的过期时间。命中、未命中等计数先在内存中累加，每隔
+    counter_flush_seconds 以及 stats()、close() 时写入磁盘库，所有工作进程
+    累计到同一组计数。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        memory_entries: int = 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+        max_size_mb: int = 512,
+        counter_flush_seconds: float = 5.0,
+    ):
+        self.memory_entries = memory_entries
+        self.ttl_seconds = ttl_seconds
+        self.counter_flush_seconds = counter_flush_seconds
+        self.disk = DiskLRUCache(db_path, max_size_mb)
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 尚未写入磁盘库的计数增量
+        self._pending_counts: Dict[str, int] = {}
+        self._counts_flushed_at = time.monotonic()
+
+    @classmethod
+    def from_config(cls) -> Optional["WorkflowResponseCache"]:
+        """按 LongContextConfig.RESPONSE_CACHE 创建，未启用时返回 None"""
+        settings = LongContextConfig.RESPONSE_CACHE
+        if not settings["enabled"]:
+            return None
+        return cls(
+            settings["storage_path"],
+            settings["memory_entries"],
+            settings["ttl_seconds"],
+            settings["max_size_mb"],
+            settings["counter_flush_seconds"],
+        )
+
+    @staticmethod
+    def make_key(
+        workflow_id: str, inputs: Dict[str, Any], model: Optional[str] = None
+    ) -> str:
+        """由工作流 ID、规范化后的输入和路由选择的模型生成缓存键
+
+        不同模型的审核结果不互相复用；未启用路由时 model 为 None，对应工作流
+        默认模型。
+        """
+        payload = json.dumps(
+            normalize_inputs(inputs), sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(
+            f"{workflow_id}:{model or ''}:{payload}".encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """依次查询内存和磁盘，磁盘命中时回填内存"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                else:
+                    del self._memory[key]
+                    entry = None
+        if entry is not None:
+            self.record("memory_hits")
+            return entry[1]
+
+        value = self.disk.get(key)
+        if value is None:
+            self.record("misses")
+            return None
+        cached = json.loads(zlib.decompress(value))
+        self._remember(key, cached["expires_at"], cached["response"])
+        self.record("disk_hits")
+        return cached["response"]
+
+    def set(self, key: str, response: Dict[str, Any]):
+        """写入两级缓存"""
+        expires_at = time.time() + self.ttl_seconds
+        data = json.dumps(
+            {"expires_at": expires_at, "response": response}, ensure_ascii=False
+        ).encode("utf-8")
+        self.disk.set(key, zlib.compress(data, 1), self.ttl_seconds)
+        self._remember(key, expires_at, response)
+        self.record("stores")
+
+    def record(self, name: str, delta: int = 1):
+        """累加统计计数（内存中累加，定期写入磁盘库）"""
+        now = time.monotonic()
+        with self._lock:
+            self._pending_counts[name] = self._pending_counts.get(name, 0) + delta
+            due = now - self._counts_flushed_at >= self.counter_flush_seconds
+        if due:
+            self.flush_counters()
+
+    def flush_counters(self):
+        """将内存中的计数增量写入磁盘库"""
+        with self._lock:
+            pending, self._pending_counts = self._pending_counts, {}
+            self._counts_flushed_at = time.monotonic()
+        if pending:
+            self.disk.add_counters(pending)
+
+    def close(self):
+        """写入剩余计数并关闭磁盘库"""
+        self.flush_counters()
+        self.disk.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率和容量统计（计数为所有进程累计）"""
+        self.flush_counters()
+        counters = self.disk.counters()
+        hits = counters.get("memory_hits", 0) + counters.get("disk_hits", 0)
+        lookups = hits + counters.get("misses", 0)
+        # 合并到进行中请求的查询先记为未命中，同样没有产生远程调用
+        hits += counters.get("coalesced", 0)
+        with self._lock:
+            memory_entries = len(self._memory)
+        return {
+            "memory_hits": counters.get("memory_hits", 0),
+            "disk_hits": counters.get("disk_hits", 0),
+            "misses": counters.get("misses", 0),
+            "coalesced": counters.get("coalesced", 0),
+            "stores": counters.get("stores", 0),
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "disk_entries": self.disk.entry_count(),
+            "disk_size_bytes": self.disk.total_size(),
+            "memory_entries": memory_entries,
+        }
+
+    def _remember(self, key: str, expires_at: float, response: Dict[str, Any]):
+        with self._lock:
+            self._memory[key] = (expires_at, response)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
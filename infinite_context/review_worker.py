@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+合同审核工作进程 - 从任务队列领取审核作业并执行
+
+每个进程运行一个事件循环，最多同时执行 worker_concurrency 个作业；
+增加进程数（或在多台主机上运行并使用 Redis 队列）即可横向扩展。
+
+用法: python review_worker.py --workers 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+from datetime import datetime
+from typing import Any, Dict, List
+
+from async_dify_reviewer import AsyncDifyLongContextContractReviewer
+from clause_dedup import ClauseIndex
+from clause_search import ClauseSearchIndex
+from contract_cache import ContractCache
+from dify_contract_reviewer import ProgressCallback
+from deployment_config import LongContextConfig
+from metrics import get_registry
+from model_router import get_router
+from response_cache import WorkflowResponseCache
+from task_queue import TaskQueue, create_task_queue
+
+
+def create_reviewer() -> AsyncDifyLongContextContractReviewer:
+    """按环境变量和配置创建审核器"""
+    return AsyncDifyLongContextContractReviewer(
+        dify_api_base=os.getenv("DIFY_API_BASE", "https://api.dify.ai/v1"),
+        api_key=os.getenv("DIFY_API_KEY", "default-key"),
+        cache=ContractCache(
+            LongContextConfig.FILE_PROCESSING["cache_storage_path"],
+            LongContextConfig.FILE_PROCESSING["cache_max_size_mb"],
+        ),
+        response_cache=WorkflowResponseCache.from_config(),
+        clause_index=ClauseIndex.from_config(),
+        model_router=(
+            get_router() if LongContextConfig.MODEL_ROUTING["enabled"] else None
+        ),
+        search_index=ClauseSearchIndex.from_config(),
+    )
+
+
+class ReviewWorker:
+    """审核作业执行器"""
+
+    def __init__(
+        self,
+        queue: TaskQueue,
+        reviewer: AsyncDifyLongContextContractReviewer,
+        worker_id: str,
+        concurrency: int = 4,
+        poll_interval: float = 0.5,
+        lease_seconds: float = 300,
+        priority_slots: int = 0,
+    ):
+        self.queue = queue
+        self.reviewer = reviewer
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        # 为优先作业保留的槽位数，普通作业不能占满全部并发
+        self.priority_slots = min(priority_slots, concurrency - 1)
+
+    async def run(self, stop: asyncio.Event):
+        """持续领取作业直到 stop 被设置，退出前等待进行中的作业完成"""
+        running = set()
+        running_normal = set()
+        loop = asyncio.get_running_loop()
+        next_requeue = 0.0
+        while not stop.is_set():
+            # 定期回收租约过期（工作进程已退出）的作业
+            if loop.time() >= next_requeue:
+                await asyncio.to_thread(self.queue.requeue_expired)
+                next_requeue = loop.time() + self.lease_seconds / 3
+
+            job = None
+            if len(running) < self.concurrency:
+                priority_only = (
+                    len(running_normal) >= self.concurrency - self.priority_slots
+                )
+                job = await asyncio.to_thread(
+                    self.queue.claim_job, self.worker_id, priority_only
+                )
+            if job is None:
+                await self._wait(stop, self.poll_interval)
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            if not job.get("priority"):
+                running_normal.add(task)
+                task.add_done_callback(running_normal.discard)
+
+        if running:
+            await asyncio.gather(*running)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        task_id = job["task_id"]
+        await asyncio.to_thread(
+            self.queue.update_task,
+            task_id,
+            {
+                "status": "processing",
+                "stage": "started",
+                "progress": 10,
+                "worker_id": self.worker_id,
+                "started_at": datetime.now().isoformat(),
+            },
+        )
+
+        heartbeat = asyncio.create_task(self._heartbeat(task_id))
+        try:
+            result = await self._review(job, self._progress_reporter(task_id))
+            fields = {
+                "status": "completed",
+                "stage": "completed",
+                "progress": 100,
+                "result": result,
+                "completed_at": datetime.now().isoformat(),
+            }
+        except Exception as e:
+            fields = {
+                "status": "failed",
+                "error": str(e),
+                "failed_at": datetime.now().isoformat(),
+            }
+        finally:
+            heartbeat.cancel()
+
+        await asyncio.to_thread(self.queue.update_task, task_id, fields)
+        await asyncio.to_thread(self.queue.finish_job, task_id)
+        # 每个作业结束后写出本进程的指标，/metrics 不必等待定期写出
+        metrics = get_registry()
+        metrics.inc("review_jobs_total", kind=job["kind"], status=fields["status"])
+        await asyncio.to_thread(metrics.flush)
+
+    async def _review(
+        self, job: Dict[str, Any], progress_callback: ProgressCallback
+    ) -> Dict[str, Any]:
+        if job["kind"] == "prepare":
+            return await self._prepare(job)
+        if job["kind"] == "batch":
+            return await self.reviewer.review_multiple_contracts(
+                job["file_paths"], job["workflow_id"], progress_callback
+            )
+        return await self.reviewer.review_single_contract(
+            job["file_path"], job["workflow_id"], progress_callback
+        )
+
+    async def _prepare(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """预处理上传的合同并写入处理缓存，后续审核直接命中缓存"""
+        contract = await asyncio.to_thread(
+            self.reviewer.processor.process_contract,
+            job["file_path"],
+            job.get("content_hash"),
+        )
+        return {
+            "content_hash": contract.metadata.get("content_hash"),
+            "token_count": contract.token_count,
+            "section_count": len(contract.sections),
+            "can_fit_in_context": contract.metadata["can_fit_in_context"],
+            "stage_seconds": contract.metadata["stage_seconds"],
+        }
+
+    def _progress_reporter(self, task_id: str) -> ProgressCallback:
+        """将审核器的进度事件写入任务状态"""
+        lock = asyncio.Lock()
+        reported = {"progress": 0}
+
+        async def report(event: Dict[str, Any]):
+            # 并发分块的完成事件可能乱序写入，只写入更大的进度
+            async with lock:
+                if event["progress"] < reported["progress"]:
+                    return
+                reported["progress"] = event["progress"]
+                detail = {
+                    key: value
+                    for key, value in event.items()
+                    if key not in ("stage", "progress")
+                }
+                await asyncio.to_thread(
+                    self.queue.update_task,
+                    task_id,
+                    {
+                        "stage": event["stage"],
+                        "progress": event["progress"],
+                        "progress_detail": detail,
+                    },
+                )
+
+        return report
+
+    async def _heartbeat(self, task_id: str):
+        """作业执行期间定期续约，防止长时间审核被其他进程重新领取"""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self.queue.renew_lease, task_id)
+
+    @staticmethod
+    async def _wait(stop: asyncio.Event, timeout: float):
+        try:
+            await asyncio.wait_for(stop.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def serve(settings: Dict[str, Any]):
+    """在当前进程运行一个工作进程，收到 SIGTERM / SIGINT 后优雅退出"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    queue = create_task_queue(settings)
+    reviewer = create_reviewer()
+    worker = ReviewWorker(
+        queue,
+        reviewer,
+        f"{socket.gethostname()}-{os.getpid()}",
+        settings["worker_concurrency"],
+        settings["poll_interval_seconds"],
+        settings["lease_seconds"],
+        (
+            LongContextConfig.ADMISSION_CONTROL["priority_slots"]
+            if LongContextConfig.ADMISSION_CONTROL["enabled"]
+            else 0
+        ),
+    )
+    try:
+        await worker.run(stop)
+    finally:
+        await reviewer.aclose()
+        queue.close()
+
+
+def worker_main(settings: Dict[str, Any]):
+    """工作进程入口"""
+    asyncio.run(serve(settings))
+
+
+def start_workers(count: int) -> List[multiprocessing.Process]:
+    """启动 count 个工作进程
+
+    使用 spawn 启动，避免从多线程的 API 进程 fork；工作进程内部还会创建
+    PDF 解析进程池，因此不能是 daemon 进程，需由调用方 stop_workers 回收。
+    """
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=worker_main,
+            args=(LongContextConfig.TASK_QUEUE,),
+            name=f"review-worker-{i}",
+        )
+        for i in range(count)
+    ]
+    for process in processes:
+        process.start()
+    return processes
+
+
+def stop_workers(processes: List[multiprocessing.Process], timeout: float = 30):
+    """发送 SIGTERM 等待进行中的作业完成，超时后强制结束"""
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join(timeout)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="合同审核工作进程")
+    parser.add_argument(
+        "--workers", type=int, default=LongContextConfig.TASK_QUEUE["workers"]
+    )
+    args = parser.parse_args()
+
+    workers = start_workers(args.workers)
+    try:
+        for worker_process in workers:
+            worker_process.join()
+    except KeyboardInterrupt:
+        stop_workers(workers)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+章节检索 - 超出上下文的合同按审核项检索相关章节（哈希向量 + NumPy 余弦 top-k）
+"""
+
+import unicodedata
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from chunk_packer import ChunkPacker
+from contract_processor import LongContextContractProcessor, SectionView
+from deployment_config import LongContextConfig
+
+# 基本多文种平面内的字母数字字符，二元组不跨越空白和标点（平面外字符均视为文字）
+_WORD_CHARS = np.array([chr(c).isalnum() for c in range(0x10000)], dtype=bool)
+
+# 特征 = 前一字符码位 << 21 | 后一字符码位；批内键 = 行号 << 42 | 特征
+_CODE_BITS = np.uint64(21)
+_FEATURE_BITS = np.uint64(42)
+_FEATURE_MASK = np.uint64((1 << 42) - 1)
+# 乘法哈希（64 位黄金分割常数），高位决定桶号，最高位决定符号
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+class HashingEmbedder:
+    """字符二元组哈希向量
+
+    文本经 NFKC 规范化、转小写后取相邻两个字母数字字符为特征（中文即二字
+    词），按 (1 + log tf) × idf 加权，再用带符号哈希投影到 dim 维并做 L2
+    归一化，向量内积近似 TF-IDF 余弦相似度。不依赖预训练模型，计算全部在
+    NumPy 中向量化完成。idf 由 fit 在待检索的文本上统计，未出现过的特征
+    不计入向量。
+    """
+
+    def __init__(self, dim: int = 256, batch_chars: int = 1 << 20):
+        self.dim = dim
+        self.batch_chars = batch_chars
+        self.features = np.empty(0, dtype=np.uint64)
+        self.idf = np.empty(0, dtype=np.float32)
+
+    def fit(self, texts: Sequence[str]) -> "HashingEmbedder":
+        """统计各特征的文档频率，计算 idf"""
+        batch_features, batch_counts = [], []
+        for _, _, _, features, _ in self._batches(texts):
+            # 每批的 (行, 特征) 已去重，特征出现次数即批内文档频率
+            features, counts = np.unique(features, return_counts=True)
+            batch_features.append(features)
+            batch_counts.append(counts)
+        if not batch_features:
+            return self
+        self.features, inverse = np.unique(
+            np.concatenate(batch_features), return_inverse=True
+        )
+        df = np.bincount(inverse, weights=np.concatenate(batch_counts))
+        self.idf = (np.log((1 + len(texts)) / (1 + df)) + 1).astype(np.float32)
+        return self
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        """文本向量，形状 (len(texts), dim)，每行 L2 归一化（无特征的行为零向量）"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for offset, count, rows, features, tf in self._batches(texts):
+            # 按去重后的有序特征查 idf、算哈希，访存连续
+            features, inverse = np.unique(features, return_inverse=True)
+            hashes = features * _HASH_MULTIPLIER
+            buckets = (hashes >> np.uint64(32)) % np.uint64(self.dim)
+            signs = np.where(hashes >> np.uint64(63), -1.0, 1.0)
+            weights = (1 + np.log(tf)) * (self._feature_idf(features) * signs)[inverse]
+            vectors[offset : offset + count] = np.bincount(
+                (rows * np.uint64(self.dim) + buckets[inverse]).astype(np.int64),
+                weights=weights,
+                minlength=count * self.dim,
+            ).reshape(count, self.dim)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+    def _feature_idf(self, features: np.ndarray) -> np.ndarray:
+        if len(self.features) == 0:
+            return np.zeros(len(features))
+        positions = np.minimum(
+            np.searchsorted(self.features, features), len(self.features) - 1
+        )
+        known = self.features[positions] == features
+        return np.where(known, self.idf[positions], 0.0)
+
+    def _batches(
+        self, texts: Sequence[str]
+    ) -> Iterator[Tuple[int, int, np.ndarray, np.ndarray, np.ndarray]]:
+        """按 batch_chars 分批，产出 (起始行, 行数, 行号, 特征, 词频)，(行, 特征) 不重复"""
+        start = 0
+        while start < len(texts):
+            end, chars = start + 1, len(texts[start])
+            while end < len(texts) and chars + len(texts[end]) <= self.batch_chars:
+                chars += len(texts[end])
+                end += 1
+            yield (start, end - start, *self._bigram_counts(texts[start:end]))
+            start = end
+
+    @staticmethod
+    def _bigram_counts(
+        texts: Sequence[str],
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        normalized = [unicodedata.normalize("NFKC", text).lower() for text in texts]
+        # 以 \0 分隔各文本，分隔符不是文字，二元组不会跨越文本
+        codes = np.frombuffer("\0".join(normalized).encode("utf-32-le"), np.uint32)
+        lengths = np.array([len(text) + 1 for text in normalized])
+        rows = np.repeat(np.arange(len(normalized), dtype=np.uint64), lengths)
+        rows = rows[: len(codes)]
+
+        word = np.ones(len(codes), dtype=bool)
+        in_bmp = codes < 0x10000
+        word[in_bmp] = _WORD_CHARS[codes[in_bmp]]
+        pairs = word[:-1] & word[1:]
+        features = (codes[:-1][pairs].astype(np.uint64) << _CODE_BITS) | codes[1:][
+            pairs
+        ]
+        keys, tf = np.unique(
+            (rows[:-1][pairs] << _FEATURE_BITS) | features, return_counts=True
+        )
+        return keys >> _FEATURE_BITS, keys & _FEATURE_MASK, tf
+
+
+class SectionVectorIndex:
+    """归一化向量的余弦 top-k 检索
+
+    向量连续存放在一个 float32 矩阵中，一批查询与每个行块做一次矩阵乘法，
+    用 argpartition 保留各查询当前的前 k 个，内存只与 block_rows 有关。
+    """
+
+    def __init__(self, vectors: np.ndarray, block_rows: int = 65536):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.block_rows = block_rows
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """每个查询的前 k 个 (行号, 相似度)，形状均为 (查询数, k)，按相似度从高到低"""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self.vectors))
+        ids = np.empty((len(queries), 0), dtype=np.int64)
+        scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.vectors), self.block_rows):
+            block = queries @ self.vectors[start : start + self.block_rows].T
+            block_ids = np.broadcast_to(
+                np.arange(start, start + block.shape[1]), block.shape
+            )
+            if block.shape[1] > k:
+                keep = np.argpartition(-block, k - 1, axis=1)[:, :k]
+                block = np.take_along_axis(block, keep, axis=1)
+                block_ids = keep + start
+            # 与之前各块的前 k 个合并
+            scores = np.concatenate([scores, block], axis=1)
+            ids = np.concatenate([ids, block_ids], axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                ids = np.take_along_axis(ids, keep, axis=1)
+
+        order = np.argsort(-scores, axis=1, kind="stable")
+        return np.take_along_axis(ids, order, axis=1), np.take_along_axis(
+            scores, order, axis=1
+        )
+
+
+class SectionRetriever:
+    """按审核项检索超长合同的相关章节
+
+    章节先按 unit_tokens 打包为大小相近的检索单元（合并相邻短章节、拆分
+    超长章节），以单元的哈希向量建立索引；每个查询取相似度不低于
+    min_similarity 的前 units_per_item 个单元，按相似度依次收入直到
+    token_budget，结果按原文顺序排列。
+    """
+
+    def __init__(
+        self,
+        processor: LongContextContractProcessor,
+        token_budget: int,
+        unit_tokens: int = 2000,
+        units_per_item: int = 12,
+        min_similarity: float = 0.1,
+        embedding_dim: int = 256,
+        batch_chars: int = 1 << 20,
+    ):
+        self.processor = processor
+        self.token_budget = token_budget
+        self.unit_tokens = min(unit_tokens, token_budget)
+        self.units_per_item = units_per_item
+        self.min_similarity = min_similarity
+        self.embedding_dim = embedding_dim
+        self.batch_chars = batch_chars
+
+    @classmethod
+    def from_config(
+        cls, processor: LongContextContractProcessor
+    ) -> Optional["SectionRetriever"]:
+        """按 LongContextConfig.RETRIEVAL_REVIEW 创建，预算取处理模型的分块预算；
+        未启用时返回 None"""
+        settings = LongContextConfig.RETRIEVAL_REVIEW
+        if not settings["enabled"]:
+            return None
+        model = LongContextConfig.MODELS.get(
+            processor.model_name, LongContextConfig.MODELS["gpt-4-turbo"]
+        )
+        return cls(
+            processor,
+            model["chunk_token_budget"],
+            settings["unit_tokens"],
+            settings["units_per_item"],
+            settings["min_similarity"],
+            settings["embedding_dim"],
+            settings["batch_chars"],
+        )
+
+    def retrieve(
+        self, sections: List[SectionView], queries: List[str]
+    ) -> List[List[Tuple[SectionView, float]]]:
+        """每个查询选中的 (检索单元, 相似度)，没有相关内容时为空列表"""
+        units = ChunkPacker(self.processor, self.unit_tokens).pack(sections)
+        if not units or not queries:
+            return [[] for _ in queries]
+
+        texts = [f"{unit.title}\n{unit.content}" for unit in units]
+        embedder = HashingEmbedder(self.embedding_dim, self.batch_chars).fit(texts)
+        index = SectionVectorIndex(embedder.embed(texts))
+        del texts
+        ids, scores = index.search(embedder.embed(queries), self.units_per_item)
+
+        selections = []
+        for row_ids, row_scores in zip(ids, scores):
+            selected = []
+            tokens = 0
+            for i, score in zip(row_ids, row_scores):
+                if score < self.min_similarity:
+                    break
+                if tokens + units[i].token_count > self.token_budget:
+                    continue
+                selected.append((int(i), float(score)))
+                tokens += units[i].token_count
+            selected.sort()
+            selections.append([(units[i], score) for i, score in selected])
+        return selections
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+分层总结规划器 - 将部分审核结果按 token 预算分组，供逐层归并总结
+"""
+
+from typing import List, Tuple
+
+from contract_processor import LongContextContractProcessor
+from deployment_config import LongContextConfig
+
+TRUNCATION_NOTICE = "\n（以下内容因长度限制已截断）\n\n"
+
+
+class SummaryReducer:
+    """按 token 预算对待总结内容分组
+
+    每组内容之和不超过 token_budget、组内条数不超过 max_fan_in。单条内容
+    最多占预算的一半（超出部分截断），因此每组至少容纳两条，逐层归并时
+    条数严格减少，层数约为 log(条数)。
+    """
+
+    def __init__(
+        self,
+        processor: LongContextContractProcessor,
+        token_budget: int,
+        max_fan_in: int = 16,
+    ):
+        if max_fan_in < 2:
+            raise ValueError("max_fan_in 至少为 2")
+        self.processor = processor
+        self.token_budget = token_budget
+        self.max_fan_in = max_fan_in
+        self.block_token_limit = token_budget // 2
+
+    @classmethod
+    def from_config(cls, processor: LongContextContractProcessor) -> "SummaryReducer":
+        """使用 LongContextConfig.SUMMARY 配置"""
+        settings = LongContextConfig.SUMMARY
+        return cls(processor, settings["batch_token_budget"], settings["max_fan_in"])
+
+    def plan(self, blocks: List[str]) -> List[List[str]]:
+        """将内容按原顺序分组，只有一组时即可直接生成最终总结"""
+        batches = []
+        current = []
+        current_tokens = 0
+        for block in blocks:
+            block, tokens = self.truncate(block)
+            if current and (
+                current_tokens + tokens > self.token_budget
+                or len(current) >= self.max_fan_in
+            ):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(block)
+            current_tokens += tokens
+        batches.append(current)
+        return batches
+
+    def truncate(self, block: str) -> Tuple[str, int]:
+        """将单条内容截断到 block_token_limit 以内，返回 (内容, token 数)"""
+        encoding = self.processor.encoding
+        tokens = encoding.encode_ordinary(block)
+        if len(tokens) <= self.block_token_limit:
+            return block, len(tokens)
+        notice_tokens = len(encoding.encode_ordinary(TRUNCATION_NOTICE))
+        keep = max(self.block_token_limit - notice_tokens, 0)
+        while True:
+            # 在多字节字符中间截断后重新编码可能多出 token，需要继续缩短
+            truncated = encoding.decode(tokens[:keep]) + TRUNCATION_NOTICE
+            count = self.processor.count_tokens(truncated)
+            if count <= self.block_token_limit or keep == 0:
+                return truncated, count
+            keep -= 1
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+任务状态广播 - 供长轮询和 SSE 接口等待审核进度变化
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Dict, Optional
+
+from task_queue import TaskQueue
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+class _Watch:
+    """单个任务的最新状态和等待者"""
+
+    __slots__ = ("state", "condition", "subscribers")
+
+    def __init__(self):
+        self.state: Optional[Dict[str, Any]] = None
+        self.condition = asyncio.Condition()
+        self.subscribers = 0
+
+    def revision(self) -> int:
+        return -1 if self.state is None else self.state.get("revision", 0)
+
+    def is_terminal(self) -> bool:
+        return self.state is not None and self.state["status"] in TERMINAL_STATUSES
+
+
+class TaskEventBroadcaster:
+    """任务状态变化广播
+
+    每个 API 进程只有一个轮询协程，按 poll_interval 用一次 get_tasks 读取
+    所有被等待任务的状态，revision 变化时唤醒该任务的全部等待者。任务存储
+    的查询量只与被等待的任务数有关，与等待的客户端数无关。
+    """
+
+    def __init__(self, queue: TaskQueue, poll_interval: float = 0.5):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._watches: Dict[str, _Watch] = {}
+        self._poller: Optional[asyncio.Task] = None
+
+    async def wait_for_update(
+        self, task_id: str, since_revision: int, timeout: float
+    ) -> Optional[Dict[str, Any]]:
+        """长轮询：等待 revision 超过 since_revision 或任务结束
+
+        超时返回当前状态，任务不存在返回 None。
+        """
+        watch = await self._subscribe(task_id)
+        try:
+            if watch.state is None:
+                return None
+            async with watch.condition:
+                try:
+                    await asyncio.wait_for(
+                        watch.condition.wait_for(
+                            lambda: (
+                                watch.revision() > since_revision or watch.is_terminal()
+                            )
+                        ),
+                        timeout,
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                return watch.state
+        finally:
+            self._unsubscribe(task_id, watch)
+
+    async def stream(
+        self, task_id: str, since_revision: int = -1, heartbeat: float = 15
+    ) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """依次产出 revision 递增的任务状态，任务结束后停止
+
+        heartbeat 秒内没有变化时产出 None，调用方据此发送保活消息。
+        """
+        watch = await self._subscribe(task_id)
+        try:
+            revision = since_revision
+            while watch.state is not None:
+                async with watch.condition:
+                    try:
+                        await asyncio.wait_for(
+                            watch.condition.wait_for(
+                                lambda: watch.revision() > revision
+                            ),
+                            heartbeat,
+                        )
+                    except asyncio.TimeoutError:
+                        state = None
+                    else:
+                        state = watch.state
+                if state is None:
+                    yield None
+                    continue
+
+                revision = state.get("revision", 0)
+                yield state
+                if state["status"] in TERMINAL_STATUSES:
+                    return
+        finally:
+            self._unsubscribe(task_id, watch)
+
+    async def close(self):
+        if self._poller is not None:
+            self._poller.cancel()
+            try:
+                await self._poller
+            except asyncio.CancelledError:
+                pass
+
+    async def _subscribe(self, task_id: str) -> _Watch:
+        watch = self._watches.get(task_id)
+        if watch is None:
+            watch = self._watches[task_id] = _Watch()
+        watch.subscribers += 1
+
+        if watch.state is None:
+            # 首个等待者直接读取一次，不必等下一轮轮询
+            try:
+                state = await asyncio.to_thread(self.queue.get_task, task_id)
+            except BaseException:
+                self._unsubscribe(task_id, watch)
+                raise
+            if state is not None:
+                await self._publish(watch, state)
+
+        if self._poller is None or self._poller.done():
+            self._poller = asyncio.create_task(self._poll())
+        return watch
+
+    def _unsubscribe(self, task_id: str, watch: _Watch):
+        watch.subscribers -= 1
+        if watch.subscribers == 0 and self._watches.get(task_id) is watch:
+            del self._watches[task_id]
+
+    async def _poll(self):
+        """没有等待者时退出，下次订阅时重新启动"""
+        while self._watches:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                states = await asyncio.to_thread(
+                    self.queue.get_tasks, list(self._watches)
+                )
+            except Exception:
+                # 存储暂时不可用时下一轮重试，等待者继续等待
+                continue
+            for task_id, state in states.items():
+                watch = self._watches.get(task_id)
+                if watch is not None:
+                    await self._publish(watch, state)
+
+    @staticmethod
+    async def _publish(watch: _Watch, state: Dict[str, Any]):
+        if state.get("revision", 0) > watch.revision():
+            async with watch.condition:
+                watch.state = state
+                watch.condition.notify_all()
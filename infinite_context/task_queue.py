@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+审核任务队列 - 任务状态存储和作业队列（SQLite 本地实现 / Redis 实现）
+
+API 进程只负责写入任务和查询状态，审核由 review_worker 的工作进程从队列
+领取执行。作业领取后带有租约，工作进程异常退出时租约过期，作业重新入队。
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from deployment_config import LongContextConfig
+
+try:
+    import redis
+except ImportError:  # 仅使用 SQLite 后端时不需要安装 redis
+    redis = None
+
+
+class TaskQueue:
+    """任务状态存储 + 作业队列接口
+
+    任务状态是可按字段合并更新的字典，每次更新 revision 加 1（跨进程单调
+    递增，供客户端判断状态是否变化）；作业是 {"task_id", "kind", ...} 字典，
+    同一任务最多有一个作业。作业可带 workflow_id、estimated_tokens（预估
+    token 数，用于准入控制统计未完成负载）和 priority（优先通道，先于普通
+    作业领取）。
+    """
+
+    def create_task(self, task_id: str, state: Dict[str, Any], job: Dict[str, Any]):
+        """保存任务初始状态并将作业入队"""
+        raise NotImplementedError
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """读取任务状态，不存在时返回 None"""
+        raise NotImplementedError
+
+    def get_tasks(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量读取任务状态，不存在的任务不出现在结果中"""
+        raise NotImplementedError
+
+    def update_task(self, task_id: str, fields: Dict[str, Any]):
+        """合并更新任务状态字段"""
+        raise NotImplementedError
+
+    def claim_job(
+        self, worker_id: str, priority_only: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        """领取作业并加租约（优先作业在前，同级按入队顺序），队列为空时返回 None
+
+        priority_only 为 True 时只领取优先作业。
+        """
+        raise NotImplementedError
+
+    def renew_lease(self, task_id: str):
+        """延长作业租约（工作进程定期调用）"""
+        raise NotImplementedError
+
+    def finish_job(self, task_id: str):
+        """作业完成（成功或失败），从队列中移除"""
+        raise NotImplementedError
+
+    def requeue_expired(self) -> int:
+        """将租约过期的作业重新入队，超过最大尝试次数的标记为失败"""
+        raise NotImplementedError
+
+    def queue_depth(self) -> int:
+        """等待领取的作业数"""
+        raise NotImplementedError
+
+    def pending_load(self) -> Dict[str, Dict[str, int]]:
+        """未完成（排队中和执行中）作业按 workflow_id 统计的 {"jobs", "tokens"}
+
+        没有 workflow_id 的作业（如预处理）记在空字符串下。
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _fail_abandoned(self, task_id: str, attempts: int):
+        self.update_task(
+            task_id,
+            {
+                "status": "failed",
+                "error": f"工作进程 {attempts} 次未能完成任务",
+                "failed_at": datetime.now().isoformat(),
+            },
+        )
+
+
+class SQLiteTaskQueue(TaskQueue):
+    """基于 SQLite 的任务队列，适用于单机多进程部署"""
+
+    def __init__(self, db_path: str, lease_seconds: float = 300, max_attempts: int = 3):
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                task_id TEXT PRIMARY KEY,
+                job TEXT NOT NULL,
+                enqueued_at REAL NOT NULL,
+                claimed_by TEXT,
+                lease_until REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                workflow_id TEXT NOT NULL DEFAULT '',
+                estimated_tokens INTEGER NOT NULL DEFAULT 0,
+                priority INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        # 兼容没有准入控制相关列的旧队列库
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (
+            ("workflow_id", "TEXT NOT NULL DEFAULT ''"),
+            ("estimated_tokens", "INTEGER NOT NULL DEFAULT 0"),
+            ("priority", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_priority_queue "
+            "ON jobs(claimed_by, priority, enqueued_at)"
+        )
+
+    def create_task(self, task_id: str, state: Dict[str, Any], job: Dict[str, Any]):
+        now = time.time()
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "INSERT INTO tasks (task_id, state, updated_at) VALUES (?, ?, ?)",
+                (task_id, json.dumps(dict(state, revision=0), ensure_ascii=False), now),
+            )
+            self._conn.execute(
+                "INSERT INTO jobs (task_id, job, enqueued_at, workflow_id, "
+                "estimated_tokens, priority) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    task_id,
+                    json.dumps(job, ensure_ascii=False),
+                    now,
+                    job.get("workflow_id") or "",
+                    job.get("estimated_tokens", 0),
+                    int(bool(job.get("priority"))),
+                ),
+            )
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT state FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_tasks(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not task_ids:
+            return {}
+        placeholders = ",".join("?" * len(task_ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT task_id, state FROM tasks WHERE task_id IN ({placeholders})",
+                task_ids,
+            ).fetchall()
+        return {task_id: json.loads(state) for task_id, state in rows}
+
+    def update_task(self, task_id: str, fields: Dict[str, Any]):
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                "SELECT state FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if row is None:
+                return
+            state = json.loads(row[0])
+            state.update(fields)
+            state["revision"] = state.get("revision", 0) + 1
+            self._conn.execute(
+                "UPDATE tasks SET state = ?, updated_at = ? WHERE task_id = ?",
+                (json.dumps(state, ensure_ascii=False), time.time(), task_id),
+            )
+
+    def claim_job(
+        self, worker_id: str, priority_only: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        condition = " AND priority > 0" if priority_only else ""
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                f"SELECT task_id, job FROM jobs WHERE claimed_by IS NULL{condition} "
+                "ORDER BY priority DESC, enqueued_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE jobs SET claimed_by = ?, lease_until = ?, "
+                "attempts = attempts + 1 WHERE task_id = ?",
+                (worker_id, time.time() + self.lease_seconds, row[0]),
+            )
+        return json.loads(row[1])
+
+    def renew_lease(self, task_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE task_id = ?",
+                (time.time() + self.lease_seconds, task_id),
+            )
+
+    def finish_job(self, task_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE task_id = ?", (task_id,))
+
+    def requeue_expired(self) -> int:
+        with self._lock, self._transaction():
+            expired = self._conn.execute(
+                "SELECT task_id, attempts FROM jobs "
+                "WHERE claimed_by IS NOT NULL AND lease_until < ?",
+                (time.time(),),
+            ).fetchall()
+            retry = [
+                (task_id,)
+                for task_id, attempts in expired
+                if attempts < self.max_attempts
+            ]
+            abandoned = [row for row in expired if row[1] >= self.max_attempts]
+            self._conn.executemany(
+                "UPDATE jobs SET claimed_by = NULL, lease_until = NULL WHERE task_id = ?",
+                retry,
+            )
+            self._conn.executemany(
+                "DELETE FROM jobs WHERE task_id = ?",
+                [(task_id,) for task_id, _ in abandoned],
+            )
+        for task_id, attempts in abandoned:
+            self._fail_abandoned(task_id, attempts)
+        return len(retry)
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE claimed_by IS NULL"
+            ).fetchone()
+        return row[0]
+
+    def pending_load(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT workflow_id, COUNT(*), SUM(estimated_tokens) FROM jobs "
+                "GROUP BY workflow_id"
+            ).fetchall()
+        return {
+            workflow_id: {"jobs": jobs, "tokens": tokens or 0}
+            for workflow_id, jobs, tokens in rows
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """写事务：BEGIN IMMEDIATE 保证多进程领取作业时互斥"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+
+# 原子地弹出作业并登记租约，避免领取与登记之间进程退出导致作业丢失；
+# 先取优先队列，ARGV[2] 为 "1" 时只取优先队列
+_CLAIM_SCRIPT = """
+local task_id = redis.call('RPOP', KEYS[1])
+if not task_id and ARGV[2] ~= '1' then
+    task_id = redis.call('RPOP', KEYS[2])
+end
+if not task_id then
+    return nil
+end
+redis.call('ZADD', KEYS[3], ARGV[1], task_id)
+redis.call('HINCRBY', KEYS[4], task_id, 1)
+return {task_id, redis.call('HGET', KEYS[5], task_id)}
+"""
+
+# 移除作业并扣减未完成负载；只有实际删除作业的调用才扣减，重复调用无副作用
+_FINISH_SCRIPT = """
+redis.call('ZREM', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], ARGV[1])
+if redis.call('HDEL', KEYS[3], ARGV[1]) == 1 then
+    redis.call('HINCRBY', KEYS[4], 'jobs:' .. ARGV[2], -1)
+    redis.call('HINCRBY', KEYS[4], 'tokens:' .. ARGV[2], -tonumber(ARGV[3]))
+end
+"""
+
+
+class RedisTaskQueue(TaskQueue):
+    """基于 Redis 的任务队列，适用于多主机部署
+
+    键（均带 key_prefix）：
+    - task:<id>  任务状态哈希，字段值为 JSON
+    - queue      等待领取的 task_id 列表
+    - priority_queue  等待领取的优先作业 task_id 列表
+    - leases     已领取作业的租约到期时间（有序集合）
+    - attempts   作业尝试次数
+    - jobs       作业内容
+    - load       未完成作业按工作流的计数（jobs:<workflow_id>、tokens:<workflow_id>）
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key_prefix: str = "contract_review:",
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        task_ttl_seconds: int = 7 * 24 * 3600,
+    ):
+        if redis is None:
+            raise ImportError("使用 Redis 任务队列需要安装 redis: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = key_prefix
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.task_ttl_seconds = task_ttl_seconds
+        self._claim = self.client.register_script(_CLAIM_SCRIPT)
+        self._finish = self.client.register_script(_FINISH_SCRIPT)
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def create_task(self, task_id: str, state: Dict[str, Any], job: Dict[str, Any]):
+        pipe = self.client.pipeline()
+        task_key = self._key(f"task:{task_id}")
+        pipe.hset(task_key, mapping=self._encode(dict(state, revision=0)))
+        pipe.expire(task_key, self.task_ttl_seconds)
+        pipe.hset(self._key("jobs"), task_id, json.dumps(job, ensure_ascii=False))
+        workflow_id = job.get("workflow_id") or ""
+        pipe.hincrby(self._key("load"), f"jobs:{workflow_id}", 1)
+        pipe.hincrby(
+            self._key("load"), f"tokens:{workflow_id}", job.get("estimated_tokens", 0)
+        )
+        pipe.lpush(self._queue_key(job), task_id)
+        pipe.execute()
+
+    def get_task(self, task_id: str) -> Optional[Dict[str, Any]]:
+        return self._decode(self.client.hgetall(self._key(f"task:{task_id}")))
+
+    def get_tasks(self, task_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        pipe = self.client.pipeline()
+        for task_id in task_ids:
+            pipe.hgetall(self._key(f"task:{task_id}"))
+        states = {}
+        for task_id, fields in zip(task_ids, pipe.execute()):
+            state = self._decode(fields)
+            if state is not None:
+                states[task_id] = state
+        return states
+
+    def update_task(self, task_id: str, fields: Dict[str, Any]):
+        task_key = self._key(f"task:{task_id}")
+        # 任务不存在时不创建（与 SQLite 实现一致）
+        if self.client.exists(task_key):
+            pipe = self.client.pipeline()
+            pipe.hset(task_key, mapping=self._encode(fields))
+            pipe.hincrby(task_key, "revision", 1)
+            pipe.execute()
+
+    def claim_job(
+        self, worker_id: str, priority_only: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        claimed = self._claim(
+            keys=[
+                self._key("priority_queue"),
+                self._key("queue"),
+                self._key("leases"),
+                self._key("attempts"),
+                self._key("jobs"),
+            ],
+            args=[time.time() + self.lease_seconds, "1" if priority_only else "0"],
+        )
+        if not claimed or claimed[1] is None:
+            return None
+        return json.loads(claimed[1])
+
+    def renew_lease(self, task_id: str):
+        self.client.zadd(
+            self._key("leases"), {task_id: time.time() + self.lease_seconds}, xx=True
+        )
+
+    def finish_job(self, task_id: str):
+        job = self._get_job(task_id) or {}
+        self._finish(
+            keys=[
+                self._key("leases"),
+                self._key("attempts"),
+                self._key("jobs"),
+                self._key("load"),
+            ],
+            args=[
+                task_id,
+                job.get("workflow_id") or "",
+                job.get("estimated_tokens", 0),
+            ],
+        )
+
+    def requeue_expired(self) -> int:
+        requeued = 0
+        leases = self._key("leases")
+        for task_id in self.client.zrangebyscore(leases, "-inf", time.time()):
+            # ZREM 成功的进程负责处理该作业，避免多个工作进程重复入队
+            if not self.client.zrem(leases, task_id):
+                continue
+            attempts = int(self.client.hget(self._key("attempts"), task_id) or 0)
+            if attempts >= self.max_attempts:
+                self.finish_job(task_id.decode())
+                self._fail_abandoned(task_id.decode(), attempts)
+                continue
+            # 重新入队到队首，优先重试
+            self.client.rpush(
+                self._queue_key(self._get_job(task_id.decode()) or {}), task_id
+            )
+            requeued += 1
+        return requeued
+
+    def queue_depth(self) -> int:
+        pipe = self.client.pipeline()
+        pipe.llen(self._key("queue"))
+        pipe.llen(self._key("priority_queue"))
+        return sum(pipe.execute())
+
+    def pending_load(self) -> Dict[str, Dict[str, int]]:
+        load: Dict[str, Dict[str, int]] = {}
+        for field, value in self.client.hgetall(self._key("load")).items():
+            metric, workflow_id = field.decode().split(":", 1)
+            load.setdefault(workflow_id, {"jobs": 0, "tokens": 0})[metric] = int(value)
+        return {
+            workflow_id: counts
+            for workflow_id, counts in load.items()
+            if counts["jobs"] > 0
+        }
+
+    def _queue_key(self, job: Dict[str, Any]) -> str:
+        return self._key("priority_queue" if job.get("priority") else "queue")
+
+    def _get_job(self, task_id: str) -> Optional[Dict[str, Any]]:
+        job = self.client.hget(self._key("jobs"), task_id)
+        return json.loads(job) if job else None
+
+    def close(self):
+        self.client.close()
+
+    @staticmethod
+    def _decode(fields: Dict[bytes, bytes]) -> Optional[Dict[str, Any]]:
+        if not fields:
+            return None
+        return {key.decode(): json.loads(value) for key, value in fields.items()}
+
+    @staticmethod
+    def _encode(fields: Dict[str, Any]) -> Dict[str, str]:
+        return {
+            key: json.dumps(value, ensure_ascii=False) for key, value in fields.items()
+        }
+
+
+def create_task_queue(settings: Optional[Dict[str, Any]] = None) -> TaskQueue:
+    """按 LongContextConfig.TASK_QUEUE 创建任务队列"""
+    settings = settings or LongContextConfig.TASK_QUEUE
+    if settings["backend"] == "redis":
+        return RedisTaskQueue(
+            settings["redis_url"],
+            settings["key_prefix"],
+            settings["lease_seconds"],
+            settings["max_attempts"],
+        )
+    if settings["backend"] == "sqlite":
+        return SQLiteTaskQueue(
+            settings["sqlite_path"], settings["lease_seconds"], settings["max_attempts"]
+        )
+    raise ValueError(f"不支持的任务队列后端: {settings['backend']}")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+分层 token 估算器 - 抽样精确编码并按文件格式、文字类型外推
+"""
+
+import os
+import re
+import zipfile
+from typing import Any, Dict, List, Optional
+from xml.sax.saxutils import unescape
+
+import tiktoken
+import PyPDF2
+
+from contract_processor import docx_main_part, iter_docx_paragraphs
+from deployment_config import LongContextConfig
+
+# 中日韩文字（含全角标点）
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+# DOCX 主文档 XML 片段中的文本节点、制表符、换行和段落结束
+_DOCX_TEXT_PATTERN = re.compile(
+    r"<w:t(?:\s[^>]*)?>([^<]*)</w:t>|<w:(p?tab)\b[^>]*/>|<w:(?:cr|br)\b[^>]*/>|</w:p>"
+)
+
+
+def detect_script(text: str) -> str:
+    """根据中日韩字符占比判断文字类型：cjk / latin / mixed"""
+    visible = sum(1 for ch in text if not ch.isspace())
+    if visible == 0:
+        return "mixed"
+    ratio = len(_CJK_PATTERN.findall(text)) / visible
+    if ratio >= 0.6:
+        return "cjk"
+    if ratio <= 0.1:
+        return "latin"
+    return "mixed"
+
+
+class TokenEstimator:
+    """分层 token 估算器
+
+    - exact: 小文件直接完整编码
+    - sampled: 抽取若干页 / 文本块精确编码，再按页数、字节数或字符数外推
+    - ratio: 无法解析时按各格式、各文字类型校准的字节/token 比例估算
+      （解析失败时 parse_error 为原因）
+    - error: 文件不存在或无法读取，estimated_tokens 为 0，error 为原因
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None):
+        self.settings = settings or LongContextConfig.TOKEN_ESTIMATION
+        self.encoding = tiktoken.encoding_for_model("gpt-4")
+
+    def count_tokens(self, text: str) -> int:
+        """精确计算token数量"""
+        return len(self.encoding.encode_ordinary(text))
+
+    def estimate_files(self, file_paths: List[str]) -> List[Dict[str, Any]]:
+        """批量估算文件 token 数，结果与 file_paths 一一对应（无法读取的文件标为 error）"""
+        results = []
+        for file_path in file_paths:
+            try:
+                results.append(self.estimate_file(file_path))
+            except FileNotFoundError:
+                results.append(self._error_result(file_path, "文件不存在"))
+            except OSError as e:
+                results.append(self._error_result(file_path, f"无法读取文件: {e}"))
+        return results
+
+    def estimate_file(self, file_path: str) -> Dict[str, Any]:
+        """估算单个文件的 token 数"""
+        extension = os.path.splitext(file_path)[1].lower()
+        try:
+            if extension == ".pdf":
+                return self._estimate_pdf(file_path)
+            if extension == ".docx":
+                return self._estimate_docx(file_path)
+            if extension == ".txt":
+                return self._estimate_text_file(file_path)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            # 解析失败时退回比例估算，并在结果中注明原因
+            result = self._estimate_by_ratio(file_path, extension)
+            result["parse_error"] = str(e)
+            return result
+        return self._estimate_by_ratio(file_path, extension)
+
+    def _estimate_text_file(self, file_path: str) -> Dict[str, Any]:
+        file_size = os.path.getsize(file_path)
+        chunk_bytes = self.settings["sample_chunk_bytes"]
+        chunk_count = self.settings["sample_chunks"]
+
+        if file_size <= self.settings["exact_threshold_bytes"]:
+            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
+                text = f.read()
+            return self._result(
+                file_path, self.count_tokens(text), "exact", detect_script(text)
+            )
+
+        # 均匀抽取若干字节块，块边界处被截断的多字节字符直接丢弃
+        samples = []
+        with open(file_path, "rb") as f:
+            for offset in self._sample_offsets(file_size, chunk_bytes, chunk_count):
+                f.seek(offset)
+                samples.append(f.read(chunk_bytes).decode("utf-8", errors="ignore"))
+
+        sampled_tokens = sum(self.count_tokens(sample) for sample in samples)
+        sampled_bytes = sum(len(sample.encode("utf-8")) for sample in samples)
+        if sampled_bytes == 0:
+            return self._estimate_by_ratio(file_path, ".txt")
+        return self._result(
+            file_path,
+            round(file_size * sampled_tokens / sampled_bytes),
+            "sampled",
+            detect_script("".join(samples)),
+        )
+
+    def _estimate_pdf(self, file_path: str) -> Dict[str, Any]:
+        with open(file_path, "rb") as file:
+            reader = PyPDF2.PdfReader(file)
+            page_count = len(reader.pages)
+            if page_count == 0:
+                return self._result(file_path, 0, "exact", "mixed")
+
+            sample_pages = self.settings["sample_pages"]
+            if page_count <= sample_pages:
+                page_indexes = list(range(page_count))
+            else:
+                page_indexes = self._sample_offsets(page_count, 1, sample_pages)
+            texts = [reader.pages[i].extract_text() + "\n" for i in page_indexes]
+
+        sampled_tokens = sum(self.count_tokens(text) for text in texts)
+        method = "exact" if len(page_indexes) == page_count else "sampled"
+        return self._result(
+            file_path,
+            round(page_count * sampled_tokens / len(page_indexes)),
+            method,
+            detect_script("".join(texts)),
+        )
+
+    def _estimate_docx(self, file_path: str) -> Dict[str, Any]:
+        """与文本文件相同的抽样方式：在主文档 XML 中均匀抽取若干字节块，
+        只解压不解析整个文档，按 XML 大小外推（表格内文字也会计入）"""
+        chunk_bytes = self.settings["sample_chunk_bytes"]
+        chunk_count = self.settings["sample_chunks"]
+        with zipfile.ZipFile(file_path) as archive:
+            part_name = docx_main_part(archive)
+            part_size = archive.getinfo(part_name).file_size
+            if part_size <= self.settings["exact_threshold_bytes"]:
+                text = "\n".join(iter_docx_paragraphs(file_path))
+                return self._result(
+                    file_path, self.count_tokens(text), "exact", detect_script(text)
+                )
+
+            samples = []
+            sampled_bytes = 0
+            with archive.open(part_name) as part:
+                for offset in self._sample_offsets(part_size, chunk_bytes, chunk_count):
+                    part.seek(offset)
+                    window = part.read(chunk_bytes)
+                    sampled_bytes += len(window)
+                    samples.append(
+                        self._docx_window_text(window.decode("utf-8", errors="ignore"))
+                    )
+
+        if sampled_bytes == 0:
+            return self._estimate_by_ratio(file_path, ".docx")
+        sampled_tokens = sum(self.count_tokens(sample) for sample in samples)
+        return self._result(
+            file_path,
+            round(part_size * sampled_tokens / sampled_bytes),
+            "sampled",
+            detect_script("".join(samples)),
+        )
+
+    @staticmethod
+    def _docx_window_text(xml: str) -> str:
+        """XML 片段中的正文文本（两端被截断的节点丢弃）"""
+        parts = []
+        for match in _DOCX_TEXT_PATTERN.finditer(xml):
+            if match.group(1) is not None:
+                parts.append(unescape(match.group(1), {"&quot;": '"', "&apos;": "'"}))
+            elif match.group(2) is not None:
+                parts.append("\t")
+            else:
+                parts.append("\n")
+        return "".join(parts)
+
+    def _estimate_by_ratio(self, file_path: str, extension: str) -> Dict[str, Any]:
+        file_size = os.path.getsize(file_path)
+        ratios = self.settings["bytes_per_token"].get(
+            extension, self.settings["bytes_per_token"][".txt"]
+        )
+
+        # 纯文本可从文件头判断文字类型，二进制格式按混合文字处理
+        script = "mixed"
+        if extension == ".txt":
+            with open(file_path, "rb") as f:
+                head = f.read(self.settings["sample_chunk_bytes"])
+            script = detect_script(head.decode("utf-8", errors="ignore"))
+
+        return self._result(
+            file_path, round(file_size / ratios[script]), "ratio", script
+        )
+
+    @staticmethod
+    def _sample_offsets(total: int, window: int, count: int) -> List[int]:
+        """在 [0, total - window] 内均匀取 count 个起始位置"""
+        last = max(total - window, 0)
+        if count <= 1 or last == 0:
+            return [0]
+        return sorted({round(i * last / (count - 1)) for i in range(count)})
+
+    @staticmethod
+    def _error_result(file_path: str, error: str) -> Dict[str, Any]:
+        return {
+            "file_path": file_path,
+            "estimated_tokens": 0,
+            "method": "error",
+            "script": None,
+            "error": error,
+        }
+
+    @staticmethod
+    def _result(
+        file_path: str, estimated_tokens: int, method: str, script: str
+    ) -> Dict[str, Any]:
+        return {
+            "file_path": file_path,
+            "estimated_tokens": estimated_tokens,
+            "method": method,
+            "script": script,
+        }